@@ -0,0 +1,87 @@
+"""
+Aho-Corasick多模式匹配自动机
+"""
+
+from collections import deque
+
+
+class AhoCorasick(object):
+    """
+    多模式匹配自动机，构建后只读，可在多线程间共享；匹配耗时与文本长度及匹配数成正比，与词数无关
+    """
+
+    def __init__(self, words):
+        """
+        构建自动机
+        :param words: 词列表，忽略空词和重复词
+        """
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._size = 0
+
+        for word in set(w for w in words if w):
+            node = 0
+            for ch in word:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[node][ch] = next_node
+                node = next_node
+
+            self._out[node] = (len(word),)
+            self._size += 1
+
+        # 按层构建失败指针，并将失败指针上的输出合并到当前结点
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, next_node in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                self._fail[next_node] = self._goto[fail].get(ch, 0)
+                self._out[next_node] += self._out[self._fail[next_node]]
+                queue.append(next_node)
+
+    def __len__(self):
+        return self._size
+
+    def iter_matches(self, text):
+        """
+        按结束位置顺序逐个产出匹配
+        :param text: 文本
+        :return: (起始位置, 结束位置（不含）, 词)生成器
+        """
+
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            for length in out[node]:
+                yield i + 1 - length, i + 1, text[i + 1 - length:i + 1]
+
+    def find_all(self, text):
+        """
+        查找全部匹配，包括相互重叠的匹配
+        :param text: 文本
+        :return: [(起始位置, 结束位置（不含）, 词)]
+        """
+        return list(self.iter_matches(text))
+
+    def search(self, text):
+        """
+        查找第一个匹配
+        :param text: 文本
+        :return: (起始位置, 结束位置（不含）, 词) 或 None
+        """
+        return next(self.iter_matches(text), None)
@@ -0,0 +1,60 @@
+"""
+布隆过滤器
+"""
+
+import hashlib
+import math
+import threading
+
+
+class BloomFilter(object):
+    """
+    布隆过滤器，判断元素是否可能存在；不存在的判断是确定的
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        初始化，按容量和误判率计算位数与哈希函数个数
+        :param capacity: 预计元素个数
+        :param error_rate: 误判率
+        """
+
+        assert capacity > 0 and 0 < error_rate < 1
+
+        self._size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_num = max(1, int(round(self._size / capacity * math.log(2))))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def _positions(self, item):
+        """
+        计算元素对应的位，使用双重哈希生成k个位置
+        :param item: 元素，字符串
+        :return: 位置迭代器
+        """
+
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self._size for i in range(self._hash_num))
+
+    def add(self, item):
+        """
+        加入元素
+        :param item: 元素，字符串
+        :return:
+        """
+
+        with self._lock:
+            for p in self._positions(item):
+                self._bits[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def __len__(self):
+        return self._count
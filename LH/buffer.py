@@ -0,0 +1,169 @@
+"""
+写缓冲工具集
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PartialFlushError(Exception):
+    """
+    刷新处理程序只写入了部分数据，仅失败的数据放回缓冲区重试
+    """
+
+    def __init__(self, failed):
+        """
+        初始化
+        :param failed: 未写入的{键: 值}
+        """
+
+        super().__init__('%d items failed' % len(failed))
+        self.failed = failed
+
+
+class WriteBehindBuffer(object):
+    """
+    后写缓冲区，按键合并待写入的值，并由后台线程定时批量刷新
+    """
+
+    def __init__(self, flush_handler, interval=1.0, merge=None):
+        """
+        初始化
+        :param flush_handler: 刷新处理程序，参数为{键: 值}字典，部分写入时抛出PartialFlushError
+        :param interval: 刷新间隔，单位秒
+        :param merge: 合并函数，参数为(旧值, 新值)，默认以新值覆盖
+        """
+
+        assert interval > 0
+
+        self._flush_handler = flush_handler
+        self._interval = interval
+        self._merge = merge
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+        # 进程退出时刷新剩余数据
+        atexit.register(self.stop)
+
+    def put(self, key, value):
+        """
+        写入待刷新的值
+        :param key: 键
+        :param value: 值
+        :return:
+        """
+
+        self.put_many({key: value})
+
+    def put_many(self, items):
+        """
+        原子地写入多个待刷新的值，保证在同一次刷新中写入
+        :param items: {键: 值}
+        :return:
+        """
+
+        with self._lock:
+            for key, value in items.items():
+                if self._merge is not None and key in self._pending:
+                    value = self._merge(self._pending[key], value)
+
+                self._pending[key] = value
+
+            # 分叉后的子进程需重新启动线程
+            if self._thread is None or self._pid != os.getpid():
+                self._start()
+
+    def get(self, key, default=None):
+        """
+        获取尚未写入完成的值，包括正在刷新的值
+        :param key: 键
+        :param default: 默认值
+        :return: 待刷新的值 或 default
+        """
+
+        with self._lock:
+            if key in self._flushing and key in self._pending and self._merge is not None:
+                return self._merge(self._flushing[key], self._pending[key])
+
+            return self._pending.get(key, self._flushing.get(key, default))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pending or key in self._flushing
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """
+        立即刷新所有待写入的值，失败的数据会在下次刷新时重试
+        :return: 刷新的条目数
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                items, self._pending = self._pending, {}
+                self._flushing = items
+
+            if not items:
+                return 0
+
+            try:
+                self._flush_handler(items)
+            except Exception as e:
+                # 部分写入时只重试失败的数据，已写入的不能重复写入
+                failed = e.failed if isinstance(e, PartialFlushError) else items
+                logger.exception('write-behind flush failed, %d of %d items requeued', len(failed), len(items))
+
+                # 放回缓冲区，保留期间写入的更新值
+                with self._lock:
+                    self._flushing = {}
+                    for k, v in failed.items():
+                        if k in self._pending:
+                            self._pending[k] = self._merge(v, self._pending[k]) if self._merge else self._pending[k]
+                        else:
+                            self._pending[k] = v
+
+                return len(items) - len(failed)
+
+            with self._lock:
+                self._flushing = {}
+
+            return len(items)
+
+    def stop(self):
+        """
+        停止后台线程并刷新剩余数据
+        :return:
+        """
+
+        self._stopped.set()
+        self.flush()
+
+    def _start(self):
+        """
+        启动后台刷新线程，首次写入时调用以兼容预分叉的WSGI服务器
+        :return:
+        """
+
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='write-behind-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        后台线程主循环
+        :return:
+        """
+
+        while not self._stopped.wait(self._interval):
+            self.flush()
@@ -0,0 +1,92 @@
+"""
+缓存工具集
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    带过期时间的有界LRU缓存，线程安全
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        """
+        初始化
+        :param max_size: 最大条目数
+        :param ttl: 默认过期时间，单位秒
+        """
+
+        assert max_size > 0 and ttl > 0
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        获取缓存值，过期条目视为不存在
+        :param key: 键
+        :param default: 默认值
+        :return: 缓存值 或 default
+        """
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            value, expire_time = item
+            if expire_time <= time.time():
+                # 已过期
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        写入缓存值，超出容量时淘汰最久未使用的条目
+        :param key: 键
+        :param value: 值
+        :param ttl: 过期时间，单位秒，默认使用初始化时的值
+        :return:
+        """
+
+        expire_time = time.time() + (ttl if ttl is not None else self._ttl)
+
+        with self._lock:
+            self._data[key] = (value, expire_time)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        删除缓存值
+        :param key: 键
+        :return: 存在返回真，否则假
+        """
+
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """
+        清空缓存
+        :return:
+        """
+
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
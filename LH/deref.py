@@ -0,0 +1,79 @@
+"""
+批量解引用，类似sql后端的select_related，每个被引用集合只查询一次
+"""
+
+from bson import DBRef
+from mongoengine import ReferenceField, ListField
+from collections import defaultdict
+
+
+def _ref_id(value):
+    """
+    获取未解引用的值对应的ID
+    :param value: DBRef、ID或已加载的文档
+    :return: ID，已加载时返回None
+    """
+
+    if isinstance(value, DBRef):
+        return value.id
+    if hasattr(value, '_data'):
+        return None
+    return value
+
+
+def select_related(docs, *fields, only=None):
+    """
+    批量加载文档列表的引用字段，将结果写回各文档，不标记字段已修改
+    :param docs: 文档列表，可以是不同查询得到的同类文档
+    :param fields: 引用字段名，支持ReferenceField及ListField(ReferenceField)
+    :param only: {被引用的数据模型: 需加载的字段列表}，未指定时加载全部字段
+    :return: 文档列表
+    """
+
+    docs = list(docs)
+    if not docs:
+        return docs
+
+    only = only or {}
+    doc_cls = type(docs[0])
+
+    # 按被引用的数据模型收集ID，同一集合的多个字段合并查询
+    wanted = defaultdict(set)
+    targets = {}
+    for name in fields:
+        field = doc_cls._fields[name]
+        is_list = isinstance(field, ListField)
+        ref_field = field.field if is_list else field
+        assert isinstance(ref_field, ReferenceField), '%s is not a reference field' % name
+
+        target = ref_field.document_type
+        targets[name] = (target, is_list)
+
+        for doc in docs:
+            value = doc._data.get(name)
+            for v in (value or []) if is_list else [value]:
+                ref_id = _ref_id(v) if v is not None else None
+                if ref_id is not None:
+                    wanted[target].add(ref_id)
+
+    loaded = {}
+    for target, ids in wanted.items():
+        queryset = target.objects(pk__in=list(ids))
+        if target in only:
+            queryset = queryset.only(*only[target])
+        loaded[target] = dict((d.pk, d) for d in queryset)
+
+    # 写回_data，避免通过属性赋值标记字段已修改
+    for name, (target, is_list) in targets.items():
+        objects = loaded.get(target, {})
+        for doc in docs:
+            value = doc._data.get(name)
+            if value is None:
+                continue
+
+            if is_list:
+                doc._data[name] = [objects.get(_ref_id(v), v) for v in value]
+            else:
+                doc._data[name] = objects.get(_ref_id(value), value)
+
+    return docs
@@ -0,0 +1,149 @@
+"""
+双写执行器，并发执行mongo与sql后端的写入处理程序；启用发件箱复制时仅同步写入mongo后端
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.db import close_old_connections
+from LH.settings import DUAL_WRITE
+from LH.stats import LatencyStats
+from LH import outbox
+from LH import instrument
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 后端名，与run的参数顺序及返回值顺序一致
+BACKENDS = ('mongo', 'sql')
+
+
+class DualWriteExecutor(object):
+    """
+    在有界线程池中并发执行两个后端的处理程序，每个后端单独计时和超时
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.DUAL_WRITE
+        """
+
+        self._config = config
+        self._executor = ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='dual-write')
+        self._stats = dict((b, LatencyStats()) for b in BACKENDS)
+
+    def _call(self, backend, handler):
+        """
+        在线程池中执行处理程序并记录耗时
+        :param backend: 后端名
+        :param handler: 处理程序
+        :return: 处理程序的返回值
+        """
+
+        start = time.monotonic()
+        ok = False
+
+        # 线程池中的线程各自持有数据库连接，按CONN_MAX_AGE回收
+        if backend == 'sql':
+            close_old_connections()
+
+        try:
+            result = handler()
+            ok = True
+            return result
+        finally:
+            if backend == 'sql':
+                close_old_connections()
+            self._stats[backend].record(time.monotonic() - start, ok)
+
+    def run(self, mongo_handler, sql_handler, failure=None, replay=None):
+        """
+        并发执行两个后端的处理程序
+        :param mongo_handler: mongo后端处理程序，无参数可调用对象
+        :param sql_handler: sql后端处理程序，无参数可调用对象
+        :param failure: 处理程序超时或抛出异常时使用的结果，异常不再向调用方抛出，调用方需检查结果是否为此值
+        :param replay: (变更名, 参数列表) 或返回它的无参数可调用对象，启用发件箱复制时由复制进程在sql后端重放；
+                       参数依赖sql后端数据时使用可调用对象，仅在发件箱模式下mongo写入成功后求值
+        :return: [mongo结果, sql结果]，与顺序执行两个处理程序的结果列表相同
+        """
+
+        if replay is not None and outbox.is_enabled():
+            return self._run_primary(mongo_handler, failure, replay)
+
+        start = time.monotonic()
+        call = instrument.bind(self._call)
+        futures = [self._executor.submit(call, b, h) for b, h in zip(BACKENDS, (mongo_handler, sql_handler))]
+
+        results = []
+        for backend, future in zip(BACKENDS, futures):
+            timeout = max(0, start + self._config['TIMEOUT'][backend] - time.monotonic())
+            try:
+                results.append(future.result(timeout))
+            except TimeoutError:
+                results.append(failure)
+                self._abandon(backend, future)
+            except Exception:
+                logger.exception('%s write failed', backend)
+                results.append(failure)
+
+        return results
+
+    def _abandon(self, backend, future):
+        """
+        放弃超时的写入：尚在排队的取消执行，视为未写入；
+        已开始执行的无法中断，记录其最终结果，便于由对账程序修复
+        :param backend: 后端名
+        :param future: 写入的future
+        :return:
+        """
+
+        if future.cancel():
+            logger.warning('%s write timed out after %ss and was cancelled before running',
+                           backend, self._config['TIMEOUT'][backend])
+            return
+
+        logger.warning('%s write timed out after %ss while running, it may still be applied',
+                       backend, self._config['TIMEOUT'][backend])
+
+        def log_late(f):
+            if f.exception() is None:
+                logger.warning('%s write applied after being reported as timed out: %r', backend, f.result())
+
+        future.add_done_callback(log_late)
+
+    def _run_primary(self, mongo_handler, failure, replay):
+        """
+        同步写入mongo后端并记录变更，sql后端结果视为与mongo后端相同；
+        变更记录与mongo写入不在同一事务中，mongo已写入后记录失败时不再报错，记录日志后由对账程序修复sql后端
+        :param mongo_handler: mongo后端处理程序
+        :param failure: 失败时使用的结果
+        :param replay: (变更名, 参数列表) 或返回它的无参数可调用对象
+        :return: [mongo结果, sql结果]
+        """
+
+        try:
+            result = self._call('mongo', mongo_handler)
+        except Exception:
+            logger.exception('mongo write failed')
+            return [failure, failure]
+
+        if result == failure:
+            return [failure, failure]
+
+        try:
+            outbox.append(*(replay() if callable(replay) else replay))
+        except Exception:
+            logger.exception('outbox append failed after the mongo write, sql needs reconciling')
+
+        return [result, result]
+
+    def get_stats(self):
+        """
+        获取各后端的延迟统计
+        :return: {后端名: 统计字典}
+        """
+        return dict((b, s.snapshot()) for b, s in self._stats.items())
+
+
+# 进程内共享的双写执行器
+dual_write = DualWriteExecutor(DUAL_WRITE)
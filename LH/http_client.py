@@ -0,0 +1,311 @@
+"""
+HTTP客户端，提供连接池、超时、重试与熔断
+"""
+
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, RemoteDisconnected
+from urllib.parse import urlsplit, urlencode
+from LH.stats import LatencyStats
+import queue
+import random
+import socket
+import threading
+import time
+
+
+class HttpClientError(Exception):
+    """
+    HTTP请求失败
+    """
+
+
+class CircuitOpenError(HttpClientError):
+    """
+    熔断器处于打开状态，请求被直接拒绝
+    """
+
+
+class ConnectionPool(object):
+    """
+    单个主机的长连接池
+    """
+
+    def __init__(self, scheme, host, port, max_size, ssl_context=None):
+        """
+        初始化
+        :param scheme: 协议，http或https
+        :param host: 主机
+        :param port: 端口
+        :param max_size: 最大空闲连接数
+        :param ssl_context: https使用的ssl上下文
+        """
+
+        self._scheme = scheme
+        self._host = host
+        self._port = port
+        self._ssl_context = ssl_context
+        self._idle = queue.LifoQueue(max_size)
+
+    def new(self, timeout):
+        """
+        新建一个连接
+        :param timeout: 超时时间，单位秒
+        :return: 连接对象
+        """
+
+        if self._scheme == 'https':
+            return HTTPSConnection(self._host, self._port, timeout=timeout, context=self._ssl_context)
+        return HTTPConnection(self._host, self._port, timeout=timeout)
+
+    def get(self, timeout):
+        """
+        取出一个连接，没有空闲连接时新建
+        :param timeout: 超时时间，单位秒
+        :return: 连接对象
+        """
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self.new(timeout)
+
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+        return conn
+
+    def put(self, conn):
+        """
+        归还连接，连接池已满时关闭
+        :param conn: 连接对象
+        :return:
+        """
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+class CircuitBreaker(object):
+    """
+    熔断器，连续失败达到阈值后打开，冷却后放行一次试探请求
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold, reset_timeout):
+        """
+        初始化
+        :param threshold: 连续失败阈值
+        :param reset_timeout: 打开后的冷却时间，单位秒
+        """
+
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """
+        是否允许请求
+        :return: 允许返回真，否则假
+        """
+
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+                # 冷却结束，放行一次试探请求
+                self._state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HttpClient(object):
+    """
+    带连接池、超时、指数退避重试与熔断的HTTP客户端
+    """
+
+    def __init__(self, config, ssl_context=None):
+        """
+        初始化
+        :param config: 配置，格式同settings.HTTP_CLIENT
+        :param ssl_context: https使用的ssl上下文
+        """
+
+        self._config = config
+        self._ssl_context = ssl_context
+        self._pools = {}
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _endpoint_option(self, endpoint, name):
+        """
+        获取端点配置，未配置时使用默认值
+        :param endpoint: 端点名
+        :param name: 配置项
+        :return: 配置值
+        """
+        return self._config.get('ENDPOINTS', {}).get(endpoint, {}).get(name, self._config[name])
+
+    def _get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(scheme, host, port, self._config['POOL_SIZE'], self._ssl_context)
+            return self._pools[key]
+
+    def _get_breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self._config['BREAKER_THRESHOLD'],
+                                                          self._config['BREAKER_RESET'])
+            return self._breakers[endpoint]
+
+    def _get_stats(self, endpoint):
+        with self._lock:
+            if endpoint not in self._stats:
+                self._stats[endpoint] = LatencyStats()
+            return self._stats[endpoint]
+
+    def request(self, url, data=None, endpoint=None, headers=None):
+        """
+        发送请求，data不为None时使用POST
+        :param url: url
+        :param data: 提交数据，字典、字节串或文件对象
+        :param endpoint: 端点名，用于选择超时/重试配置及统计，默认为主机名
+        :param headers: 附加请求头
+        :return: 响应内容
+        """
+
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise HttpClientError('invalid url: %s' % url)
+
+        endpoint = endpoint or parts.hostname
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        method = 'GET' if data is None else 'POST'
+        headers = dict(headers or {})
+        if isinstance(data, dict):
+            data = urlencode(data).encode()
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        timeout = self._endpoint_option(endpoint, 'TIMEOUT')
+        retries = self._endpoint_option(endpoint, 'RETRIES')
+        breaker = self._get_breaker(endpoint)
+        stats = self._get_stats(endpoint)
+        pool = self._get_pool(parts.scheme, parts.hostname, port)
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                stats.record_rejected()
+                raise CircuitOpenError('circuit open: %s' % endpoint)
+
+            start = time.monotonic()
+            try:
+                body = self._send(pool, method, path, data, headers, timeout)
+            except (HttpClientError, HTTPException, socket.timeout, OSError) as e:
+                stats.record(time.monotonic() - start, False)
+                breaker.record_failure()
+
+                if attempt >= retries:
+                    raise e if isinstance(e, HttpClientError) else HttpClientError(str(e))
+
+                # 指数退避，加入随机抖动
+                attempt += 1
+                time.sleep(random.uniform(0, self._config['BACKOFF'] * (2 ** attempt)))
+                continue
+
+            stats.record(time.monotonic() - start, True)
+            breaker.record_success()
+            return body
+
+    def _send(self, pool, method, path, data, headers, timeout):
+        """
+        通过连接池发送一次请求，5xx响应视为可重试错误；
+        复用的长连接已被服务端关闭时，换用新连接重发一次，不计入重试和熔断
+        :return: 响应内容
+        """
+
+        conn = pool.get(timeout)
+        reused = conn.sock is not None
+
+        while True:
+            # 文件类请求体重发时需从头发送
+            if hasattr(data, 'seek'):
+                data.seek(0)
+
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if not reused:
+                    raise
+
+                conn = pool.new(timeout)
+                reused = False
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+
+        if response.status >= 500:
+            raise HttpClientError('server error %d' % response.status)
+
+        if response.status >= 400:
+            # 客户端错误不重试，也不计入熔断
+            return b''
+
+        return body
+
+    def get_stats(self):
+        """
+        获取各端点的延迟统计
+        :return: {端点名: 统计字典}
+        """
+
+        with self._lock:
+            items = list(self._stats.items())
+
+        result = {}
+        for endpoint, stats in items:
+            result[endpoint] = stats.snapshot()
+            result[endpoint]['circuit'] = self._get_breaker(endpoint).state
+
+        return result
@@ -0,0 +1,75 @@
+"""
+ID分配器，按hi/lo方式从计数器集合批量领取ID段，mongo与sql后端使用同一ID
+"""
+
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument
+from LH.settings import ID_ALLOCATOR
+import os
+import threading
+
+
+class IdAllocator(object):
+    """
+    每个进程每次从计数器集合领取一段连续ID，在段内分配不再访问数据库，线程安全
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.ID_ALLOCATOR
+        """
+
+        self._config = config
+        self._ranges = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _block_size(self, name):
+        return self._config['BLOCK_SIZES'].get(name, self._config['BLOCK_SIZE'])
+
+    def _allocate(self, name, size):
+        """
+        领取一段ID
+        :param name: 序列名
+        :param size: 段大小
+        :return: [段内下一个ID, 段结束ID（不含）]
+        """
+
+        counter = get_db()[self._config['COLLECTION']].find_one_and_update(
+            {'_id': 'id.' + name}, {'$inc': {'seq': size}}, upsert=True, return_document=ReturnDocument.AFTER)
+        return [counter['seq'] - size + 1, counter['seq'] + 1]
+
+    def next_id(self, name):
+        """
+        分配一个ID
+        :param name: 序列名，如user、topic
+        :return: ID
+        """
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork后子进程不能沿用父进程已领取的ID段
+                self._ranges.clear()
+                self._pid = os.getpid()
+
+            current = self._ranges.get(name)
+            if current is None or current[0] >= current[1]:
+                current = self._ranges[name] = self._allocate(name, self._block_size(name))
+
+            current[0] += 1
+            return current[0] - 1
+
+    def seed(self, name, floor):
+        """
+        保证序列不会分配出不大于floor的ID，用于接入已有数据
+        :param name: 序列名
+        :param floor: 已使用的最大ID
+        :return:
+        """
+
+        get_db()[self._config['COLLECTION']].update_one({'_id': 'id.' + name}, {'$max': {'seq': floor}}, upsert=True)
+
+
+# 进程内共享的ID分配器
+id_allocator = IdAllocator(ID_ALLOCATOR)
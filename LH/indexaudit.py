@@ -0,0 +1,82 @@
+"""
+索引审计，登记视图使用的查询形状，通过explain检查是否有索引支持
+"""
+
+# 已登记的查询形状
+_shapes = []
+
+
+class QueryShape(object):
+    """
+    查询形状，使用示例值描述一类查询的过滤条件和排序
+    """
+
+    def __init__(self, document, query, sort=None, name=None):
+        """
+        初始化
+        :param document: mongo数据模型
+        :param query: 过滤条件，原始查询字典，值为示例值
+        :param sort: 排序，[(字段, 方向)]
+        :param name: 形状名，默认由集合名和字段名生成
+        """
+
+        self.document = document
+        self.query = query
+        self.sort = sort
+        self.name = name or '%s(%s)' % (document._get_collection_name(), ', '.join(query))
+
+    def explain(self):
+        """
+        获取查询计划
+        :return: 优胜计划
+        """
+
+        cursor = self.document._get_collection().find(self.query)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+
+        return cursor.explain()['queryPlanner']['winningPlan']
+
+
+def register(document, query, sort=None, name=None):
+    """
+    登记一个查询形状
+    :param document: mongo数据模型
+    :param query: 过滤条件
+    :param sort: 排序
+    :param name: 形状名
+    :return:
+    """
+    _shapes.append(QueryShape(document, query, sort, name))
+
+
+def get_shapes():
+    return list(_shapes)
+
+
+def _walk(plan):
+    """
+    遍历查询计划的各阶段
+    :param plan: 查询计划
+    :return: 阶段生成器
+    """
+
+    yield plan
+    if 'inputStage' in plan:
+        yield from _walk(plan['inputStage'])
+    for p in plan.get('inputStages', []):
+        yield from _walk(p)
+
+
+def audit(shape):
+    """
+    检查查询形状
+    :param shape: QueryShape
+    :return: (是否全表扫描, 阶段名列表, 使用的索引名列表)
+    """
+
+    nodes = list(_walk(shape.explain()))
+    stages = [n['stage'] for n in nodes]
+    indexes = [n['indexName'] for n in nodes if 'indexName' in n]
+
+    return 'COLLSCAN' in stages, stages, indexes
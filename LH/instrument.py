@@ -0,0 +1,169 @@
+"""
+数据库操作计量，按请求统计mongo与sql后端的操作数、字节数与耗时
+
+本模块在settings中创建mongo连接前导入，不能依赖django配置
+"""
+
+from bson import BSON
+from pymongo import monitoring
+from collections import Counter
+import threading
+import time
+
+# 当前线程的计量器
+_local = threading.local()
+
+# 各命令中过滤条件所在的位置
+_FILTERS = {'find': ('filter',), 'count': ('query',), 'distinct': ('query',), 'findAndModify': ('query',),
+            'update': ('updates', 'q'), 'delete': ('deletes', 'q')}
+
+
+class QueryRecorder(object):
+    """
+    单个请求的计量器，请求处理线程与双写、读路由的线程池线程共用，线程安全
+    """
+
+    def __init__(self, measure_bytes=False):
+        """
+        初始化
+        :param measure_bytes: 是否统计mongo命令与回复的字节数，需重新编码BSON，只对抽样的请求开启
+        """
+
+        self.measure_bytes = measure_bytes
+        self.ops = Counter()
+        self.bytes = Counter()
+        self.time = Counter()
+        self.shapes = Counter()
+        self.shape_time = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, backend, shape, size, duration):
+        """
+        记录一次操作
+        :param backend: 后端名
+        :param shape: 查询形状
+        :param size: 字节数
+        :param duration: 耗时，单位秒
+        :return:
+        """
+
+        with self._lock:
+            self.ops[backend] += 1
+            self.bytes[backend] += size
+            self.time[backend] += duration
+            self.shapes[(backend, shape)] += 1
+            self.shape_time[(backend, shape)] += duration
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+def activate(recorder):
+    """
+    设置当前线程的计量器
+    :param recorder: QueryRecorder 或 None
+    :return: 之前的计量器
+    """
+
+    previous = current()
+    _local.recorder = recorder
+    return previous
+
+
+def bind(func):
+    """
+    将当前线程的计量器绑定到函数，用于提交到线程池的任务
+    :param func: 函数
+    :return: 在执行线程中使用同一计量器的函数
+    """
+
+    recorder = current()
+    if recorder is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        previous = activate(recorder)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            activate(previous)
+
+    return wrapper
+
+
+def _mongo_shape(event):
+    """
+    生成mongo命令的查询形状，只保留命令名、集合名和过滤字段名
+    :param event: 命令开始事件
+    :return: 查询形状
+    """
+
+    command = event.command
+    name = event.command_name
+
+    query = command
+    for key in _FILTERS.get(name, ()):
+        query = query.get(key) if isinstance(query, dict) else None
+        if isinstance(query, list):
+            query = query[0] if query else None
+
+    if name == 'aggregate' and command.get('pipeline'):
+        query = command['pipeline'][0].get('$match')
+
+    fields = sorted(query) if isinstance(query, dict) and query is not command else []
+    return '%s %s {%s}' % (name, command.get(name, ''), ', '.join(fields))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    pymongo命令监听器，命令事件在发出命令的线程中同步触发
+    """
+
+    def started(self, event):
+        if current() is None:
+            return
+
+        pending = getattr(_local, 'pending', None)
+        if pending is None:
+            pending = _local.pending = {}
+
+        size = len(BSON.encode(event.command)) if current().measure_bytes else 0
+        pending[event.request_id] = (_mongo_shape(event), size)
+
+    def _finish(self, event, size):
+        recorder = current()
+        pending = getattr(_local, 'pending', {}).pop(event.request_id, None)
+        if recorder is None or pending is None:
+            return
+
+        shape, request_size = pending
+        recorder.record('mongo', shape, request_size + size, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        recorder = current()
+        if recorder is not None:
+            self._finish(event, len(BSON.encode(event.reply)) if recorder.measure_bytes else 0)
+
+    def failed(self, event):
+        self._finish(event, 0)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """
+    django数据库执行包装器，安装到每个连接的execute_wrappers
+    """
+
+    recorder = current()
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    start = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.record('sql', sql[:200], len(sql), time.monotonic() - start)
+
+
+# mongo连接使用的命令监听器
+command_listener = MongoCommandListener()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import autodiscover_modules
+from LH.indexaudit import get_shapes, audit
+
+
+class Command(BaseCommand):
+    """
+    检查已登记的查询形状是否有索引支持，可创建数据模型中声明的索引，存在全表扫描时以非零状态退出
+    """
+
+    help = 'Explain registered query shapes and fail when any of them scans a collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--create', action='store_true',
+                            help='create the indexes declared in meta before checking')
+
+    def handle(self, *args, **options):
+        # 加载各应用的queries模块以登记查询形状
+        autodiscover_modules('queries')
+        shapes = get_shapes()
+
+        if options['create']:
+            documents = []
+            for shape in shapes:
+                if shape.document not in documents:
+                    documents.append(shape.document)
+
+            for document in documents:
+                # 后台创建，不阻塞线上读写
+                document._meta['index_background'] = True
+                document.ensure_indexes()
+                self.stdout.write('ensured indexes on %s' % document._get_collection_name())
+
+        scans = []
+        for shape in shapes:
+            scan, stages, indexes = audit(shape)
+            self.stdout.write('%-6s %s: %s%s' % ('SCAN' if scan else 'ok', shape.name, ' > '.join(stages),
+                                                 ' [%s]' % ', '.join(indexes) if indexes else ''))
+            if scan:
+                scans.append(shape.name)
+
+        if scans:
+            raise CommandError('%d query shapes scan a collection: %s' % (len(scans), ', '.join(scans)))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from forum.models import TopicMongo, CommentMongo
+
+
+class Command(BaseCommand):
+    """
+    为已有评论补写所属主题ID、祖先路径、层级和顶层评论ID，按主题逐层遍历回复
+    """
+
+    help = 'Backfill root, path, depth and thread of existing mongo comments'
+
+    def handle(self, *args, **options):
+        comments = CommentMongo._get_collection()
+        fields = {'_id': 1, 'id': 1}
+        total = 0
+
+        for topic in TopicMongo._get_collection().find({}, {'_id': 1, 'id': 1}):
+            # _id -> (ID, 祖先路径, 顶层评论ID)
+            level = dict((c['_id'], (c['id'], [], c['id'])) for c in comments.find({'topic': topic['_id']}, fields))
+            depth = 0
+            requests = []
+
+            while level:
+                requests.extend(UpdateOne({'_id': _id}, {'$set': {'root': topic['id'], 'path': path, 'depth': depth,
+                                                                  'thread': thread}})
+                                for _id, (comment_id, path, thread) in level.items())
+
+                parents = level
+                level = {}
+                for c in comments.find({'comment': {'$in': list(parents)}}, dict(fields, comment=1)):
+                    parent_id, path, thread = parents[c['comment']]
+                    level[c['_id']] = (c['id'], path + [parent_id], thread)
+                depth += 1
+
+            if requests:
+                comments.bulk_write(requests, ordered=False)
+                total += len(requests)
+
+        self.stdout.write('%d comments backfilled' % total)
@@ -0,0 +1,194 @@
+from django.core.management.base import BaseCommand, CommandError
+from coin.models import MarketMongo
+from LH.ahocorasick import AhoCorasick
+from LH.buffer import WriteBehindBuffer
+from LH.deref import select_related
+from LH.idalloc import IdAllocator
+from LH.instrument import QueryRecorder, activate
+from LH.settings import ID_ALLOCATOR, POST_COUNTER
+from mongoengine.connection import get_db
+from pymongo import UpdateOne
+import operator
+import random
+import threading
+import time
+
+
+class Command(BaseCommand):
+    """
+    性能基准测试，按目标名运行对应的测试
+    """
+
+    help = 'Run micro benchmarks against the configured backends'
+
+    targets = ('ids', 'deref', 'counters', 'sensitive')
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=self.targets, help='benchmark to run')
+        parser.add_argument('--workers', type=int, default=8, help='number of concurrent worker threads')
+        parser.add_argument('--count', type=int, default=10000, help='operations per worker')
+
+    def handle(self, *args, **options):
+        handler = getattr(self, 'bench_%s' % options['target'], None)
+        if handler is None:
+            raise CommandError('unknown benchmark: %s' % options['target'])
+
+        handler(options['workers'], options['count'])
+
+    def _run_workers(self, workers, func):
+        """
+        并发运行worker并计时
+        :param workers: worker数
+        :param func: worker函数，参数为worker序号
+        :return: 耗时，单位秒
+        """
+
+        threads = [threading.Thread(target=func, args=(i,)) for i in range(workers)]
+
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return time.monotonic() - start
+
+    def _report(self, name, ops, elapsed, extra=''):
+        self.stdout.write('%s: %d ops in %.3fs, %.0f ops/s%s' % (name, ops, elapsed, ops / elapsed, extra))
+
+    def bench_ids(self, workers, count):
+        """
+        ID分配吞吐量，对比逐个领取与按段领取，使用独立的序列名，不消耗业务ID；
+        每个工作线程使用独立的分配器，模拟多个进程各自领取ID段
+        """
+
+        for block_size in (1, ID_ALLOCATOR['BLOCK_SIZE']):
+            config = dict(ID_ALLOCATOR, BLOCK_SIZE=block_size, BLOCK_SIZES={})
+            results = [None] * workers
+
+            def worker(i):
+                allocator = IdAllocator(config)
+                results[i] = [allocator.next_id('benchmark') for _ in range(count)]
+
+            elapsed = self._run_workers(workers, worker)
+
+            ids = [x for r in results for x in r]
+            if len(set(ids)) != len(ids):
+                raise CommandError('duplicate ids allocated with block size %d' % block_size)
+
+            self._report('ids (block size %d)' % block_size, len(ids), elapsed,
+                         ', %d round trips' % (workers * -(-count // block_size)))
+
+    def _count_ops(self, func):
+        """
+        统计函数执行期间的mongo查询数，游标续取不计入
+        :param func: 函数
+        :return: (查询数, 耗时，单位秒)
+        """
+
+        recorder = QueryRecorder()
+        previous = activate(recorder)
+        start = time.monotonic()
+        try:
+            func()
+        finally:
+            activate(previous)
+
+        elapsed = time.monotonic() - start
+        queries = sum(n for (backend, shape), n in recorder.shapes.items()
+                      if backend == 'mongo' and not shape.startswith('getMore'))
+        return queries, elapsed
+
+    def bench_deref(self, workers, count):
+        """
+        渲染市场列表时的查询数，对比逐个解引用与批量解引用
+        """
+
+        def lazy():
+            [str(m) for m in MarketMongo.objects.limit(count)]
+
+        def batched():
+            [str(m) for m in select_related(MarketMongo.objects.limit(count), 'base_coin', 'quot_coin', 'exchange')]
+
+        rendered = MarketMongo.objects.limit(count).count(with_limit_and_skip=True)
+        for name, func in (('lazy', lazy), ('select_related', batched)):
+            ops, elapsed = self._count_ops(func)
+            self._report('deref %s' % name, rendered, elapsed, ', %d queries' % ops)
+
+        # 一次列表查询加上coin、exchange两个集合各一次
+        ops, _ = self._count_ops(batched)
+        if rendered and ops > 3:
+            raise CommandError('select_related issued %d queries for %d markets, expected at most 3' % (ops, rendered))
+
+    def bench_counters(self, workers, count):
+        """
+        热点贴子计数写入吞吐量，对比每次点击单独$inc与按贴子合并后批量写入，使用独立的集合
+        """
+
+        collection = get_db()['benchmark_counter']
+        collection.delete_many({})
+        collection.insert_many([{'id': i, 'digg_num': 0} for i in range(10)])
+
+        # 大部分点击集中在一个贴子上
+        def post_of(n):
+            return 0 if n % 10 else n % 100 // 10
+
+        def direct(i):
+            for n in range(count):
+                collection.update_one({'id': post_of(n)}, {'$inc': {'digg_num': 1}})
+
+        def flush(items):
+            collection.bulk_write([UpdateOne({'id': k}, {'$inc': {'digg_num': v}}) for k, v in items.items()],
+                                  ordered=False)
+
+        buffer = WriteBehindBuffer(flush, POST_COUNTER['FLUSH_INTERVAL'], merge=operator.add)
+
+        def buffered(i):
+            for n in range(count):
+                buffer.put(post_of(n), 1)
+
+        for name, worker in (('direct $inc', direct), ('buffered', buffered)):
+            collection.update_many({}, {'$set': {'digg_num': 0}})
+
+            start = time.monotonic()
+            self._run_workers(workers, worker)
+            buffer.flush()
+            elapsed = time.monotonic() - start
+
+            total = sum(d['digg_num'] for d in collection.find({}, {'digg_num': 1}))
+            if total != workers * count:
+                raise CommandError('%s lost updates: %d of %d' % (name, total, workers * count))
+
+            self._report('counters %s' % name, total, elapsed)
+
+        buffer.stop()
+        collection.drop()
+
+    def bench_sensitive(self, workers, count):
+        """
+        敏感词匹配，1万词的词表对1万字的贴子，对比逐词查找与自动机，贴子数为count，最多200篇
+        """
+
+        rnd = random.Random(0)
+
+        def text(length):
+            return ''.join(chr(rnd.randint(0x4e00, 0x4e00 + 2000)) for _ in range(length))
+
+        words = [text(rnd.randint(2, 6)) for _ in range(10000)]
+        posts = [text(10000) for _ in range(min(count, 200))]
+
+        start = time.monotonic()
+        matcher = AhoCorasick(words)
+        self.stdout.write('build: %d words in %.3fs' % (len(matcher), time.monotonic() - start))
+
+        start = time.monotonic()
+        naive = [[w for w in words if p.find(w) >= 0] for p in posts]
+        self._report('sensitive str.find', len(posts), time.monotonic() - start)
+
+        start = time.monotonic()
+        matched = [matcher.find_all(p) for p in posts]
+        self._report('sensitive aho-corasick', len(posts), time.monotonic() - start)
+
+        for expected, found in zip(naive, matched):
+            if set(expected) != set(word for _, _, word in found):
+                raise CommandError('aho-corasick matches differ from str.find')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from account.models import User, UserMongo
+from forum.models import Topic, Comment, TopicMongo, CommentMongo
+from LH.reconcile import ReconcileSpec, Reconciler
+from LH.settings import RECONCILE
+import json
+
+
+class Command(BaseCommand):
+    """
+    校验mongo与sql后端的数据一致性，输出或应用修复
+    """
+
+    help = 'Compare the mongo and sql copies chunk by chunk and emit or apply repairs'
+
+    # 点赞、踩贴由计数器缓冲写入，评论数在发件箱模式下异步写入，只报告不修复
+    specs = [ReconcileSpec('user', UserMongo, User, ['follow_num', 'follower_num', 'topic_num']),
+             ReconcileSpec('topic', TopicMongo, Topic, ['comment_num', 'digg_num', 'diss_num'],
+                           buffered=['comment_num', 'digg_num', 'diss_num']),
+             ReconcileSpec('comment', CommentMongo, Comment, ['digg_num', 'diss_num'],
+                           buffered=['digg_num', 'diss_num'])]
+
+    def add_arguments(self, parser):
+        parser.add_argument('entities', nargs='*', help='entities to check, default all')
+        parser.add_argument('--source', choices=('mongo', 'sql'), default='mongo',
+                            help='backend treated as correct')
+        parser.add_argument('--apply', action='store_true',
+                            help='apply counter repairs to the other backend, buffered counters are only reported')
+        parser.add_argument('--start', type=int, default=0, help='id to start from')
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE['CHUNK_SIZE'])
+        parser.add_argument('--duty-cycle', type=float, default=RECONCILE['DUTY_CYCLE'],
+                            help='max fraction of time spent querying, 1 disables throttling')
+
+    def handle(self, *args, **options):
+        config = dict(RECONCILE, CHUNK_SIZE=options['chunk_size'], DUTY_CYCLE=options['duty_cycle'])
+        specs = [s for s in self.specs if not options['entities'] or s.name in options['entities']]
+
+        for spec in specs:
+            reconciler = Reconciler(spec, config, options['source'])
+            found = applied = 0
+
+            for repair in reconciler.run(options['start']):
+                found += 1
+                if options['apply'] and reconciler.apply(repair):
+                    applied += 1
+                    repair['applied'] = True
+                self.stdout.write(json.dumps(repair))
+
+            self.stderr.write('%s: %d repairs, %d applied' % (spec.name, found, applied))
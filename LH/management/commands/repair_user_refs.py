@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateMany
+from account.models import UserMongo
+from forum.models import TopicMongo, CommentMongo
+
+
+class Command(BaseCommand):
+    """
+    将误存为整型用户ID的用户引用改写为用户文档主键
+    """
+
+    help = 'Rewrite user references stored as integer user ids to user document pks'
+
+    # 含用户引用字段的数据模型
+    documents = (TopicMongo, CommentMongo)
+
+    def handle(self, *args, **options):
+        for document in self.documents:
+            collection = document._get_collection()
+            uids = collection.distinct('user', {'user': {'$type': 'int'}})
+            if not uids:
+                continue
+
+            pks = dict((u['id'], u['_id']) for u in UserMongo._get_collection().find({'id': {'$in': uids}},
+                                                                                   {'_id': 1, 'id': 1}))
+            result = collection.bulk_write([UpdateMany({'user': uid}, {'$set': {'user': pk}})
+                                            for uid, pk in pks.items()], ordered=False)
+            self.stdout.write('%s: %d rewritten, %d users missing' % (collection.name, result.modified_count,
+                                                                    len(uids) - len(pks)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+from LH.outbox import Replicator
+
+
+class Command(BaseCommand):
+    """
+    启动发件箱复制进程，将主后端的变更按序应用到sql后端
+    """
+
+    help = 'Replay outbox changes to the sql backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='sql', help='replication name of the checkpoint')
+        parser.add_argument('--once', action='store_true', help='apply one batch and exit')
+
+    def handle(self, *args, **options):
+        # 加载各应用的replication模块以注册处理程序
+        autodiscover_modules('replication')
+
+        replicator = Replicator(options['name'])
+        if options['once']:
+            self.stdout.write('applied %d changes' % replicator.run_once())
+            return
+
+        self.stdout.write('replicating from seq %d' % replicator.get_checkpoint())
+        replicator.run()
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.module_loading import autodiscover_modules
+from LH.settings import TASK_QUEUE
+from LH.tasks import task_queue
+import multiprocessing
+
+
+class Command(BaseCommand):
+    """
+    启动任务队列worker进程
+    """
+
+    help = 'Run background task queue workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', default=','.join(TASK_QUEUE['QUEUES']),
+                            help='comma separated queue names')
+        parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+
+    def handle(self, *args, **options):
+        # 加载各应用的tasks模块以注册任务
+        autodiscover_modules('tasks')
+
+        queues = [q for q in options['queues'].split(',') if q]
+        connections.close_all()
+
+        workers = []
+        for i in range(options['processes']):
+            p = multiprocessing.Process(target=task_queue.run_worker, args=(queues,), name='task-worker-%d' % i)
+            p.start()
+            workers.append(p)
+
+        self.stdout.write('started %d workers on queues: %s' % (len(workers), ', '.join(queues)))
+
+        for p in workers:
+            p.join()
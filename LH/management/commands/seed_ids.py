@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from pymongo import DESCENDING
+from account.models import User, Follow, UserMongo, FollowMongo
+from coin.models import Coin, Market, Exchange, CoinMongo, MarketMongo, ExchangeMongo
+from forum.models import Topic, Comment, TopicMongo, CommentMongo
+from notify.models import Notify, NotifyMongo
+from LH.idalloc import id_allocator
+
+
+class Command(BaseCommand):
+    """
+    将ID分配器的各序列推进到两个后端已使用的最大ID之后，只写入其中一个后端的数据同样计入
+    """
+
+    help = 'Seed id allocator counters from existing mongo and sql ids'
+
+    # 序列名 -> (mongo数据模型, sql数据模型)
+    sequences = {'user': (UserMongo, User), 'follow': (FollowMongo, Follow), 'topic': (TopicMongo, Topic),
+                 'comment': (CommentMongo, Comment), 'notify': (NotifyMongo, Notify), 'coin': (CoinMongo, Coin),
+                 'market': (MarketMongo, Market), 'exchange': (ExchangeMongo, Exchange)}
+
+    def handle(self, *args, **options):
+        for name, (document, model) in self.sequences.items():
+            son = document._get_collection().find_one({}, {'id': 1}, sort=[('id', DESCENDING)])
+            mongo_max = son.get('id', 0) if son else 0
+            sql_max = model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+            floor = max(mongo_max, sql_max)
+            id_allocator.seed(name, floor)
+            self.stdout.write('%s: %d (mongo %d, sql %d)' % (name, floor, mongo_max, sql_max))
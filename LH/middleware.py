@@ -0,0 +1,84 @@
+"""
+请求级中间件
+"""
+
+from django.db.backends.signals import connection_created
+from LH.instrument import QueryRecorder, activate, sql_wrapper
+from LH.settings import INSTRUMENT
+import logging
+import random
+import time
+
+logger = logging.getLogger('LH.slow_request')
+
+
+def _install_sql_wrapper(sender, connection, **kwargs):
+    """
+    新建数据库连接时安装计量包装器，线程池线程的连接同样生效
+    """
+
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+connection_created.connect(_install_sql_wrapper)
+
+
+class QueryInstrumentMiddleware(object):
+    """
+    统计每个请求的数据库操作，通过Server-Timing响应头返回，并记录慢请求日志
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(measure_bytes=random.random() < INSTRUMENT['BYTES_SAMPLE'])
+        previous = activate(recorder)
+        start = time.monotonic()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            activate(previous)
+
+        elapsed = time.monotonic() - start
+
+        if INSTRUMENT['SERVER_TIMING']:
+            response['Server-Timing'] = self._server_timing(recorder, elapsed)
+
+        ops = sum(recorder.ops.values())
+        if elapsed >= INSTRUMENT['SLOW_REQUEST'] or ops >= INSTRUMENT['SLOW_OPS']:
+            self._log_slow(request, recorder, elapsed, ops)
+
+        return response
+
+    def _server_timing(self, recorder, elapsed):
+        """
+        生成Server-Timing响应头
+        :param recorder: 计量器
+        :param elapsed: 请求总耗时，单位秒
+        :return: 响应头的值
+        """
+
+        metrics = []
+        for backend in sorted(recorder.ops):
+            desc = '%d ops' % recorder.ops[backend]
+            if recorder.measure_bytes:
+                desc += ', %d B' % recorder.bytes[backend]
+            metrics.append('%s;dur=%.1f;desc="%s"' % (backend, recorder.time[backend] * 1000, desc))
+        metrics.append('total;dur=%.1f' % (elapsed * 1000))
+
+        return ', '.join(metrics)
+
+    def _log_slow(self, request, recorder, elapsed, ops):
+        """
+        记录慢请求及其查询形状，按次数排序
+        """
+
+        lines = ['%s %s %.1fms, %d ops' % (request.method, request.path, elapsed * 1000, ops)]
+        for (backend, shape), count in recorder.shapes.most_common(INSTRUMENT['SLOW_SHAPES']):
+            lines.append('  %dx %.1fms %s: %s' % (count, recorder.shape_time[(backend, shape)] * 1000,
+                                                  backend, shape))
+
+        logger.warning('\n'.join(lines))
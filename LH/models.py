@@ -0,0 +1,60 @@
+from django.db import models
+
+
+class ReplicationCheckpoint(models.Model):
+    """
+    复制检查点数据模型，与复制的变更在同一事务中更新，各字段说明如下：
+
+      name: 复制名，字符串
+      seq: 已应用的最大变更序号，整型
+    """
+
+    # 字段声明
+
+    name = models.CharField(max_length=50, primary_key=True)
+    seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'ReplicationCheckpoint'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        """
+        string representation
+        :return:
+        """
+        return '<name: %s, seq: %d>' % (self.name, self.seq)
+
+
+class ReplicationDeadLetter(models.Model):
+    """
+    复制死信数据模型，多次应用失败的变更和等待超时的序号空缺，与检查点在同一事务中写入，各字段说明如下：
+
+      name: 复制名，字符串
+      seq: 变更序号，整型
+      op: 变更名，字符串，序号空缺时为空
+      args: 变更参数，JSON字符串
+      error: 最后一次失败的错误信息，字符串
+      time: 写入时间，日期型
+    """
+
+    # 字段声明
+
+    name = models.CharField(max_length=50)
+    seq = models.BigIntegerField()
+    op = models.CharField(max_length=50, blank=True)
+    args = models.TextField(default='[]')
+    error = models.TextField(blank=True)
+    time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'ReplicationDeadLetter'
+        verbose_name_plural = verbose_name
+        unique_together = ('name', 'seq')
+
+    def __str__(self):
+        """
+        string representation
+        :return:
+        """
+        return '<name: %s, seq: %d, op: %s>' % (self.name, self.seq, self.op)
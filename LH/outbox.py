@@ -0,0 +1,253 @@
+"""
+变更发件箱，主后端同步写入后记录变更，由复制进程按序应用到从后端
+"""
+
+from django.db import transaction
+from mongoengine import *
+from pymongo import ReturnDocument
+from LH.models import ReplicationCheckpoint, ReplicationDeadLetter
+from LH.settings import REPLICATION
+import datetime
+import json
+import logging
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# 变更处理程序注册表，变更名 -> sql后端处理程序
+_handlers = {}
+
+# 复制进程为等待超时的序号空缺占位的变更名，占位后迟到的写入改用新序号
+GAP = ''
+
+
+class OutboxMongo(Document):
+    """
+    发件箱MongoDB数据模型，各字段说明如下：
+
+      seq: 变更序号，整型
+      op: 变更名，字符串，序号空缺的占位为空
+      args: 变更参数，列表
+      attempts: 应用失败次数，整型
+      time: 记录时间，日期型
+    """
+
+    # 字段声明
+
+    seq = IntField(unique=True, required=True)
+    op = StringField(max_length=50)
+    args = ListField(default=[])
+    attempts = IntField(default=0)
+    time = DateTimeField(default=datetime.datetime.utcnow)
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'outbox', 'indexes': ['+seq']}
+
+
+def replicated(op):
+    """
+    注册变更在sql后端的处理程序的装饰器，处理程序需只依赖可序列化的参数
+    :param op: 变更名
+    :return:
+    """
+
+    def decorator(func):
+        _handlers[op] = func
+        return func
+
+    return decorator
+
+
+def is_enabled():
+    """
+    是否启用发件箱复制
+    :return: 启用返回真，否则假
+    """
+    return REPLICATION['MODE'] == 'outbox'
+
+
+def _next_seq():
+    """
+    分配变更序号
+    :return: 序号
+    """
+
+    counter = OutboxMongo._get_db()['counters'].find_one_and_update(
+        {'_id': 'outbox'}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+    return counter['seq']
+
+
+def append(op, args):
+    """
+    记录一次变更
+    :param op: 变更名
+    :param args: 变更参数列表
+    :return: 变更序号
+    """
+
+    while True:
+        seq = _next_seq()
+        try:
+            OutboxMongo(seq=seq, op=op, args=list(args)).save(force_insert=True)
+            return seq
+        except NotUniqueError:
+            # 写入过慢，序号已被复制进程作为空缺占位
+            logger.warning('outbox seq %d taken as gap, reallocating', seq)
+
+
+class Replicator(object):
+    """
+    复制进程，按序号批量应用变更，检查点与变更在同一sql事务中提交，重放不会重复应用
+    """
+
+    def __init__(self, name='sql'):
+        """
+        初始化
+        :param name: 复制名，用于区分检查点
+        """
+        self._name = name
+
+    def get_checkpoint(self):
+        """
+        获取检查点
+        :return: 已应用的最大变更序号
+        """
+
+        checkpoint, _ = ReplicationCheckpoint.objects.get_or_create(name=self._name)
+        return checkpoint.seq
+
+    def _fill_gap(self, start, end):
+        """
+        为等待超时的序号空缺写入占位变更，占位与迟到的写入按序号唯一索引只有一个成功
+        :param start: 空缺的起始序号
+        :param end: 空缺的结束序号，包含
+        :return: 全部占位成功返回真，有写入已到达返回假
+        """
+
+        for seq in range(start, end + 1):
+            try:
+                OutboxMongo(seq=seq, op=GAP).save(force_insert=True)
+            except NotUniqueError:
+                return False
+
+        logger.warning('outbox seq %d-%d missing, recorded as gap', start, end)
+        return True
+
+    def _fetch(self, seq):
+        """
+        获取待应用的变更，遇到序号空缺时等待空缺的写入完成，超时后写入占位变更
+        :param seq: 检查点
+        :return: 变更列表
+        """
+
+        settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=REPLICATION['SETTLE'])
+        entries = list(OutboxMongo.objects(seq__gt=seq).order_by('seq').limit(REPLICATION['BATCH_SIZE']))
+
+        batch = []
+        expected = seq + 1
+        for e in entries:
+            if e.seq != expected and (e.time > settled or not self._fill_gap(expected, e.seq - 1)):
+                # 序号空缺且尚在等待期内，或空缺的写入刚刚到达，下一轮重新获取
+                break
+
+            if e.seq != expected:
+                batch.extend(OutboxMongo(seq=s, op=GAP) for s in range(expected, e.seq))
+
+            batch.append(e)
+            expected = e.seq + 1
+
+        return batch
+
+    def _apply(self, batch, error=None):
+        """
+        在一个sql事务中应用变更并推进检查点，序号空缺和指定错误的变更写入死信
+        :param batch: 变更列表
+        :param error: 错误信息，不为None时不再应用而是全部写入死信
+        :return: 应用的变更数
+        """
+
+        with transaction.atomic():
+            # 锁定检查点，避免多个复制进程同时应用
+            checkpoint = ReplicationCheckpoint.objects.select_for_update().get(name=self._name)
+            batch = [e for e in batch if e.seq > checkpoint.seq]
+
+            for e in batch:
+                if e.op == GAP or error is not None:
+                    ReplicationDeadLetter.objects.create(name=self._name, seq=e.seq, op=e.op,
+                                                         args=json.dumps(e.args, default=str),
+                                                         error=error or 'missing')
+                else:
+                    _handlers[e.op](*e.args)
+
+            if batch:
+                checkpoint.seq = batch[-1].seq
+                checkpoint.save(update_fields=['seq'])
+
+        return len(batch)
+
+    def _record_failure(self, entry):
+        """
+        累加变更的应用失败次数
+        :param entry: 变更
+        :return: 失败次数
+        """
+
+        result = OutboxMongo._get_collection().find_one_and_update(
+            {'seq': entry.seq}, {'$inc': {'attempts': 1}}, projection={'attempts': True},
+            return_document=ReturnDocument.AFTER)
+        return result['attempts'] if result else REPLICATION['MAX_ATTEMPTS']
+
+    def run_once(self):
+        """
+        应用一批变更
+        :return: 应用的变更数
+        """
+
+        batch = self._fetch(self.get_checkpoint())
+        if not batch:
+            return 0
+
+        try:
+            return self._apply(batch)
+        except Exception:
+            logger.exception('outbox batch %d-%d failed, applying one by one', batch[0].seq, batch[-1].seq)
+
+        # 逐条应用找出失败的变更，失败次数达到上限后写入死信，否则停在该变更处下一轮重试
+        applied = 0
+        for e in batch:
+            try:
+                applied += self._apply([e])
+                continue
+            except Exception:
+                error = traceback.format_exc()
+
+            attempts = self._record_failure(e)
+            if attempts < REPLICATION['MAX_ATTEMPTS']:
+                logger.error('outbox seq %d failed %d times', e.seq, attempts)
+                break
+
+            logger.error('outbox seq %d failed %d times, moved to dead letters', e.seq, attempts)
+            applied += self._apply([e], error)
+
+        return applied
+
+    def purge(self):
+        """
+        清理已应用且超过保留时间的变更
+        :return:
+        """
+
+        keep_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=REPLICATION['KEEP'])
+        OutboxMongo.objects(seq__lte=self.get_checkpoint(), time__lt=keep_before).delete()
+
+    def run(self):
+        """
+        复制主循环
+        :return:
+        """
+
+        while True:
+            if not self.run_once():
+                self.purge()
+                time.sleep(REPLICATION['POLL_INTERVAL'])
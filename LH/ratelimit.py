@@ -0,0 +1,70 @@
+"""
+限流工具集
+"""
+
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import datetime
+import time
+
+
+class SharedWindowLimiter(object):
+    """
+    多进程共享的固定窗口限流器，各窗口的计数保存在MongoDB中，由TTL索引清理过期窗口
+    """
+
+    def __init__(self, name, limit, window, collection='rate_limit'):
+        """
+        初始化
+        :param name: 限流器名，用于区分计数
+        :param limit: 每个窗口允许的请求数
+        :param window: 窗口长度，单位秒
+        :param collection: 计数集合名
+        """
+
+        assert limit >= 1 and window > 0
+
+        self._name = name
+        self._limit = limit
+        self._window = window
+        self._collection = collection
+        self._indexed = False
+
+    def _get_collection(self):
+        collection = get_db()[self._collection]
+        if not self._indexed:
+            collection.create_index('expire_time', expireAfterSeconds=0)
+            self._indexed = True
+        return collection
+
+    def allow(self, key):
+        """
+        尝试计入一次请求
+        :param key: 键
+        :return: 允许时返回计数ID，可用于refund；否则None
+        """
+
+        index = int(time.time() // self._window)
+        counter_id = '%s:%s:%d' % (self._name, key, index)
+        expire_time = datetime.datetime.utcfromtimestamp((index + 1) * self._window)
+
+        collection = self._get_collection()
+        update = {'$inc': {'count': 1}, '$setOnInsert': {'expire_time': expire_time}}
+        try:
+            counter = collection.find_one_and_update({'_id': counter_id}, update, upsert=True,
+                                                     return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # 并发upsert同一窗口时其中一个失败，此时文档已存在
+            counter = collection.find_one_and_update({'_id': counter_id}, update,
+                                                     return_document=ReturnDocument.AFTER)
+
+        return counter_id if counter['count'] <= self._limit else None
+
+    def refund(self, counter_id):
+        """
+        退回一次已计入的请求，用于同一请求的其他限制未通过时
+        :param counter_id: allow返回的计数ID
+        :return:
+        """
+        self._get_collection().update_one({'_id': counter_id, 'count': {'$gt': 0}}, {'$inc': {'count': -1}})
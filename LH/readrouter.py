@@ -0,0 +1,184 @@
+"""
+读路由，按健康状况在mongo与sql后端之间选择读取的后端
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.db import close_old_connections
+from LH.cache import LRUCache
+from LH import instrument
+from LH.settings import READ_ROUTER
+from LH.stats import LatencyStats
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 后端名，与run的参数顺序一致
+BACKENDS = ('mongo', 'sql')
+
+# 空结果缓存的占位值
+_MISSING = object()
+
+
+class ReadRouter(object):
+    """
+    根据各后端最近的耗时和错误率选择首选后端，首选后端超过对冲延迟未返回、失败或无数据时向另一后端发出请求，
+    先返回数据的结果生效；双写失败或复制延迟时数据可能只存在于一个后端，两个后端均无数据时才返回并短暂缓存空结果
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.READ_ROUTER
+        """
+
+        self._config = config
+        self._executor = ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='read-router')
+        self._stats = dict((b, LatencyStats(config['WINDOW'])) for b in BACKENDS)
+        self._negative = LRUCache(config['NEGATIVE_CACHE_SIZE'], config['NEGATIVE_TTL'])
+        self._served = dict((b, 0) for b in BACKENDS)
+        self._hedged = 0
+        self._cached = 0
+        self._lock = threading.Lock()
+
+    def _score(self, backend):
+        """
+        计算后端的代价，一次错误按一次超时计
+        :param backend: 后端名
+        :return: 代价，越小越健康
+        """
+
+        latency, error_rate = self._stats[backend].recent()
+        return latency + error_rate * self._config['TIMEOUT']
+
+    def _order(self):
+        """
+        确定后端的尝试顺序
+        :return: 后端名列表
+        """
+
+        order = sorted(BACKENDS, key=self._score)
+
+        # 以小概率先试次选后端，使其健康统计保持更新
+        if random.random() < self._config['PROBE']:
+            order.reverse()
+
+        return order
+
+    def _call(self, backend, handler):
+        """
+        在线程池中执行处理程序并记录耗时
+        :param backend: 后端名
+        :param handler: 处理程序
+        :return: 处理程序的返回值
+        """
+
+        start = time.monotonic()
+        ok = False
+
+        if backend == 'sql':
+            close_old_connections()
+
+        try:
+            result = handler()
+            ok = True
+            return result
+        finally:
+            if backend == 'sql':
+                close_old_connections()
+            self._stats[backend].record(time.monotonic() - start, ok)
+
+    def run(self, key, mongo_handler, sql_handler):
+        """
+        读取数据
+        :param key: 空结果缓存的键，为None时不缓存
+        :param mongo_handler: mongo后端处理程序，无参数可调用对象，无数据时返回None
+        :param sql_handler: sql后端处理程序，无参数可调用对象，无数据时返回None
+        :return: 先返回数据的后端结果，均无数据、失败或超时返回None
+        """
+
+        if key is not None and self._negative.get(key, _MISSING) is None:
+            with self._lock:
+                self._cached += 1
+            return None
+
+        handlers = dict(zip(BACKENDS, (mongo_handler, sql_handler)))
+        standby = self._order()
+        deadline = time.monotonic() + self._config['TIMEOUT']
+
+        # 线程池中的读取计入当前请求
+        call = instrument.bind(self._call)
+
+        backend = standby.pop(0)
+        pending = {self._executor.submit(call, backend, handlers[backend]): backend}
+        empty = []
+
+        while pending:
+            timeout = deadline - time.monotonic()
+            if standby:
+                timeout = min(timeout, self._config['HEDGE_DELAY'])
+
+            done, _ = wait(pending, max(0, timeout), FIRST_COMPLETED)
+            for future in done:
+                backend = pending.pop(future)
+                if future.exception() is not None:
+                    logger.warning('%s read failed: %r', backend, future.exception())
+                elif future.result() is not None:
+                    return self._serve(key, backend, future.result())
+                else:
+                    empty.append(backend)
+
+            if standby:
+                # 首选后端过慢、失败或无数据，对冲到另一后端
+                backend = standby.pop(0)
+                pending[self._executor.submit(call, backend, handlers[backend])] = backend
+                with self._lock:
+                    self._hedged += 1
+            elif time.monotonic() >= deadline:
+                logger.warning('read timed out after %ss', self._config['TIMEOUT'])
+                break
+
+        # 只有两个后端都确认无数据时才缓存空结果
+        if len(empty) == len(BACKENDS):
+            return self._serve(key, empty[-1], None)
+
+        return None
+
+    def _serve(self, key, backend, result):
+        """
+        记录提供结果的后端，缓存空结果
+        :param key: 空结果缓存的键
+        :param backend: 后端名
+        :param result: 结果
+        :return: 结果
+        """
+
+        with self._lock:
+            self._served[backend] += 1
+
+        if result is None and key is not None:
+            self._negative.set(key, None)
+
+        return result
+
+    def get_stats(self):
+        """
+        获取各后端的延迟统计及提供结果的次数
+        :return: 统计字典
+        """
+
+        with self._lock:
+            result = {'hedged': self._hedged, 'negative_cached': self._cached}
+            served = dict(self._served)
+
+        for b, s in self._stats.items():
+            result[b] = s.snapshot()
+            result[b]['served'] = served[b]
+
+        return result
+
+
+# 进程内共享的读路由
+read_router = ReadRouter(READ_ROUTER)
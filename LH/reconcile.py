@@ -0,0 +1,197 @@
+"""
+mongo与sql后端一致性校验，按ID分段比较校验和，仅对不一致的分段逐行比较
+"""
+
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, Sum, F, Min
+import time
+
+
+class ReconcileSpec(object):
+    """
+    一类数据的校验定义
+    """
+
+    def __init__(self, name, document, model, fields, buffered=()):
+        """
+        初始化
+        :param name: 数据名
+        :param document: mongo数据模型
+        :param model: sql数据模型
+        :param fields: 需比较的整型字段，两个后端字段名相同
+        :param buffered: 其中由各进程缓冲或异步写入两个后端的字段，差异可能是尚未写入的增量，只报告不修复
+        """
+
+        self.name = name
+        self.document = document
+        self.model = model
+        self.fields = list(fields)
+        self.buffered = set(buffered)
+
+
+class Reconciler(object):
+    """
+    一致性校验器，分段校验和包括行数、ID和、各字段和及各字段按ID加权的和，均在数据库端计算
+    """
+
+    def __init__(self, spec, config, source='mongo'):
+        """
+        初始化
+        :param spec: ReconcileSpec
+        :param config: 配置，格式同settings.RECONCILE
+        :param source: 以哪个后端为准，mongo或sql
+        """
+
+        assert source in ('mongo', 'sql')
+
+        self._spec = spec
+        self._config = config
+        self._source = source
+        self._collection = spec.document._get_collection()
+
+    def _mongo_checksum(self, lo, hi):
+        group = {'_id': None, 'count': {'$sum': 1}, 'ids': {'$sum': '$id'}}
+        for f in self._spec.fields:
+            group[f] = {'$sum': '$' + f}
+            group[f + '_w'] = {'$sum': {'$multiply': ['$id', {'$ifNull': ['$' + f, 0]}]}}
+
+        result = list(self._collection.aggregate([{'$match': {'id': {'$gte': lo, '$lt': hi}}}, {'$group': group}]))
+        if not result:
+            return self._empty_checksum()
+
+        result[0].pop('_id')
+        return result[0]
+
+    def _sql_checksum(self, lo, hi):
+        aggregates = {'count': Count('id'), 'ids': Sum('id')}
+        for f in self._spec.fields:
+            aggregates[f] = Sum(f)
+            # 加权和超出整型范围，按64位整型计算
+            aggregates[f + '_w'] = Sum(ExpressionWrapper(F('id') * F(f), output_field=BigIntegerField()))
+
+        result = self._spec.model.objects.filter(id__gte=lo, id__lt=hi).aggregate(**aggregates)
+        return dict((k, v or 0) for k, v in result.items())
+
+    def _empty_checksum(self):
+        result = {'count': 0, 'ids': 0}
+        for f in self._spec.fields:
+            result[f] = result[f + '_w'] = 0
+        return result
+
+    def _next_id(self, start):
+        """
+        获取两个后端中不小于start的最小ID，用于跳过空白区间
+        :param start: 起始ID
+        :return: ID 或 None
+        """
+
+        doc = self._collection.find_one({'id': {'$gte': start}}, {'id': 1}, sort=[('id', 1)])
+        row = self._spec.model.objects.filter(id__gte=start).aggregate(min_id=Min('id'))['min_id']
+
+        ids = [i for i in (doc and doc['id'], row) if i is not None]
+        return min(ids) if ids else None
+
+    def _mongo_rows(self, lo, hi):
+        projection = dict((f, 1) for f in ['id'] + self._spec.fields)
+        projection['_id'] = 0
+
+        cursor = self._collection.find({'id': {'$gte': lo, '$lt': hi}}, projection, sort=[('id', 1)],
+                                       batch_size=self._config['BATCH_SIZE'])
+        for doc in cursor:
+            yield doc['id'], dict((f, doc.get(f, 0)) for f in self._spec.fields)
+
+    def _sql_rows(self, lo, hi):
+        rows = self._spec.model.objects.filter(id__gte=lo, id__lt=hi).order_by('id')
+        for row in rows.values_list('id', *self._spec.fields).iterator():
+            yield row[0], dict(zip(self._spec.fields, row[1:]))
+
+    def _diff(self, lo, hi):
+        """
+        按ID顺序归并两个后端的数据流，逐行比较
+        :param lo: 分段起始ID
+        :param hi: 分段结束ID（不含）
+        :return: 修复项生成器
+        """
+
+        streams = {'mongo': self._mongo_rows(lo, hi), 'sql': self._sql_rows(lo, hi)}
+        source, target = streams[self._source], streams['sql' if self._source == 'mongo' else 'mongo']
+        target_name = 'sql' if self._source == 'mongo' else 'mongo'
+
+        s, t = next(source, None), next(target, None)
+        while s is not None or t is not None:
+            if t is None or (s is not None and s[0] < t[0]):
+                yield {'entity': self._spec.name, 'id': s[0], 'op': 'missing', 'backend': target_name}
+                s = next(source, None)
+            elif s is None or t[0] < s[0]:
+                yield {'entity': self._spec.name, 'id': t[0], 'op': 'orphan', 'backend': target_name}
+                t = next(target, None)
+            else:
+                changed = dict((f, v) for f, v in s[1].items() if t[1][f] != v)
+                if changed:
+                    repair = {'entity': self._spec.name, 'id': s[0], 'op': 'update', 'backend': target_name,
+                              'set': changed, 'expected': dict((f, t[1][f]) for f in changed)}
+                    buffered = sorted(self._spec.buffered.intersection(changed))
+                    if buffered:
+                        repair['buffered'] = buffered
+                    yield repair
+                s, t = next(source, None), next(target, None)
+
+    def apply(self, repair):
+        """
+        应用一项修复，只修复计数字段，行缺失或多余需人工处理；
+        按差值累加且要求字段仍为比较时的值，比较之后并发的计数变更不被覆盖，此时跳过该修复；
+        缓冲写入的字段不修复，其差异可能是各进程尚未刷新的增量，修复后刷新会再次累加
+        :param repair: 修复项
+        :return: 已应用返回真，否则假
+        """
+
+        if repair['op'] != 'update':
+            return False
+
+        fields = [f for f in repair['set'] if f not in self._spec.buffered]
+        if not fields:
+            return False
+
+        expected = dict((f, repair['expected'][f]) for f in fields)
+        deltas = dict((f, repair['set'][f] - expected[f]) for f in fields)
+
+        if repair['backend'] == 'sql':
+            updates = dict((f, F(f) + d) for f, d in deltas.items())
+            return self._spec.model.objects.filter(id=repair['id'], **expected).update(**updates) > 0
+
+        # 比较时缺失的字段按0计
+        query = dict((f, v if v else {'$in': [0, None]}) for f, v in expected.items())
+        query['id'] = repair['id']
+        return self._collection.update_one(query, {'$inc': deltas}).modified_count > 0
+
+    def _throttle(self, elapsed):
+        """
+        按占空比休眠，使校验占用的数据库时间不超过DUTY_CYCLE
+        :param elapsed: 本分段耗时，单位秒
+        :return:
+        """
+
+        duty = self._config['DUTY_CYCLE']
+        if duty < 1:
+            time.sleep(elapsed * (1 - duty) / duty)
+
+    def run(self, start=0):
+        """
+        校验全部数据
+        :param start: 起始ID
+        :return: 修复项生成器，每个分段结束后产出该分段的修复项
+        """
+
+        chunk = self._config['CHUNK_SIZE']
+        lo = self._next_id(start)
+
+        while lo is not None:
+            began = time.monotonic()
+            hi = lo + chunk
+
+            mongo, sql = self._mongo_checksum(lo, hi), self._sql_checksum(lo, hi)
+            if mongo != sql:
+                for repair in self._diff(lo, hi):
+                    yield repair
+
+            self._throttle(time.monotonic() - began)
+            lo = self._next_id(hi)
@@ -0,0 +1,357 @@
+"""
+会话存储后端，进程内读缓存 + MongoDB后写持久化
+"""
+
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.sessions.backends.base import SessionBase, CreateError
+from django.utils import timezone
+from mongoengine import *
+from pymongo import ReplaceOne, DeleteOne
+from pymongo.errors import DuplicateKeyError
+from LH.buffer import WriteBehindBuffer
+from LH.cache import LRUCache
+from LH.settings import SESSION_STORE
+import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 登录状态相关的会话键，变化时同步写入
+_AUTH_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+
+
+class SessionMongo(Document):
+    """
+    会话MongoDB数据模型，各字段说明如下：
+
+      session_key: 会话ID，字符串
+      session_data: 会话数据，字符串
+      expire_date: 过期时间，日期型，由TTL索引自动清理
+    """
+
+    # 字段声明
+
+    session_key = StringField(primary_key=True, max_length=40)
+    session_data = StringField()
+    expire_date = DateTimeField()
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'django_session',
+            'indexes': [{'fields': ['expire_date'], 'expireAfterSeconds': 0}]}
+
+
+class SessionRevocationMongo(Document):
+    """
+    会话失效记录MongoDB数据模型，会话删除或登录状态变化时写入，各进程据此清理读缓存，各字段说明如下：
+
+      session_key: 会话ID，字符串
+      time: 写入时间，数据库服务器时间，日期型，超过读缓存过期时间后由TTL索引自动清理
+    """
+
+    # 字段声明
+
+    session_key = StringField(primary_key=True, max_length=40)
+    time = DateTimeField()
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'django_session_revocation',
+            'indexes': [{'fields': ['time'], 'expireAfterSeconds': SESSION_STORE['CACHE_TTL'] + 60}]}
+
+
+def _flush_sessions(items):
+    """
+    批量写入会话，值为None表示删除
+    :param items: {会话ID: (会话数据, 过期时间) 或 None}
+    :return:
+    """
+
+    requests = []
+    for session_key, value in items.items():
+        if value is None:
+            requests.append(DeleteOne({'_id': session_key}))
+        else:
+            session_data, expire_date = value
+            requests.append(ReplaceOne({'_id': session_key},
+                                       {'_id': session_key, 'session_data': session_data, 'expire_date': expire_date},
+                                       upsert=True))
+
+    SessionMongo._get_collection().bulk_write(requests, ordered=False)
+
+
+class SessionStore(SessionBase):
+    """
+    会话存储，读取优先命中进程内缓存，修改由后写缓冲区批量持久化。
+
+    新建会话、登录状态变化和删除会话同步写入，并记录失效记录；
+    各进程的后台线程每隔REVOKE_INTERVAL检查失效记录，清理被其他进程失效的缓存会话，
+    超过REVOKE_LAG未成功检查时不使用读缓存，因此登录、登出在其他进程最迟REVOKE_LAG后生效，其余修改最迟CACHE_TTL后可见。
+    """
+
+    # 进程内读缓存，值为(会话字典, 过期时间)
+    _cache = LRUCache(SESSION_STORE['CACHE_SIZE'], SESSION_STORE['CACHE_TTL'])
+
+    # 后写缓冲区
+    _buffer = WriteBehindBuffer(_flush_sessions, SESSION_STORE['FLUSH_INTERVAL'])
+
+    # 失效记录检查状态，checked_at为上次成功检查开始时的单调时钟时间，since为已处理的最新失效记录时间，
+    # pid为已启动检查线程的进程
+    _revocations = {'checked_at': None, 'since': None, 'pid': None}
+    _revocations_lock = threading.Lock()
+
+    # 加载统计
+    _stats = {'loads': 0, 'hits': 0, 'misses': 0, 'load_time': 0.0}
+    _stats_lock = threading.Lock()
+
+    def load(self):
+        """
+        加载会话数据
+        :return: 会话字典
+        """
+
+        start = time.perf_counter()
+        session_key = self.session_key
+
+        self._ensure_revocation_poller()
+        cached = self._cache.get(session_key) if self._revocations_fresh() else None
+        hit = cached is not None
+
+        if hit:
+            data, expire_date = cached
+        else:
+            data, expire_date = self._load_from_db(session_key)
+
+        self._record_load(hit, time.perf_counter() - start)
+
+        if data is None or expire_date <= timezone.now():
+            # 会话不存在或已过期
+            self._session_key = None
+            return {}
+
+        if not hit:
+            self._cache.set(session_key, (data, expire_date))
+
+        # 返回副本，避免请求内的修改影响缓存
+        return dict(data)
+
+    def _load_from_db(self, session_key):
+        """
+        从缓冲区或数据库中读取会话
+        :param session_key: 会话ID
+        :return: (会话字典, 过期时间) 或 (None, None)
+        """
+
+        pending = self._buffer.get(session_key)
+        if pending is not None:
+            session_data, expire_date = pending
+            return self.decode(session_data), expire_date
+
+        if session_key in self._buffer:
+            # 已被删除，尚未刷新
+            return None, None
+
+        session = SessionMongo.objects(session_key=session_key, expire_date__gt=timezone.now()).first()
+        if not session:
+            return None, None
+
+        expire_date = session.expire_date
+        if timezone.is_naive(expire_date):
+            expire_date = timezone.make_aware(expire_date, timezone.utc)
+
+        return self.decode(session.session_data), expire_date
+
+    def exists(self, session_key):
+        """
+        检查会话是否存在
+        :param session_key: 会话ID
+        :return: 存在返回真，否则假
+        """
+
+        if session_key in self._cache or self._buffer.get(session_key) is not None:
+            return True
+
+        if session_key in self._buffer:
+            return False
+
+        return SessionMongo.objects(session_key=session_key).count() > 0
+
+    def create(self):
+        """
+        创建新会话
+        :return:
+        """
+
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        """
+        保存会话，新建会话和登录状态变化时同步写入，其余写入后写缓冲区
+        :param must_create: 是否必须新建
+        :return:
+        """
+
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        expire_date = self.get_expiry_date()
+        session_data = self.encode(data)
+
+        if must_create:
+            # 同步写入，依赖主键唯一性检测冲突
+            try:
+                SessionMongo._get_collection().insert_one(
+                    {'_id': self._session_key, 'session_data': session_data, 'expire_date': expire_date})
+            except DuplicateKeyError:
+                raise CreateError
+        else:
+            # 与本进程缓存中的登录状态比较，未缓存时视为已变化
+            cached = self._cache.get(self._session_key)
+            auth_changed = cached is None or any(cached[0].get(k) != data.get(k) for k in _AUTH_KEYS)
+
+            self._buffer.put(self._session_key, (session_data, expire_date))
+            if auth_changed:
+                self._write_through(self._session_key)
+
+        self._cache.set(self._session_key, (dict(data), expire_date))
+
+    def delete(self, session_key=None):
+        """
+        删除会话
+        :param session_key: 会话ID，默认为当前会话
+        :return:
+        """
+
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+
+        self._cache.delete(session_key)
+        self._buffer.put(session_key, None)
+        self._write_through(session_key)
+
+    @classmethod
+    def _write_through(cls, session_key):
+        """
+        立即刷新后写缓冲区，使该会话的最新值先于失效记录写入，再记录失效记录；
+        刷新排在进行中的刷新之后，不会被较早的值覆盖，刷新失败时由缓冲区重试
+        :param session_key: 会话ID
+        :return:
+        """
+
+        cls._buffer.flush()
+        SessionRevocationMongo._get_collection().update_one(
+            {'_id': session_key}, {'$currentDate': {'time': True}}, upsert=True)
+
+    @classmethod
+    def _ensure_revocation_poller(cls):
+        """
+        当前进程首次加载会话时启动失效记录检查线程，分叉后的子进程重新启动
+        :return:
+        """
+
+        if cls._revocations['pid'] == os.getpid():
+            return
+
+        with cls._revocations_lock:
+            if cls._revocations['pid'] == os.getpid():
+                return
+            cls._revocations['pid'] = os.getpid()
+
+        threading.Thread(target=cls._poll_revocations, name='session-revocations', daemon=True).start()
+
+    @classmethod
+    def _revocations_fresh(cls):
+        """
+        失效记录是否在REVOKE_LAG内检查过，否则读缓存可能包含已被其他进程失效的会话
+        :return: 是返回真，否则假
+        """
+
+        checked_at = cls._revocations['checked_at']
+        return checked_at is not None and time.monotonic() - checked_at < SESSION_STORE['REVOKE_LAG']
+
+    @classmethod
+    def _poll_revocations(cls):
+        """
+        检查线程主循环，每隔REVOKE_INTERVAL检查一次
+        :return:
+        """
+
+        while True:
+            try:
+                cls._check_revocations()
+            except Exception:
+                logger.exception('session revocation check failed')
+
+            time.sleep(SESSION_STORE['REVOKE_INTERVAL'])
+
+    @classmethod
+    def _check_revocations(cls):
+        """
+        清理被其他进程失效的缓存会话，只在检查线程中执行；
+        与上次检查的时间窗口重叠一秒，避免遗漏写入时间相近但稍后提交的记录；
+        首次检查只取读缓存过期时间内的记录，更早失效的会话不会在本进程的读缓存中
+        :return:
+        """
+
+        now = time.monotonic()
+        since = cls._revocations['since']
+        if since is None:
+            start = datetime.datetime.utcnow() - datetime.timedelta(seconds=SESSION_STORE['CACHE_TTL'] + 1)
+        else:
+            start = since - datetime.timedelta(seconds=1)
+
+        for revocation in SessionRevocationMongo._get_collection().find({'time': {'$gte': start}}):
+            cls._cache.delete(revocation['_id'])
+            if since is None or revocation['time'] > since:
+                since = revocation['time']
+
+        cls._revocations['since'] = since
+        cls._revocations['checked_at'] = now
+
+    @classmethod
+    def clear_expired(cls):
+        """
+        清理过期会话，通常由TTL索引自动完成
+        :return:
+        """
+        SessionMongo.objects(expire_date__lt=timezone.now()).delete()
+
+    @classmethod
+    def _record_load(cls, hit, elapsed):
+        """
+        记录加载统计
+        :param hit: 是否命中缓存
+        :param elapsed: 耗时，单位秒
+        :return:
+        """
+
+        with cls._stats_lock:
+            cls._stats['loads'] += 1
+            cls._stats['hits' if hit else 'misses'] += 1
+            cls._stats['load_time'] += elapsed
+
+    @classmethod
+    def get_stats(cls):
+        """
+        获取加载统计
+        :return: 统计字典，avg_load_ms为平均加载耗时（毫秒）
+        """
+
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+
+        stats['avg_load_ms'] = stats['load_time'] * 1000 / stats['loads'] if stats['loads'] else 0.0
+        stats['pending_writes'] = len(cls._buffer)
+        return stats
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 
 import os
 import mongoengine
+from LH.instrument import command_listener
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -30,11 +31,12 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'account',
+    'account.apps.AccountConfig',
     'coin',
     'forum',
     'notify',
     'action',
+    'LH',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LH.middleware.QueryInstrumentMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,7 +87,12 @@ DATABASES = {
 
 # MongoEngine配置
 
-SESSION_ENGINE = 'mongoengine.django.sessions'
+# 会话存储配置，CACHE_TTL和FLUSH_INTERVAL单位为秒，SIGNED_COOKIE为真时会话数据保存在签名cookie中
+# REVOKE_INTERVAL为后台线程检查其他进程失效记录的间隔，REVOKE_LAG为超过多久未成功检查即不使用读缓存，单位为秒
+
+SESSION_STORE = {'CACHE_SIZE': 10000, 'CACHE_TTL': 5, 'FLUSH_INTERVAL': 1, 'REVOKE_INTERVAL': 0.2, 'REVOKE_LAG': 1,
+                 'SIGNED_COOKIE': False}
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies' if SESSION_STORE['SIGNED_COOKIE'] else 'LH.session'
 AUTHENTICATION_BACKENDS = (
     'mongoengine.django.auth.MongoEngineBackend',
 )
@@ -98,7 +106,7 @@ MONGODB_DB = 'liansea'
 MONGODB_HOST = '127.0.0.1:27017'
 MONGODB_URI = 'mongodb://%s:%s@%s/%s' % (MONGODB_USERNAME, MONGODB_PASSWORD, MONGODB_HOST, MONGODB_DB)
 
-mongoengine.connect(MONGODB_DB, host=MONGODB_HOST)
+mongoengine.connect(MONGODB_DB, host=MONGODB_HOST, event_listeners=[command_listener])
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -118,6 +126,19 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# 密码哈希配置，ITERATIONS为PBKDF2迭代次数，修改后旧哈希在用户登录时重新计算
+# WORKERS为哈希进程池大小，QUEUE_SIZE为排队等待的哈希数上限，TIMEOUT为等待哈希结果的最长时间，单位为秒
+
+PASSWORD_HASH = {'ITERATIONS': 100000, 'WORKERS': 4, 'QUEUE_SIZE': 64, 'TIMEOUT': 10}
+
+PASSWORD_HASHERS = [
+    'account.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.0/topics/i18n/
 
@@ -143,3 +164,121 @@ DEFAULT_PORTRAIT_URL = 'http://www.1.com/2.jpeg'
 # 第三方API
 
 THIRD_PARTY_API = {'SMS_CODE': '', 'QQ_LOGIN': '', 'WECHAT_LOGIN': '', 'QINIU': ''}
+
+# 已验证用户缓存配置，MAX_SIZE为最大会话数，TTL单位为秒
+
+AUTH_CACHE = {'MAX_SIZE': 10000, 'TTL': 60}
+
+# HTTP客户端配置，超时与退避单位为秒，ENDPOINTS中可按第三方API覆盖TIMEOUT与RETRIES
+
+HTTP_CLIENT = {'POOL_SIZE': 10, 'TIMEOUT': 5, 'RETRIES': 2, 'BACKOFF': 0.1,
+               'BREAKER_THRESHOLD': 5, 'BREAKER_RESET': 30,
+               'ENDPOINTS': {'SMS_CODE': {'TIMEOUT': 3, 'RETRIES': 0},
+                             'QQ_LOGIN': {'TIMEOUT': 3},
+                             'WECHAT_LOGIN': {'TIMEOUT': 3},
+                             'QINIU': {'TIMEOUT': 10, 'RETRIES': 1}}}
+
+# 任务队列配置，时间单位为秒；WAIT为视图等待任务结果的默认时长，LEASE为任务租约时长，KEEP为已完成任务的保留时长
+# CONCURRENCY为队列同时运行的任务数上限，MAX_RETRIES为失败后的重试次数，超过后转入死信
+
+TASK_QUEUE = {'PATH': os.path.join(BASE_DIR, 'tasks.sqlite3'), 'WAIT': 2, 'LEASE': 60, 'KEEP': 3600,
+              'POLL_INTERVAL': 0.05,
+              'QUEUES': {'default': {'CONCURRENCY': 4, 'MAX_RETRIES': 3, 'RETRY_DELAY': 1},
+                         'sms': {'CONCURRENCY': 4, 'MAX_RETRIES': 0, 'RETRY_DELAY': 1},
+                         'login': {'CONCURRENCY': 8, 'MAX_RETRIES': 1, 'RETRY_DELAY': 0.5},
+                         'upload': {'CONCURRENCY': 2, 'MAX_RETRIES': 3, 'RETRY_DELAY': 2}}}
+
+# 最后登录时间批量写入间隔，单位为秒
+
+LOGIN_TIME_FLUSH_INTERVAL = 5
+
+# 第三方token缓存配置，TTL为验证通过及token到用户ID映射的过期时间，NEGATIVE_TTL为验证失败结果的过期时间，单位为秒
+
+TOKEN_CACHE = {'MAX_SIZE': 10000, 'TTL': 300, 'NEGATIVE_TTL': 30}
+
+# 用户名与手机号可用性布隆过滤器配置，CAPACITY为最小容量，ERROR_RATE为误判率，ENABLED为假时总是查询数据库
+# 每个进程首次检查时在后台构建；POLL_INTERVAL为增量加载其他进程新注册用户的间隔，
+# POLL_OVERLAP为增量加载向前重叠的时长，需大于各服务器时钟偏差，MAX_LAG为超过多久未成功增量加载即不信任过滤器，
+# MAX_BACKOFF为构建失败后重试间隔的上限，单位为秒
+
+USER_BLOOM = {'CAPACITY': 1000000, 'ERROR_RATE': 0.001, 'BATCH_SIZE': 1000, 'ENABLED': True,
+              'POLL_INTERVAL': 1, 'POLL_OVERLAP': 60, 'MAX_LAG': 5, 'MAX_BACKOFF': 60}
+
+# 短信验证码配置，TTL为验证码有效期，RESEND_INTERVAL为重发间隔，单位为秒；MAX_ATTEMPTS为错误验证次数上限
+# MOBILE_LIMIT与IP_LIMIT为每个手机号与IP在LIMIT_WINDOW秒内的发送次数上限，计数由各进程共享
+
+SMS_CODE = {'TTL': 300, 'RESEND_INTERVAL': 60, 'MAX_ATTEMPTS': 5,
+            'MOBILE_LIMIT': 5, 'IP_LIMIT': 20, 'LIMIT_WINDOW': 3600}
+
+# 用户资料快照缓存配置，TTL单位为秒
+
+PROFILE_CACHE = {'MAX_SIZE': 10000, 'TTL': 600}
+
+# 头像上传配置，MAX_SIZE为文件大小上限，MAX_REQUEST_SIZE为请求体大小上限，单位为字节
+# SPOOL_DIR为待推送文件的暂存目录，需与任务worker共享；URL_PREFIX加内容哈希为头像url
+
+PORTRAIT_UPLOAD = {'MAX_SIZE': 2 * 1024 * 1024, 'MAX_REQUEST_SIZE': 2 * 1024 * 1024 + 64 * 1024,
+                   'SPOOL_DIR': os.path.join(BASE_DIR, 'spool', 'portrait'), 'THUMB_SIZE': (128, 128),
+                   'URL_PREFIX': 'http://www.1.com/portrait/'}
+
+# 上传文件超过该大小时写入临时文件，单位为字节
+
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# 双写执行器配置，WORKERS为线程池大小，TIMEOUT为各后端写入的超时时间，单位为秒
+
+DUAL_WRITE = {'WORKERS': 16, 'TIMEOUT': {'mongo': 2, 'sql': 2}}
+
+# 复制配置，MODE为dual时两个后端同步双写，为outbox时仅同步写入mongo后端，变更由replicate_outbox命令应用到sql后端
+# SETTLE为等待序号空缺的时长，超时后空缺记入死信，KEEP为已应用变更的保留时长，POLL_INTERVAL为无变更时的轮询间隔，单位为秒
+# MAX_ATTEMPTS为单条变更应用失败的次数上限，达到后记入死信并继续复制
+
+REPLICATION = {'MODE': 'dual', 'BATCH_SIZE': 500, 'SETTLE': 5, 'KEEP': 86400, 'POLL_INTERVAL': 0.5,
+               'MAX_ATTEMPTS': 5}
+
+# 读路由配置，WORKERS为线程池大小，TIMEOUT为读取的总超时时间，HEDGE_DELAY为首选后端未返回时向另一后端发出对冲请求的延迟，单位为秒
+# WINDOW为健康统计保留的最近请求数，PROBE为随机选择非首选后端的概率，NEGATIVE_TTL为空结果的缓存时间，单位为秒
+
+READ_ROUTER = {'WORKERS': 16, 'TIMEOUT': 2, 'HEDGE_DELAY': 0.05, 'WINDOW': 200, 'PROBE': 0.05,
+               'NEGATIVE_TTL': 5, 'NEGATIVE_CACHE_SIZE': 10000}
+
+# ID分配器配置，COLLECTION为计数器集合，BLOCK_SIZE为每次领取的ID段大小，BLOCK_SIZES可按序列名单独指定
+
+ID_ALLOCATOR = {'COLLECTION': 'counters', 'BLOCK_SIZE': 100, 'BLOCK_SIZES': {'follow': 1000, 'comment': 1000}}
+
+# 一致性校验配置，CHUNK_SIZE为每段的ID跨度，BATCH_SIZE为逐行比较时游标每批读取的行数
+# DUTY_CYCLE为校验占用数据库时间的比例上限，每段结束后按比例休眠
+
+RECONCILE = {'CHUNK_SIZE': 1000, 'BATCH_SIZE': 500, 'DUTY_CYCLE': 0.25}
+
+# 请求级数据库计量配置，SERVER_TIMING为是否返回Server-Timing响应头，仅调试时开启，避免向客户端暴露后端耗时
+# BYTES_SAMPLE为统计mongo字节数的请求比例，统计需重新编码每个命令和回复
+# 耗时超过SLOW_REQUEST秒或操作数达到SLOW_OPS的请求记录慢请求日志，日志中列出次数最多的SLOW_SHAPES个查询形状
+
+INSTRUMENT = {'SERVER_TIMING': DEBUG, 'BYTES_SAMPLE': 0.01, 'SLOW_REQUEST': 0.5, 'SLOW_OPS': 50, 'SLOW_SHAPES': 10}
+
+# 贴子计数聚合配置，FLUSH_INTERVAL为批量写入间隔，单位为秒
+# CACHE_SIZE、CACHE_TTL为记录已返回计数的缓存，用于保证读到的计数不减小
+
+POST_COUNTER = {'FLUSH_INTERVAL': 0.2, 'CACHE_SIZE': 10000, 'CACHE_TTL': 60}
+
+# 投票账本配置，CACHE_SIZE为内存中缓存投票集合的贴子数，CACHE_TTL为缓存时间，单位为秒
+
+VOTE_LEDGER = {'CACHE_SIZE': 1000, 'CACHE_TTL': 300}
+
+# 敏感词配置，SOURCE为词表来源，file为PATH指定的文件，每行一个词，mongo为sensitive_word集合
+# RELOAD_INTERVAL为检查词表是否变化的间隔，RETRY_INTERVAL为尚未成功读取过词表时的重试间隔，单位为秒
+# MAX_SHRINK为重新读取时词数可减少的最大比例，超过时视为读取不完整
+
+SENSITIVE_WORDS = {'SOURCE': 'file', 'PATH': os.path.join(BASE_DIR, 'forum', 'sensitive_words.txt'),
+                   'RELOAD_INTERVAL': 30, 'RETRY_INTERVAL': 1, 'MAX_SHRINK': 0.5}
+
+# 主题列表配置，PAGE_SIZE为默认每页数目，MAX_PAGE_SIZE为每页数目上限
+# CACHE_SIZE、CACHE_TTL为首页缓存的条目数和过期时间，单位为秒
+
+TOPIC_FEED = {'PAGE_SIZE': 20, 'MAX_PAGE_SIZE': 50, 'CACHE_SIZE': 256, 'CACHE_TTL': 60}
+
+# 评论树配置，PAGE_SIZE为默认每页顶层评论数目，MAX_PAGE_SIZE为每页数目上限
+# REPLY_PAGE_SIZE为每条评论下展示的回复数目，MAX_DEPTH为一次返回的层数，ROW_LIMIT为一次查询取出的评论数上限
+
+COMMENT_TREE = {'PAGE_SIZE': 20, 'MAX_PAGE_SIZE': 50, 'REPLY_PAGE_SIZE': 5, 'MAX_DEPTH': 4, 'ROW_LIMIT': 500}
@@ -0,0 +1,74 @@
+"""
+统计工具集
+"""
+
+from collections import deque
+import threading
+
+
+class LatencyStats(object):
+    """
+    延迟统计，保留最近的请求耗时用于计算分位数
+    """
+
+    def __init__(self, window=1000):
+        """
+        初始化
+        :param window: 保留的最近请求数
+        """
+
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._requests = 0
+        self._errors = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        """
+        记录一次请求
+        :param latency: 耗时，单位秒
+        :param ok: 是否成功
+        :return:
+        """
+
+        with self._lock:
+            self._requests += 1
+            if not ok:
+                self._errors += 1
+            self._latencies.append(latency)
+            self._outcomes.append(ok)
+
+    def record_rejected(self):
+        with self._lock:
+            self._rejected += 1
+
+    def recent(self):
+        """
+        获取最近请求的平均耗时和错误率
+        :return: (平均耗时，单位秒, 错误率)，无请求时均为0
+        """
+
+        with self._lock:
+            if not self._latencies:
+                return 0.0, 0.0
+
+            return (sum(self._latencies) / len(self._latencies),
+                    self._outcomes.count(False) / len(self._outcomes))
+
+    def snapshot(self):
+        """
+        获取统计快照
+        :return: 统计字典，延迟单位为毫秒
+        """
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {'requests': self._requests, 'errors': self._errors, 'rejected': self._rejected}
+
+        if latencies:
+            result['avg_ms'] = sum(latencies) * 1000 / len(latencies)
+            for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+                result[name] = latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+
+        return result
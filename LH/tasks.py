@@ -0,0 +1,308 @@
+"""
+基于SQLite的持久化任务队列
+"""
+
+from LH.settings import TASK_QUEUE
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+
+# 任务注册表，任务名 -> 任务对象
+_registry = {}
+
+
+class Task(object):
+    """
+    已注册的任务
+    """
+
+    def __init__(self, func, name, queue):
+        """
+        初始化
+        :param func: 任务函数，抛出异常表示失败并按队列配置重试
+        :param name: 任务名
+        :param queue: 队列名
+        """
+
+        self.func = func
+        self.name = name
+        self.queue = queue
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+    def delay(self, *args):
+        """
+        将任务加入队列
+        :param args: 任务参数，需可序列化为json
+        :return: 任务ID
+        """
+        return task_queue.enqueue(self.name, *args)
+
+
+def task(queue='default'):
+    """
+    注册任务的装饰器
+    :param queue: 队列名
+    :return:
+    """
+
+    def decorator(func):
+        name = '%s.%s' % (func.__module__, func.__name__)
+        _registry[name] = Task(func, name, queue)
+        return _registry[name]
+
+    return decorator
+
+
+class TaskQueue(object):
+    """
+    持久化任务队列，支持重试、死信与按队列的并发限制
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.TASK_QUEUE
+        """
+
+        self._config = config
+        self._local = threading.local()
+
+    def _queue_option(self, queue, name):
+        """
+        获取队列配置
+        :param queue: 队列名
+        :param name: 配置项
+        :return: 配置值
+        """
+        return self._config['QUEUES'].get(queue, self._config['QUEUES']['default'])[name]
+
+    @property
+    def _db(self):
+        """
+        当前线程的数据库连接，分叉后重新建立
+        :return: sqlite3连接
+        """
+
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self._config['PATH'], timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS task ('
+                       'id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, name TEXT NOT NULL, '
+                       'args TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                       'run_at REAL NOT NULL, lease_until REAL, result TEXT, error TEXT, '
+                       'created REAL NOT NULL, updated REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS task_ready ON task (queue, status, run_at)')
+
+            self._local.db = db
+            self._local.pid = os.getpid()
+
+        return self._local.db
+
+    def enqueue(self, name, *args):
+        """
+        加入任务
+        :param name: 任务名
+        :param args: 任务参数
+        :return: 任务ID
+        """
+
+        assert name in _registry
+
+        now = time.time()
+        cursor = self._db.execute('INSERT INTO task (queue, name, args, status, run_at, created, updated) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (_registry[name].queue, name, json.dumps(args), PENDING, now, now, now))
+        return cursor.lastrowid
+
+    def get(self, task_id):
+        """
+        获取任务状态
+        :param task_id: 任务ID
+        :return: (状态, 结果) 或 (None, None)
+        """
+
+        row = self._db.execute('SELECT status, result FROM task WHERE id = ?', (task_id,)).fetchone()
+        if not row:
+            return None, None
+
+        return row['status'], json.loads(row['result']) if row['result'] is not None else None
+
+    def wait(self, task_id, timeout=None):
+        """
+        等待任务完成
+        :param task_id: 任务ID
+        :param timeout: 最长等待时间，单位秒，默认使用配置中的WAIT
+        :return: (状态, 结果)，超时返回当前状态
+        """
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self._config['WAIT'])
+
+        while True:
+            status, result = self.get(task_id)
+            if status in (DONE, DEAD, None) or time.monotonic() >= deadline:
+                return status, result
+
+            time.sleep(self._config['POLL_INTERVAL'])
+
+    def claim(self, queue):
+        """
+        领取一个待执行任务，队列运行中的任务数达到并发上限时不领取
+        :param queue: 队列名
+        :return: 任务行 或 None
+        """
+
+        db = self._db
+        now = time.time()
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            running = db.execute('SELECT COUNT(*) FROM task WHERE queue = ? AND status = ? AND lease_until > ?',
+                                 (queue, RUNNING, now)).fetchone()[0]
+            if running >= self._queue_option(queue, 'CONCURRENCY'):
+                db.execute('COMMIT')
+                return None
+
+            while True:
+                # 租约过期的运行中任务视为worker已退出，重新领取
+                row = db.execute('SELECT * FROM task WHERE queue = ? AND ((status = ? AND run_at <= ?) OR '
+                                 '(status = ? AND lease_until <= ?)) ORDER BY id LIMIT 1',
+                                 (queue, PENDING, now, RUNNING, now)).fetchone()
+                if not row:
+                    break
+
+                # 租约过期的一次执行计为一次失败，超过重试次数时转入死信，避免使worker退出的任务无限循环
+                if row['status'] == RUNNING and row['attempts'] > self._queue_option(queue, 'MAX_RETRIES'):
+                    db.execute('UPDATE task SET status = ?, error = ?, lease_until = NULL, updated = ? WHERE id = ?',
+                               (DEAD, 'lease expired', now, row['id']))
+                    logger.error('task %s(%d) dead-lettered: lease expired', row['name'], row['id'])
+                    continue
+
+                db.execute('UPDATE task SET status = ?, attempts = attempts + 1, lease_until = ?, updated = ? '
+                           'WHERE id = ?', (RUNNING, now + self._config['LEASE'], now, row['id']))
+                break
+
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+        return row
+
+    def complete(self, task_id, result):
+        """
+        标记任务完成
+        :param task_id: 任务ID
+        :param result: 任务结果
+        :return:
+        """
+
+        self._db.execute('UPDATE task SET status = ?, result = ?, lease_until = NULL, updated = ? WHERE id = ?',
+                         (DONE, json.dumps(result), time.time(), task_id))
+
+    def fail(self, row, error):
+        """
+        标记任务失败，未超过重试次数时延迟重试，否则转入死信
+        :param row: 任务行
+        :param error: 错误信息
+        :return:
+        """
+
+        attempts = row['attempts'] + 1
+        now = time.time()
+
+        if attempts > self._queue_option(row['queue'], 'MAX_RETRIES'):
+            status, run_at = DEAD, now
+            logger.error('task %s(%d) dead-lettered: %s', row['name'], row['id'], error)
+        else:
+            status, run_at = PENDING, now + self._queue_option(row['queue'], 'RETRY_DELAY') * 2 ** (attempts - 1)
+
+        self._db.execute('UPDATE task SET status = ?, run_at = ?, error = ?, lease_until = NULL, updated = ? '
+                         'WHERE id = ?', (status, run_at, error, now, row['id']))
+
+    def dead_letters(self, queue, num=100):
+        """
+        获取死信任务
+        :param queue: 队列名
+        :param num: 数目
+        :return: 任务行列表
+        """
+        return self._db.execute('SELECT * FROM task WHERE queue = ? AND status = ? ORDER BY id LIMIT ?',
+                                (queue, DEAD, num)).fetchall()
+
+    def requeue(self, task_id):
+        """
+        重新执行死信任务
+        :param task_id: 任务ID
+        :return: 成功返回真，否则假
+        """
+
+        cursor = self._db.execute('UPDATE task SET status = ?, attempts = 0, run_at = ?, updated = ? '
+                                  'WHERE id = ? AND status = ?', (PENDING, time.time(), time.time(), task_id, DEAD))
+        return cursor.rowcount > 0
+
+    def purge(self):
+        """
+        清理超过保留时间的已完成任务
+        :return: 清理的任务数
+        """
+
+        cursor = self._db.execute('DELETE FROM task WHERE status = ? AND updated < ?',
+                                  (DONE, time.time() - self._config['KEEP']))
+        return cursor.rowcount
+
+    def execute(self, row):
+        """
+        执行已领取的任务
+        :param row: 任务行
+        :return:
+        """
+
+        try:
+            result = _registry[row['name']](*json.loads(row['args']))
+        except Exception:
+            self.fail(row, traceback.format_exc())
+        else:
+            self.complete(row['id'], result)
+
+    def run_worker(self, queues):
+        """
+        worker主循环，轮流从各队列领取任务
+        :param queues: 队列名列表
+        :return:
+        """
+
+        last_purge = time.monotonic()
+
+        while True:
+            busy = False
+            for queue in queues:
+                row = self.claim(queue)
+                if row:
+                    busy = True
+                    self.execute(row)
+
+            if time.monotonic() - last_purge > self._config['KEEP']:
+                self.purge()
+                last_purge = time.monotonic()
+
+            if not busy:
+                time.sleep(self._config['POLL_INTERVAL'])
+
+
+# 进程内共享的任务队列
+task_queue = TaskQueue(TASK_QUEUE)
@@ -0,0 +1,267 @@
+from django.test import SimpleTestCase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from unittest import skipUnless
+from account.models import UserMongo
+from account.principal import UserPrincipal
+from forum.comments import comment_tree
+from forum.feed import topic_feed
+from forum.models import TopicMongo, CommentMongo
+from LH.http_client import HttpClient, HttpClientError, CircuitOpenError
+from LH.instrument import QueryRecorder, activate
+from LH.reconcile import ReconcileSpec, Reconciler
+from LH.settings import MONGODB_HOST
+from collections import Counter
+import datetime
+import threading
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    本地桩服务器的请求处理程序，按路径返回固定响应
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def _respond(self, status, body=b'', close=False):
+        self.server.requests.append(self.path)
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        # 不发送Connection: close即关闭，模拟服务端关闭空闲长连接
+        if close:
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path == '/ok':
+            self._respond(200, b'ok')
+        elif self.path == '/idle-close':
+            self._respond(200, b'ok', close=True)
+        elif self.path == '/error':
+            self._respond(500)
+        else:
+            self._respond(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._respond(200, body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientTest(SimpleTestCase):
+    """
+    HTTP客户端，针对本地桩服务器
+    """
+
+    config = {'POOL_SIZE': 2, 'TIMEOUT': 2, 'RETRIES': 0, 'BACKOFF': 0,
+              'BREAKER_THRESHOLD': 3, 'BREAKER_RESET': 30, 'ENDPOINTS': {'RETRY': {'RETRIES': 2}}}
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.daemon_threads = True
+
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+        self.client = HttpClient(self.config)
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connection(self):
+        self.assertEqual(self.client.request(self.base + '/ok'), b'ok')
+        self.assertEqual(self.client.request(self.base + '/ok'), b'ok')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_post_form(self):
+        self.assertEqual(self.client.request(self.base + '/echo', {'mobile': '13800000000'}), b'mobile=13800000000')
+
+    def test_stale_connection_resent_without_retry(self):
+        self.assertEqual(self.client.request(self.base + '/idle-close', endpoint='SMS'), b'ok')
+
+        # RETRIES为0时，已被服务端关闭的复用连接仍换用新连接重发成功，且不计入熔断
+        self.assertEqual(self.client.request(self.base + '/ok', endpoint='SMS'), b'ok')
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.client.get_stats()['SMS']['errors'], 0)
+        self.assertEqual(self.client.get_stats()['SMS']['circuit'], 'closed')
+
+    def test_server_error_retried(self):
+        with self.assertRaises(HttpClientError):
+            self.client.request(self.base + '/error', endpoint='RETRY')
+        self.assertEqual(self.server.requests, ['/error'] * 3)
+
+    def test_client_error_not_retried(self):
+        self.assertEqual(self.client.request(self.base + '/missing', endpoint='RETRY'), b'')
+        self.assertEqual(self.server.requests, ['/missing'])
+
+    def test_breaker_opens(self):
+        for _ in range(self.config['BREAKER_THRESHOLD']):
+            with self.assertRaises(HttpClientError):
+                self.client.request(self.base + '/error')
+
+        with self.assertRaises(CircuitOpenError):
+            self.client.request(self.base + '/ok')
+        self.assertEqual(len(self.server.requests), self.config['BREAKER_THRESHOLD'])
+
+
+def _mongo_available():
+    """
+    检查配置的mongo是否可连接，不可连接时跳过依赖mongo的测试
+    :return: 可连接返回真，否则假
+    """
+
+    try:
+        MongoClient(MONGODB_HOST, serverSelectionTimeoutMS=500).admin.command('ping')
+    except PyMongoError:
+        return False
+    return True
+
+
+@skipUnless(_mongo_available(), 'mongo is not available')
+class ListQueryCountTest(SimpleTestCase):
+    """
+    列表接口的查询数，主题列表和评论树的作者均批量解引用，每个集合只查询一次；
+    使用配置的mongo连接，数据使用不与业务冲突的ID并在结束后删除
+    """
+
+    base_id = 990000000
+
+    def setUp(self):
+        self.users = []
+        for i in range(2):
+            uid = self.base_id + i
+            UserMongo(id=uid, username='deref%d' % i, mobile='1990000000%d' % i, password='!').save()
+            self.users.append(UserPrincipal.load(uid))
+
+        # 引用由UserPrincipal.to_dbref生成，与发帖、回复的写入方式相同
+        now = datetime.datetime.now()
+        self.topic = TopicMongo(id=self.base_id, title='deref', content='deref', publish_time=now,
+                                forum_id=self.base_id, user=self.users[0].to_dbref())
+        self.topic.save()
+        for i in range(1, 3):
+            TopicMongo(id=self.base_id + i, title='deref', content='deref', publish_time=now,
+                       forum_id=self.base_id, user=self.users[i % 2].to_dbref()).save()
+
+        # 两条顶层评论，各有一条回复
+        for i in range(2):
+            thread = self.base_id + i
+            parent = CommentMongo(id=thread, content='deref comment', user=self.users[i].to_dbref(),
+                                  topic=self.topic, root=self.base_id, path=[], depth=0, thread=thread,
+                                  comment_num=1, time=now)
+            parent.save()
+            CommentMongo(id=self.base_id + 10 + i, content='deref comment', user=self.users[1 - i].to_dbref(),
+                         type=1, comment=parent, root=self.base_id, path=[thread], depth=1, thread=thread,
+                         time=now).save()
+
+    def tearDown(self):
+        CommentMongo.objects(id__gte=self.base_id).delete()
+        TopicMongo.objects(id__gte=self.base_id).delete()
+        UserMongo.objects(id__gte=self.base_id).delete()
+
+    def _count_queries(self, func):
+        """
+        统计函数执行期间各集合的mongo查询数
+        :param func: 函数
+        :return: (函数返回值, {集合名: 查询数})
+        """
+
+        recorder = QueryRecorder()
+        previous = activate(recorder)
+        try:
+            result = func()
+        finally:
+            activate(previous)
+
+        counts = Counter()
+        for (backend, shape), n in recorder.shapes.items():
+            if backend == 'mongo':
+                counts[shape.split(' ')[1]] += n
+        return result, counts
+
+    def test_topic_feed(self):
+        (items, _), counts = self._count_queries(lambda: topic_feed._query(self.base_id, None, 10))
+
+        self.assertEqual(counts, {TopicMongo._get_collection_name(): 1, UserMongo._get_collection_name(): 1})
+        self.assertEqual(sorted(t['user']['username'] for t in items), ['deref0', 'deref0', 'deref1'])
+
+    def test_topic_feed_deleted_author(self):
+        UserMongo.objects(id=self.users[1].id).delete()
+
+        items, _ = topic_feed._query(self.base_id, None, 10)
+        self.assertEqual(sorted(t['user']['username'] for t in items), ['', 'deref0', 'deref0'])
+
+    def test_comment_tree(self):
+        (items, _), counts = self._count_queries(lambda: comment_tree.get_page(self.base_id, 10))
+
+        self.assertEqual(counts, {CommentMongo._get_collection_name(): 1, UserMongo._get_collection_name(): 1})
+        self.assertEqual([(c['user']['username'], [r['user']['username'] for r in c['replies']]) for c in items],
+                         [('deref0', ['deref1']), ('deref1', ['deref0'])])
+
+    def test_comment_tree_deleted_author(self):
+        UserMongo.objects(id=self.users[1].id).delete()
+
+        items, _ = comment_tree.get_page(self.base_id, 10)
+        self.assertEqual([(c['user']['username'], [r['user']['username'] for r in c['replies']]) for c in items],
+                         [('deref0', ['']), ('', ['deref0'])])
+
+
+class FakeCollection(object):
+    """
+    记录更新操作的mongo集合替身
+    """
+
+    def __init__(self):
+        self.updates = []
+
+    def update_one(self, query, update):
+        self.updates.append((query, update))
+        return type('UpdateResult', (), {'modified_count': 1})()
+
+
+class FakeDocument(object):
+    collection = None
+
+    @classmethod
+    def _get_collection(cls):
+        return cls.collection
+
+
+class ReconcileApplyTest(SimpleTestCase):
+    """
+    一致性修复与计数器缓冲的交互：缓冲字段的差异可能是尚未刷新的增量，不能修复
+    """
+
+    def setUp(self):
+        FakeDocument.collection = FakeCollection()
+        spec = ReconcileSpec('post', FakeDocument, None, ['follow_num', 'digg_num'], buffered=['digg_num'])
+        self.reconciler = Reconciler(spec, {'BATCH_SIZE': 100}, source='sql')
+
+    def test_buffered_field_not_repaired(self):
+        # mongo的计数器缓冲刷新后增量已写入，sql的缓冲尚未刷新，差值即为在途增量
+        repair = {'entity': 'post', 'id': 1, 'op': 'update', 'backend': 'mongo',
+                  'set': {'digg_num': 4}, 'expected': {'digg_num': 5}, 'buffered': ['digg_num']}
+
+        self.assertFalse(self.reconciler.apply(repair))
+        self.assertEqual(FakeDocument.collection.updates, [])
+
+    def test_only_unbuffered_fields_repaired(self):
+        repair = {'entity': 'post', 'id': 1, 'op': 'update', 'backend': 'mongo',
+                  'set': {'follow_num': 3, 'digg_num': 4}, 'expected': {'follow_num': 1, 'digg_num': 5},
+                  'buffered': ['digg_num']}
+
+        self.assertTrue(self.reconciler.apply(repair))
+        self.assertEqual(FakeDocument.collection.updates, [({'follow_num': 1, 'id': 1}, {'$inc': {'follow_num': 2}})])
@@ -2,22 +2,29 @@
 功能集
 """
 
-from urllib.request import urlopen, Request
+from LH.http_client import HttpClient, HttpClientError
+from LH.settings import HTTP_CLIENT
+import logging
 import ssl
 
+logger = logging.getLogger(__name__)
+
 ssl_context = ssl._create_unverified_context()
 
+# 进程内共享的HTTP客户端
+http_client = HttpClient(HTTP_CLIENT, ssl_context)
+
 
-def http_fetch(url, data):
+def http_fetch(url, data, endpoint=None):
     """
     通过http协议获取响应结果
     :param url: url
     :param data: 提交数据
+    :param endpoint: 端点名，对应HTTP_CLIENT['ENDPOINTS']中的配置
     :return:
     """
     try:
-        response = urlopen(url, data, context=ssl_context)
-        return response.read()
-    except Exception as e:
-        print(e.__traceback__)
+        return http_client.request(url, data, endpoint=endpoint)
+    except HttpClientError:
+        logger.exception('http fetch of %s failed', url)
         return ''
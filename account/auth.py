@@ -1,5 +1,12 @@
-from mongoengine.django.auth import auth as auth_mongo
+from django.conf import settings
 from django.contrib import auth
+from django.utils.crypto import constant_time_compare
+from account.models import User, UserMongo
+from account.passwords import hash_password, verify_password, PasswordHashError
+from account.principal import UserPrincipal
+from LH.cache import LRUCache
+from LH.settings import AUTH_CACHE
+import threading
 
 
 class Auth(object):
@@ -9,36 +16,161 @@ class Auth(object):
 
     _no_permission_msg = {'code': -1, 'msg': '无操作权限'}
 
+    # 进程级已验证用户缓存，以会话ID为键
+    _user_cache = LRUCache(AUTH_CACHE['MAX_SIZE'], AUTH_CACHE['TTL'])
+
+    # 用户ID到会话ID集合的索引，用于按用户失效缓存
+    _user_sessions = {}
+    _user_sessions_lock = threading.Lock()
+
+    @classmethod
+    def get_authenticated_user(cls, request):
+        """
+        从请求中获取已验证用户，结果在请求内及进程内缓存
+        :param request: 请求
+        :return: User列表
+        """
+
+        # 请求级缓存
+        users = getattr(request, '_authenticated_users', None)
+        if users is not None:
+            return users
+
+        # 进程级缓存，凭据版本号变化时（其他进程修改了密码）视为未命中
+        session_key = cls._get_session_key(request)
+        users = cls._user_cache.get(session_key) if session_key else None
+
+        if users is not None and not cls._is_current(users[0]):
+            cls._user_cache.delete(session_key)
+            users = None
+
+        if users is None:
+            users = cls._load_authenticated_user(request)
+
+            # 仅缓存已验证的结果
+            if users and session_key:
+                cls._user_cache.set(session_key, users)
+                cls._index_session(users[0].id, session_key)
+
+        request._authenticated_users = users
+        return users
+
     @classmethod
-    def get_authenticated_user(cls,request):
+    def _load_authenticated_user(cls, request):
         """
-        从请求中获取已验证用户
+        从各后端加载已验证用户
         :param request: 请求
         :return: User列表
         """
 
-        users=[]
+        users = []
 
-        user_mongo=cls.get_authenticated_user_mongo(request)
+        user_mongo = cls.get_authenticated_user_mongo(request)
         if user_mongo:
             users.append(user_mongo)
 
-        user_sql=cls.get_authenticated_user_sql(request)
+        user_sql = cls.get_authenticated_user_sql(request)
         if user_sql:
             users.append(user_sql)
 
         return users
 
+    @classmethod
+    def _is_current(cls, user):
+        """
+        检查缓存的用户凭据是否仍有效，仅投影查询凭据版本号
+        :param user: 缓存的用户对象
+        :return: 有效为真，否则假
+        """
+
+        # 仅有sql后端用户时无版本号可比较，重新加载
+        if not isinstance(user, UserPrincipal):
+            return False
+
+        son = UserMongo.objects(id=user.id).only('auth_version').as_pymongo().first()
+        return son is not None and son.get(UserMongo._fields['auth_version'].db_field, 0) == user.auth_version
+
+    @classmethod
+    def _get_session_key(cls, request):
+        """
+        获取请求的会话ID
+        :param request: 请求
+        :return: 会话ID 或 None
+        """
+
+        session = getattr(request, 'session', None)
+        return session.session_key if session is not None else None
+
+    @classmethod
+    def _index_session(cls, uid, session_key):
+        """
+        记录用户的会话ID，并清理已被淘汰的会话
+        :param uid: 用户ID
+        :param session_key: 会话ID
+        :return:
+        """
+
+        with cls._user_sessions_lock:
+            keys = set(k for k in cls._user_sessions.get(uid, ()) if k in cls._user_cache)
+            keys.add(session_key)
+            cls._user_sessions[uid] = keys
+
+    @classmethod
+    def invalidate(cls, request):
+        """
+        使当前请求的已验证用户缓存失效
+        :param request: 请求
+        :return:
+        """
+
+        request._authenticated_users = None
+
+        session_key = cls._get_session_key(request)
+        if session_key:
+            cls._user_cache.delete(session_key)
+
+    @classmethod
+    def invalidate_user(cls, uid):
+        """
+        使指定用户所有会话的已验证用户缓存失效，仅作用于本进程；
+        其他进程由凭据版本号发现密码变化
+        :param uid: 用户ID
+        :return:
+        """
+
+        with cls._user_sessions_lock:
+            keys = cls._user_sessions.pop(uid, ())
+
+        for k in keys:
+            cls._user_cache.delete(k)
+
     @classmethod
     def get_authenticated_user_mongo(cls,request):
         """
-        从请求中获取已验证对象，mongo后端
+        从请求中获取已验证对象，mongo后端；与auth.get_user相同，检查会话的验证后端和会话验证哈希，
+        哈希不匹配（密码已修改）时清空会话
         :param request: 请求
-        :return: User对象，或者None
+        :return: UserPrincipal对象，或者None
         """
 
-        user=auth_mongo.get_user(request)
-        return user if user.is_authenticated() else None
+        try:
+            uid = int(request.session[auth.SESSION_KEY])
+        except (KeyError, ValueError, TypeError):
+            return None
+
+        if request.session.get(auth.BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+            return None
+
+        user = UserPrincipal.load(uid)
+        if user is None:
+            return None
+
+        session_hash = request.session.get(auth.HASH_SESSION_KEY)
+        if not session_hash or not constant_time_compare(session_hash, user.get_session_auth_hash()):
+            request.session.flush()
+            return None
+
+        return user
 
     @classmethod
     def get_authenticated_user_sql(cls, request):
@@ -54,34 +186,55 @@ class Auth(object):
     @classmethod
     def authenticate(cls, username, password):
         """
-        验证用户凭据
+        验证用户凭据，密码哈希未能完成时抛出PasswordHashError
         :param username: 用户名
         :param password: 密码
         :return: 验证通过返回用户对象，否则None
         """
 
-        user=cls.authenticate_mongo(username, password)
-        return user if user else cls.authenticate_sql(username, password)
+        user = cls._get_credentials(username)
+        if user is None:
+            return None
+
+        # 密码哈希两个后端共用，仅验证一次
+        ok, must_update = verify_password(password, user.password)
+        if not ok:
+            return None
+
+        if must_update:
+            # 哈希参数已变化，重新计算并写入，失败时下次登录再重新计算
+            try:
+                cls.set_password(user.id, hash_password(password))
+            except PasswordHashError:
+                pass
+
+        return user
 
     @classmethod
-    def authenticate_mongo(cls, username,password):
+    def _get_credentials(cls, username):
         """
-        验证用户凭据，mongo后端
+        获取用户凭据，优先mongo后端
         :param username: 用户名
-        :param password: 密码
-        :return: 验证通过返回用户对象，否则None
+        :return: 仅含id、username、password的用户对象，或者None
         """
-        return auth_mongo.authenticate(username,password)
+
+        user = UserMongo.objects(username=username).only('id', 'username', 'password').first()
+        if user is None:
+            user = User.objects.filter(username=username).only('id', 'username', 'password').first()
+
+        return user
 
     @classmethod
-    def authenticate_sql(cls, username, password):
+    def set_password(cls, uid, encoded):
         """
-        验证用户凭据，sql后端
-        :param username: 用户名
-        :param password: 密码
-        :return: 验证通过返回用户对象，否则None
+        更新各后端的密码哈希
+        :param uid: 用户ID
+        :param encoded: 密码哈希
+        :return:
         """
-        return auth.authenticate(username, password)
+
+        UserMongo.objects(id=uid).update_one(set__password=encoded, inc__auth_version=1)
+        User.objects.filter(id=uid).update(password=encoded)
 
     @classmethod
     def get_no_permission_msg(cls):
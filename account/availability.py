@@ -0,0 +1,202 @@
+from bson import ObjectId
+from account.models import UserMongo
+from LH.bloom import BloomFilter
+from LH.settings import USER_BLOOM
+import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AvailabilityIndex(object):
+    """
+    用户名与手机号可用性索引，布隆过滤器判定不存在时无需查询数据库。
+
+    每个进程首次检查时启动后台线程构建，构建失败时按退避间隔重试；构建后每隔POLL_INTERVAL按文档主键中的创建时间
+    增量加载新注册的用户，包括其他进程注册的用户；尚未构建或超过MAX_LAG未成功加载时不信任过滤器，直接查询数据库。
+    两次增量加载之间其他进程注册的用户仍可能被判定为可用，注册时由唯一索引兜底
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.USER_BLOOM
+        """
+
+        self._config = config
+        self._usernames = None
+        self._mobiles = None
+        self._building = None
+        self._since = None
+        self._polled_at = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        启动后台线程，构建索引并定时增量加载
+        :return:
+        """
+        threading.Thread(target=self._run, name='availability-index', daemon=True).start()
+
+    def _ensure_started(self):
+        """
+        当前进程首次使用时启动后台线程，分叉后的子进程沿用父进程已构建的过滤器
+        :return:
+        """
+
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        self.start()
+
+    def _run(self):
+        """
+        后台线程主循环：尚未构建时构建，失败时退避重试；已构建时每隔POLL_INTERVAL增量加载
+        :return:
+        """
+
+        backoff = self._config['POLL_INTERVAL']
+        while True:
+            if self._usernames is None:
+                if self.rebuild():
+                    backoff = self._config['POLL_INTERVAL']
+                else:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self._config['MAX_BACKOFF'])
+                    continue
+            else:
+                self._poll()
+
+            time.sleep(self._config['POLL_INTERVAL'])
+
+    def rebuild(self):
+        """
+        从用户集合流式重建索引，重建期间的新注册同时写入新旧过滤器
+        :return: 成功返回真，失败返回假
+        """
+
+        # 此后创建的用户由增量加载补充
+        since = datetime.datetime.utcnow()
+
+        try:
+            capacity = max(self._config['CAPACITY'], UserMongo.objects.count() * 2)
+        except Exception:
+            logger.exception('availability index rebuild failed')
+            return False
+
+        usernames = BloomFilter(capacity, self._config['ERROR_RATE'])
+        mobiles = BloomFilter(capacity, self._config['ERROR_RATE'])
+
+        with self._lock:
+            self._building = (usernames, mobiles)
+
+        try:
+            for u in UserMongo.objects.only('username', 'mobile').as_pymongo().batch_size(
+                    self._config['BATCH_SIZE']):
+                if u.get('username'):
+                    usernames.add(u['username'])
+                if u.get('mobile'):
+                    mobiles.add(u['mobile'])
+        except Exception:
+            logger.exception('availability index rebuild failed')
+            with self._lock:
+                self._building = None
+            return False
+
+        with self._lock:
+            self._usernames, self._mobiles = usernames, mobiles
+            self._building = None
+            self._since = since
+            self._polled_at = time.monotonic()
+
+        logger.info('availability index rebuilt with %d users', len(usernames))
+        return True
+
+    def _poll(self):
+        """
+        增量加载新注册的用户，在后台线程中执行；
+        文档主键中的创建时间由各服务器生成，加载范围向前重叠POLL_OVERLAP以容忍时钟偏差和写入延迟
+        :return:
+        """
+
+        since = datetime.datetime.utcnow()
+        start = ObjectId.from_datetime(self._since - datetime.timedelta(seconds=self._config['POLL_OVERLAP']))
+
+        try:
+            users = list(UserMongo.objects(__raw__={'_id': {'$gte': start}}).only('username', 'mobile')
+                         .as_pymongo())
+        except Exception:
+            logger.exception('availability index poll failed')
+            return
+
+        for u in users:
+            self.add(u.get('username'), u.get('mobile'))
+
+        self._since = since
+        self._polled_at = time.monotonic()
+
+    def _is_fresh(self):
+        """
+        过滤器是否可用于判定不存在：已构建且MAX_LAG内增量加载成功过
+        :return: 可用返回真，否则假
+        """
+
+        if not self._config['ENABLED']:
+            return False
+
+        self._ensure_started()
+        return self._usernames is not None and time.monotonic() - self._polled_at < self._config['MAX_LAG']
+
+    def add(self, username=None, mobile=None):
+        """
+        注册成功后加入索引
+        :param username: 用户名
+        :param mobile: 手机号
+        :return:
+        """
+
+        with self._lock:
+            filters = [f for f in ((self._usernames, self._mobiles), self._building) if f and f[0] is not None]
+
+        for usernames, mobiles in filters:
+            if username:
+                usernames.add(username)
+            if mobile:
+                mobiles.add(mobile)
+
+    def is_username_available(self, username):
+        """
+        检查用户名是否可用
+        :param username: 用户名
+        :return: 可用返回真，否则假
+        """
+
+        if self._is_fresh() and username not in self._usernames:
+            return True
+
+        return not UserMongo.objects(username=username).only('id').first()
+
+    def is_mobile_available(self, mobile):
+        """
+        检查手机号是否可用
+        :param mobile: 手机号
+        :return: 可用返回真，否则假
+        """
+
+        if self._is_fresh() and mobile not in self._mobiles:
+            return True
+
+        return not UserMongo.objects(mobile=mobile).only('id').first()
+
+
+# 进程内共享的可用性索引
+availability_index = AvailabilityIndex(USER_BLOOM)
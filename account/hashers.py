@@ -0,0 +1,10 @@
+from django.contrib.auth import hashers
+from LH.settings import PASSWORD_HASH
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    迭代次数可配置的PBKDF2哈希器，迭代次数变化后旧哈希会在登录时重新计算
+    """
+
+    iterations = PASSWORD_HASH['ITERATIONS']
@@ -0,0 +1,36 @@
+from account.models import User, UserMongo
+from django.db.models import Case, When, Value, DateTimeField
+from pymongo import UpdateOne
+from LH.buffer import WriteBehindBuffer
+from LH.settings import LOGIN_TIME_FLUSH_INTERVAL
+import datetime
+
+
+def _flush_login_times(items):
+    """
+    批量写入最后登录时间，mongo后端使用bulk_write，sql后端使用单条UPDATE
+    :param items: {用户ID: 最后登录时间}
+    :return:
+    """
+
+    field = UserMongo._fields['last_login_time'].db_field
+    UserMongo._get_collection().bulk_write(
+        [UpdateOne(UserMongo.objects(id=uid)._query, {'$max': {field: t}}) for uid, t in items.items()],
+        ordered=False)
+
+    User.objects.filter(id__in=list(items)).update(
+        last_login_time=Case(*[When(id=uid, then=Value(t)) for uid, t in items.items()],
+                             output_field=DateTimeField()))
+
+
+# 最后登录时间缓冲区，同一用户仅保留最新的时间
+login_time_buffer = WriteBehindBuffer(_flush_login_times, LOGIN_TIME_FLUSH_INTERVAL, merge=max)
+
+
+def touch_login_time(uid):
+    """
+    记录用户登录，最后登录时间由缓冲区定时批量写入
+    :param uid: 用户ID
+    :return:
+    """
+    login_time_buffer.put(uid, datetime.datetime.now())
@@ -23,7 +23,7 @@ class FollowMongo(Document):
     time = DateTimeField(default=datetime.datetime.now)
 
     # 元数据：指定集合和索引
-    meta = {'collection': 'follow'}
+    meta = {'collection': 'follow', 'indexes': [{'fields': ['uid', 'follow_id'], 'unique': True}, '+follow_id']}
 
     def __str__(self):
         """
@@ -55,6 +55,8 @@ class UserMongo(Document):
       qq_token: QQ token，字符串
       wechat_token: 微信token，字符串
       login_login_time: 最后登录时间，日期型
+      profile_version: 资料版本号，资料中的计数或头像变化时加一，整型
+      auth_version: 凭据版本号，密码变化时加一，整型
     """
 
     # 字段声明
@@ -64,7 +66,7 @@ class UserMongo(Document):
     reg_time = DateTimeField(default=datetime.datetime.now)
     reg_source = StringField(max_length=50, default='mobile')
     mobile = StringField(regex=r'^1\d{10}', unique=True, required=True)
-    password = StringField(regex=r'[0-9a-fA-F]{3}', required=True)
+    password = StringField(max_length=128, required=True)
     portrait = URLField(default=DEFAULT_PORTRAIT_URL)
     followings = ListField(ReferenceField('FollowMongo'), default=[])
     followers = ListField(ReferenceField('FollowMongo'), default=[])
@@ -77,9 +79,11 @@ class UserMongo(Document):
     qq_token = StringField(max_length=256, default='')
     wechat_token = StringField(max_length=256, default='')
     last_login_time = DateTimeField(default=datetime.datetime.now)
+    profile_version = IntField(default=0)
+    auth_version = IntField(default=0)
 
     # 元数据：指定集合和索引
-    meta = {'collection': 'user', 'indexes': ['+id', '+username', '+mobile']}
+    meta = {'collection': 'user', 'indexes': ['+id', '+username', '+mobile', '#qq_token', '#wechat_token']}
 
     def __str__(self):
         """
@@ -143,14 +147,14 @@ class User(models.Model):
     reg_time = models.DateTimeField(default=datetime.datetime.now)
     reg_source = models.CharField(max_length=10, default='mobile')
     mobile = models.CharField(max_length=11)
-    password = models.CharField(max_length=32)
+    password = models.CharField(max_length=128)
     portrait = models.URLField(default=DEFAULT_PORTRAIT_URL)
     follow_num = models.IntegerField(default=0)
     follower_num = models.IntegerField(default=0)
     topic_num = models.IntegerField(default=0)
     collected_market_num = models.IntegerField(default=0)
-    qq_token = models.CharField(max_length=256, default='')
-    wechat_token = models.CharField(max_length=256, default='')
+    qq_token = models.CharField(max_length=256, default='', db_index=True)
+    wechat_token = models.CharField(max_length=256, default='', db_index=True)
     last_login_time = models.DateTimeField(default=datetime.datetime.now)
 
 
@@ -0,0 +1,135 @@
+from django.contrib.auth.hashers import make_password, check_password, identify_hasher
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from LH.settings import PASSWORD_HASH
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 密码哈希进程池，首次使用时创建
+_executor = None
+_executor_lock = threading.Lock()
+
+# 已提交未完成的哈希数上限，包括正在执行的
+_slots = threading.BoundedSemaphore(PASSWORD_HASH['WORKERS'] + PASSWORD_HASH['QUEUE_SIZE'])
+
+
+class PasswordHashError(Exception):
+    """
+    密码哈希未能完成：排队已满、超时或进程池异常退出
+    """
+
+
+def _init_worker(settings_module):
+    """
+    哈希进程的初始化程序，使用与父进程相同的Django配置
+    :param settings_module: 配置模块名
+    :return:
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+
+
+def _get_executor():
+    """
+    获取密码哈希进程池。使用spawn方式启动，避免从已有后台线程的WSGI进程中fork
+    :return: ProcessPoolExecutor对象
+    """
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH['WORKERS'],
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'LH.settings'),))
+        return _executor
+
+
+def _reset_executor(executor):
+    """
+    丢弃异常退出的进程池，下次使用时重新创建
+    :param executor: 异常的进程池
+    :return:
+    """
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+    executor.shutdown(wait=False)
+
+
+def _run(func, *args):
+    """
+    在进程池中执行并等待结果
+    :param func: 函数
+    :param args: 参数
+    :return: 函数返回值
+    """
+
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashError('password hash queue full')
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(func, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _reset_executor(executor)
+        raise PasswordHashError('password hash pool broken')
+
+    # 超时后仍在执行的哈希完成时才释放名额
+    future.add_done_callback(lambda f: _slots.release())
+
+    try:
+        return future.result(PASSWORD_HASH['TIMEOUT'])
+    except TimeoutError:
+        future.cancel()
+        raise PasswordHashError('password hash timeout')
+    except BrokenProcessPool:
+        logger.exception('password hash pool broken')
+        _reset_executor(executor)
+        raise PasswordHashError('password hash pool broken')
+
+
+def _verify(password, encoded):
+    """
+    验证密码，在进程池中执行
+    :param password: 明文密码
+    :param encoded: 密码哈希
+    :return: (是否正确, 是否需要重新哈希)
+    """
+
+    if not check_password(password, encoded):
+        return False, False
+
+    return True, identify_hasher(encoded).must_update(encoded)
+
+
+def hash_password(password):
+    """
+    在进程池中计算密码哈希
+    :param password: 明文密码
+    :return: 密码哈希，未能完成时抛出PasswordHashError
+    """
+    return _run(make_password, password)
+
+
+def verify_password(password, encoded):
+    """
+    在进程池中验证密码
+    :param password: 明文密码
+    :param encoded: 密码哈希
+    :return: (是否正确, 是否需要重新哈希)，未能完成时抛出PasswordHashError
+    """
+
+    if not encoded:
+        return False, False
+
+    return _run(_verify, password, encoded)
@@ -0,0 +1,112 @@
+from django.core.files.uploadhandler import TemporaryFileUploadHandler, StopUpload
+from mongoengine import *
+from LH.settings import PORTRAIT_UPLOAD
+import datetime
+import hashlib
+import os
+import shutil
+
+
+class PortraitMongo(Document):
+    """
+    头像MongoDB数据模型，按内容哈希去重，各字段说明如下：
+
+      digest: 内容sha256哈希，字符串
+      url: 头像url，URL
+      size: 文件大小，整型
+      status: 状态，0为待上传，1为已上传，整型
+      time: 上传时间，日期型
+    """
+
+    # 字段声明
+
+    digest = StringField(primary_key=True, max_length=64)
+    url = URLField(required=True)
+    size = IntField(required=True)
+    status = IntField(default=0)
+    time = DateTimeField(default=datetime.datetime.now)
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'portrait'}
+
+
+class PortraitUploadHandler(TemporaryFileUploadHandler):
+    """
+    头像上传处理器，分块写入临时文件，同时限制大小并增量计算哈希。
+
+    需在读取request.POST或request.FILES之前设置到request.upload_handlers，
+    因此视图需免除CsrfViewMiddleware的预读取（csrf_exempt后在视图内用csrf_protect校验）。
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.too_large = False
+        self._digest = None
+        self._size = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._digest = hashlib.sha256()
+        self._size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self._size > PORTRAIT_UPLOAD['MAX_SIZE']:
+            # 超出大小限制，停止读取
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+
+        self._digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self._digest.hexdigest()
+        return uploaded
+
+
+def get_spool_path(digest):
+    """
+    获取待上传文件的暂存路径
+    :param digest: 内容哈希
+    :return: 文件路径
+    """
+    return os.path.join(PORTRAIT_UPLOAD['SPOOL_DIR'], digest)
+
+
+def store_portrait(uploaded):
+    """
+    保存上传的头像，相同内容已上传完成时直接返回已有url，否则暂存文件等待上传；
+    相同内容的记录存在但尚未上传完成（如推送任务转入死信）时，重新暂存并要求上传
+    :param uploaded: PortraitUploadHandler生成的上传文件
+    :return: (头像url, 是否需要上传)
+    """
+
+    digest = uploaded.sha256
+
+    portrait = PortraitMongo.objects(digest=digest).only('url', 'status').first()
+    if portrait and portrait.status == 1:
+        # 相同内容已上传过
+        return portrait.url, False
+
+    url = portrait.url if portrait else PORTRAIT_UPLOAD['URL_PREFIX'] + digest
+
+    # 暂存到worker可读取的目录，同一文件系统下使用硬链接避免复制
+    os.makedirs(PORTRAIT_UPLOAD['SPOOL_DIR'], exist_ok=True)
+    path = get_spool_path(digest)
+    if not os.path.exists(path):
+        try:
+            os.link(uploaded.temporary_file_path(), path)
+        except OSError:
+            shutil.copyfile(uploaded.temporary_file_path(), path)
+
+    if portrait:
+        return url, True
+
+    try:
+        PortraitMongo(digest=digest, url=url, size=uploaded.size).save(force_insert=True)
+    except NotUniqueError:
+        # 并发上传了相同内容
+        return url, False
+
+    return url, True
@@ -0,0 +1,148 @@
+from django.utils.crypto import salted_hmac
+from account.models import UserMongo
+from bson.dbref import DBRef
+
+
+class UserPrincipal(object):
+    """
+    已验证用户的轻量表示，仅包含身份、计数与token字段，各字段说明如下：
+
+      pk: 文档主键，即_id，ObjectId
+      id: ID, 整型
+      username: 用户名，字符串
+      mobile: 手机号，字符串
+      portrait: 头像url，字符串
+      reg_source: 注册来源，字符串
+      follow_num: 关注数，整型
+      follower_num: 粉丝数，整型
+      topic_num: 主题数，整型
+      collected_market_num: 收藏的市场数，整型
+      qq_token: QQ token，字符串
+      wechat_token: 微信token，字符串
+      profile_version: 资料版本号，整型
+      auth_version: 凭据版本号，整型
+
+    followings、followers、topics、collected_markets等引用列表仅在访问时按需加载
+    """
+
+    # 投影字段
+    _fields = ('id', 'username', 'mobile', 'portrait', 'reg_source', 'follow_num', 'follower_num', 'topic_num',
+               'collected_market_num', 'qq_token', 'wechat_token', 'profile_version', 'auth_version')
+
+    # 按需加载的引用列表字段
+    _lazy_fields = ('followings', 'followers', 'topics', 'collected_markets')
+
+    __slots__ = _fields + ('pk', '_lazy', '_document')
+
+    def __init__(self, pk=None, **kwargs):
+        """
+        初始化
+        :param pk: 文档主键
+        :param kwargs: 字段值
+        """
+
+        self.pk = pk
+        for f in self._fields:
+            setattr(self, f, kwargs.get(f, UserMongo._fields[f].default))
+
+        self._lazy = {}
+        self._document = None
+
+    @classmethod
+    def load(cls, uid):
+        """
+        通过投影查询加载用户
+        :param uid: 用户ID
+        :return: UserPrincipal对象 或 None
+        """
+
+        son = UserMongo.objects(id=uid).only(*cls._fields).as_pymongo().first()
+        if not son:
+            return None
+
+        return cls(pk=son['_id'], **dict((f, son.get(UserMongo._fields[f].db_field)) for f in cls._fields))
+
+    @property
+    def document(self):
+        """
+        完整的用户文档，首次访问时加载
+        :return: UserMongo对象
+        """
+
+        if self._document is None:
+            self._document = UserMongo.objects(id=self.id).first()
+
+        return self._document
+
+    def _load_lazy(self, name):
+        """
+        加载引用列表字段
+        :param name: 字段名
+        :return: 列表
+        """
+
+        if name not in self._lazy:
+            if self._document is not None:
+                self._lazy[name] = getattr(self._document, name)
+            else:
+                user = UserMongo.objects(id=self.id).only(name).first()
+                self._lazy[name] = getattr(user, name) if user else []
+
+        return self._lazy[name]
+
+    @property
+    def followings(self):
+        return self._load_lazy('followings')
+
+    @property
+    def followers(self):
+        return self._load_lazy('followers')
+
+    @property
+    def topics(self):
+        return self._load_lazy('topics')
+
+    @property
+    def collected_markets(self):
+        return self._load_lazy('collected_markets')
+
+    def update(self, **kwargs):
+        """
+        更新用户文档，参数同Document.update
+        :param kwargs: 更新操作
+        :return: 更新的文档数
+        """
+
+        # 已加载的引用列表可能过期
+        self._lazy.clear()
+        self._document = None
+
+        return UserMongo.objects(id=self.id).update_one(**kwargs)
+
+    def to_dbref(self):
+        """
+        用于引用字段赋值，引用字段保存的是文档主键而不是整型ID
+        :return: DBRef对象
+        """
+
+        pk = self.pk if self.pk is not None else self.document.pk
+        return DBRef(UserMongo._get_collection_name(), pk)
+
+    def is_authenticated(self):
+        return True
+
+    def get_session_auth_hash(self):
+        """
+        会话验证哈希，由凭据版本号生成，密码变化后已有会话失效；auth.login保存到会话中
+        :return: 哈希字符串
+        """
+
+        key_salt = 'account.principal.UserPrincipal.get_session_auth_hash'
+        return salted_hmac(key_salt, '%s:%s' % (self.id, self.auth_version)).hexdigest()
+
+    def __str__(self):
+        """
+        string representation
+        :return:
+        """
+        return '<id: %s, username: %s>' % (self.id, self.username)
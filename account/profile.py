@@ -0,0 +1,97 @@
+from account.auth import Auth
+from account.models import UserMongo
+from LH.cache import LRUCache
+from LH.settings import PROFILE_CACHE
+import json
+
+
+class ProfileSnapshot(object):
+    """
+    用户资料快照，缓存预先序列化的响应内容，以版本号判断是否过期。
+
+    topic_num、follower_num、follow_num、collected_market_num或portrait变化时，
+    写入方需同时对UserMongo.profile_version加一，并调用touch清理本进程缓存。
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.PROFILE_CACHE
+        """
+        self._cache = LRUCache(config['MAX_SIZE'], config['TTL'])
+
+    @staticmethod
+    def get_version(uid):
+        """
+        从数据库读取当前版本号
+        :param uid: 用户ID
+        :return: 版本号 或 None
+        """
+
+        son = UserMongo.objects(id=uid).only('profile_version').as_pymongo().first()
+        if son is None:
+            return None
+
+        return son.get(UserMongo._fields['profile_version'].db_field, 0)
+
+    @staticmethod
+    def etag(uid, version):
+        """
+        生成ETag
+        :param uid: 用户ID
+        :param version: 版本号
+        :return: ETag字符串
+        """
+        return '"profile-%d-%d"' % (uid, version)
+
+    def get(self, user, version, success_msg):
+        """
+        获取快照，版本号不一致时重新生成
+        :param user: 已验证的用户对象
+        :param version: 当前版本号
+        :param success_msg: 成功消息
+        :return: 序列化的响应内容，用户已被删除时返回None
+        """
+
+        entry = self._cache.get(user.id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        if user.profile_version != version:
+            # 已验证用户对象已过期，重新加载
+            uid = user.id
+            user = UserMongo.objects(id=uid).first()
+            if user is None:
+                self.touch(uid)
+                return None
+
+        data = {'id': user.id,
+                'username': user.username,
+                'mobile': user.mobile,
+                'portrait': user.portrait,
+                'topic_num': user.topic_num,
+                'following_num': user.follow_num,
+                'follower_num': user.follower_num,
+                'collected_market_num': user.collected_market_num}
+
+        result = dict(success_msg)
+        result['data'] = data
+
+        body = json.dumps(result).encode()
+        self._cache.set(user.id, (version, body))
+        return body
+
+    def touch(self, *uids):
+        """
+        用户资料变化后清理本进程中的快照与已验证用户缓存
+        :param uids: 用户ID
+        :return:
+        """
+
+        for uid in uids:
+            self._cache.delete(uid)
+            Auth.invalidate_user(uid)
+
+
+# 进程内共享的用户资料快照
+profile_snapshot = ProfileSnapshot(PROFILE_CACHE)
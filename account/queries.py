@@ -0,0 +1,16 @@
+"""
+账户相关视图使用的查询形状
+"""
+
+from account.models import UserMongo
+from account.portrait import PortraitMongo
+from account.sms import SmsCodeMongo
+from LH.indexaudit import register
+
+register(UserMongo, {'id': 1})
+register(UserMongo, {'username': 'username'})
+register(UserMongo, {'mobile': '13800000000'})
+register(UserMongo, {'qq_token': 'token'})
+register(UserMongo, {'wechat_token': 'token'})
+register(PortraitMongo, {'_id': 'digest'})
+register(SmsCodeMongo, {'_id': '13800000000'})
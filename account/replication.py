@@ -0,0 +1,11 @@
+"""
+账户变更在sql后端的重放处理程序
+"""
+
+from account.views import RegView
+from LH.outbox import replicated
+
+
+@replicated('account.register')
+def register(uid, username, password_hash, mobile):
+    return RegView().register_database_handler(uid, username, password_hash, mobile)
@@ -0,0 +1,123 @@
+from mongoengine import *
+from pymongo.errors import DuplicateKeyError
+from LH.ratelimit import SharedWindowLimiter
+from LH.settings import SMS_CODE
+import datetime
+
+
+class SmsCodeMongo(Document):
+    """
+    短信验证码MongoDB数据模型，各字段说明如下：
+
+      mobile: 手机号，字符串
+      code: 验证码，字符串，发送任务完成前为空
+      attempts: 错误验证次数，整型
+      send_time: 发送时间，日期型
+      expire_time: 过期时间，日期型，由TTL索引自动清理
+    """
+
+    # 字段声明
+
+    mobile = StringField(primary_key=True, regex=r'^1\d{10}')
+    code = StringField(max_length=10)
+    attempts = IntField(default=0)
+    send_time = DateTimeField(required=True)
+    expire_time = DateTimeField(required=True)
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'sms_code', 'indexes': [{'fields': ['expire_time'], 'expireAfterSeconds': 0}]}
+
+
+class SmsCodeStore(object):
+    """
+    短信验证码存储，所有判断都由MongoDB上的单次原子操作完成，多进程间一致
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.SMS_CODE
+        """
+
+        self._config = config
+        self._mobile_limiter = SharedWindowLimiter('sms.mobile', config['MOBILE_LIMIT'], config['LIMIT_WINDOW'])
+        self._ip_limiter = SharedWindowLimiter('sms.ip', config['IP_LIMIT'], config['LIMIT_WINDOW'])
+
+    def allow_send(self, mobile, ip):
+        """
+        检查是否允许发送验证码，同时限制重发间隔、单个手机号和单个IP的发送频率；
+        允许时即占用重发间隔，并发请求中只有一个通过；任一限制未通过时退回已计入的次数
+        :param mobile: 手机号
+        :param ip: 客户端IP
+        :return: 允许返回真，否则假
+        """
+
+        mobile_counter = self._mobile_limiter.allow(mobile)
+        if mobile_counter is None:
+            return False
+
+        ip_counter = self._ip_limiter.allow(ip)
+        if ip_counter is None:
+            self._mobile_limiter.refund(mobile_counter)
+            return False
+
+        # 重发间隔内已有发送记录时按主键冲突失败；新的发送使之前的验证码失效
+        now = datetime.datetime.utcnow()
+        resend_after = now - datetime.timedelta(seconds=self._config['RESEND_INTERVAL'])
+        try:
+            SmsCodeMongo._get_collection().update_one(
+                {'_id': mobile, 'send_time': {'$lte': resend_after}},
+                {'$set': {'send_time': now, 'attempts': 0,
+                          'expire_time': now + datetime.timedelta(seconds=self._config['TTL'])},
+                 '$unset': {'code': ''}},
+                upsert=True)
+        except DuplicateKeyError:
+            self._mobile_limiter.refund(mobile_counter)
+            self._ip_limiter.refund(ip_counter)
+            return False
+
+        return True
+
+    def save(self, mobile, code):
+        """
+        保存已发送的验证码
+        :param mobile: 手机号
+        :param code: 验证码
+        :return:
+        """
+
+        now = datetime.datetime.utcnow()
+        SmsCodeMongo._get_collection().update_one(
+            {'_id': mobile},
+            {'$set': {'code': code, 'attempts': 0,
+                      'expire_time': now + datetime.timedelta(seconds=self._config['TTL'])},
+             '$setOnInsert': {'send_time': now}},
+            upsert=True)
+
+    def verify(self, mobile, code):
+        """
+        验证验证码，验证成功后失效，错误次数达到上限后失效；
+        验证与失效为同一次find_one_and_delete，同一验证码只能验证成功一次
+        :param mobile: 手机号
+        :param code: 验证码
+        :return: 正确返回真，否则假
+        """
+
+        collection = SmsCodeMongo._get_collection()
+        now = datetime.datetime.utcnow()
+
+        consumed = collection.find_one_and_delete({'_id': mobile, 'code': code, 'expire_time': {'$gt': now},
+                                                   'attempts': {'$lt': self._config['MAX_ATTEMPTS']}},
+                                                  projection={'_id': True})
+        if consumed is not None:
+            return True
+
+        # 错误次数在数据库中累加
+        collection.update_one({'_id': mobile, 'code': {'$exists': True},
+                               'attempts': {'$lt': self._config['MAX_ATTEMPTS']}}, {'$inc': {'attempts': 1}})
+
+        return False
+
+
+# 进程内共享的验证码存储
+sms_code_store = SmsCodeStore(SMS_CODE)
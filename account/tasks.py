@@ -0,0 +1,98 @@
+from account.sms import sms_code_store
+from account.portrait import PortraitMongo, get_spool_path
+from LH.tasks import task
+from LH.utils import http_fetch, http_client
+from LH.settings import THIRD_PARTY_API, PORTRAIT_UPLOAD
+import json
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+@task(queue='sms')
+def send_sms_code(mobile):
+    """
+    通过第三方平台发送短信验证码，并存入验证码存储
+    :param mobile: 手机号
+    :return: 发送成功返回真
+    """
+
+    result = http_fetch(THIRD_PARTY_API['SMS_CODE'], {'mobile': mobile}, 'SMS_CODE')
+    if not result:
+        raise RuntimeError('sms code send failed: %s' % mobile)
+
+    sms_code_store.save(mobile, json.loads(result)['data'])
+    return True
+
+
+@task(queue='login')
+def check_token(source, token):
+    """
+    通过第三方平台检测token
+    :param source: 用户来源
+    :param token: 第三方token
+    :return: 成功返回昵称，token被第三方平台拒绝返回None
+    """
+
+    api = {'qq': 'QQ_LOGIN', 'wechat': 'WECHAT_LOGIN'}[source]
+
+    # 超时、熔断和5xx响应抛出HttpClientError，任务失败后重试，不视为token无效
+    result = http_client.request(THIRD_PARTY_API[api], {'token': token}, endpoint=api)
+    if not result:
+        # 4xx响应
+        return None
+
+    return json.loads(result.decode()).get('nickname')
+
+
+@task(queue='upload')
+def process_portrait(digest):
+    """
+    生成头像缩略图并推送到七牛云，完成后删除暂存文件；已上传完成时跳过，重复加入队列的任务不重复推送
+    :param digest: 内容哈希
+    :return: 头像url
+    """
+
+    url = PORTRAIT_UPLOAD['URL_PREFIX'] + digest
+    if PortraitMongo.objects(digest=digest, status=1).only('digest').first():
+        return url
+
+    path = get_spool_path(digest)
+
+    # 推送原图，上传key为内容哈希
+    _push_to_cdn(path, digest)
+
+    # 生成并推送缩略图，未安装Pillow时跳过
+    if Image is not None:
+        thumb_path = path + '_thumb'
+        with Image.open(path) as image:
+            image.thumbnail(PORTRAIT_UPLOAD['THUMB_SIZE'])
+            image.save(thumb_path, image.format)
+
+        _push_to_cdn(thumb_path, digest + '_thumb')
+        os.remove(thumb_path)
+
+    PortraitMongo.objects(digest=digest).update_one(set__status=1)
+    os.remove(path)
+
+    return url
+
+
+def _push_to_cdn(path, key):
+    """
+    以流的方式上传文件到七牛云
+    :param path: 文件路径
+    :param key: 上传key
+    :return:
+    """
+
+    with open(path, 'rb') as f:
+        result = http_client.request('%s?key=%s' % (THIRD_PARTY_API['QINIU'], key), f, 'QINIU',
+                                     {'Content-Type': 'application/octet-stream',
+                                      'Content-Length': str(os.path.getsize(path))})
+
+    if not result:
+        raise RuntimeError('portrait push failed: %s' % key)
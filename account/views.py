@@ -1,10 +1,22 @@
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, HttpResponseNotModified
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django import views
 from account.models import User, UserMongo
 from account.auth import Auth
-from django.contrib.auth.hashers import make_password
-from LH.utils import http_fetch
-from LH.settings import THIRD_PARTY_API
+from account.login_time import touch_login_time
+from account.availability import availability_index
+from account.sms import sms_code_store
+from account.profile import profile_snapshot
+from account.principal import UserPrincipal
+from account.portrait import PortraitUploadHandler, store_portrait
+from account.passwords import hash_password, PasswordHashError
+from account import tasks
+from LH.tasks import task_queue, PENDING, RUNNING, DONE
+from LH.cache import LRUCache
+from LH.dualwrite import dual_write
+from LH.idalloc import id_allocator
+from LH.settings import TOKEN_CACHE, PORTRAIT_UPLOAD
 import re
 import json
 import datetime
@@ -22,6 +34,9 @@ class RegView(views.View):
                   'pass_error': {'code': 1003, 'msg': '密码格式不正确，请确保长度在8-20个字符之间'},
                   'sms_send_error': {'code': 1004, 'msg': '短信验证码发送失败'},
                   'sms_verify_error': {'code': 1005, 'msg': '短信验证码错误'},
+                  'name_used_error': {'code': 1006, 'msg': '用户名已被注册'},
+                  'mobile_used_error': {'code': 1007, 'msg': '手机号已被注册'},
+                  'sms_limit_error': {'code': 1008, 'msg': '验证码请求过于频繁'},
                   'general_error': {'code': 1000, 'msg': '注册失败'}
                   }
 
@@ -44,23 +59,67 @@ class RegView(views.View):
         if not self.check_username(username) or not self.check_mobile(mobile) or not self.check_password(password):
             return self._error_response
 
-        # 写入数据库
-        if not self.register_database_handler_mongo(username, password, mobile) or not self.register_database_handler(
-                username, password, mobile)
+        # 验证是否已被注册
+        if not availability_index.is_username_available(username):
+            return HttpResponse(json.dumps(self._error_msg['name_used_error']))
+
+        if not availability_index.is_mobile_available(mobile):
+            return HttpResponse(json.dumps(self._error_msg['mobile_used_error']))
+
+        # 计算一次密码哈希，两个后端共用
+        try:
+            password_hash = hash_password(password)
+        except PasswordHashError:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
+
+        # 写入数据库，两个后端使用同一ID
+        uid = id_allocator.next_id('user')
+        if not all(dual_write.run(lambda: self.register_database_handler_mongo(uid, username, password_hash, mobile),
+                                  lambda: self.register_database_handler(uid, username, password_hash, mobile),
+                                  failure=False,
+                                  replay=('account.register', [uid, username, password_hash, mobile]))):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        # 加入可用性索引
+        availability_index.add(username, mobile)
+
         # 返回成功响应
         return HttpResponse(json.dumps(self._success_msg))
 
-    def register_database_handler_mongo(self, username, password, mobile):
+    def check_availability(self, request):
+        """
+        检查用户名和手机号是否可用，可只提供其中一项
+        :param request: 请求
+        :return: 各项是否可用
+        """
+
+        # 获取参数
+        username = request.POST.get('username', '')
+        mobile = request.POST.get('mobile', '')
+
+        if username == '' and mobile == '':
+            return HttpResponse(json.dumps(self._error_msg['name_error']))
+
+        data = {}
+        if username != '':
+            data['username'] = availability_index.is_username_available(username)
+        if mobile != '':
+            data['mobile'] = availability_index.is_mobile_available(mobile)
+
+        # 返回正确响应
+        result = copy.copy(self._success_msg)
+        result['data'] = data
+        return HttpResponse(json.dumps(result))
+
+    def register_database_handler_mongo(self, uid, username, password_hash, mobile):
         """
         注册时的mongo数据库处理器
         :return: 成功返回真，失败返回假
         """
 
         # 写入数据库
-        new_user = UserMongo(username=username)
-        new_user.password = make_password(password)
+        new_user = UserMongo(id=uid, username=username)
+        new_user.password = password_hash
         new_user.mobile = mobile
 
         new_user.last_login_time = datetime.datetime.now
@@ -68,15 +127,15 @@ class RegView(views.View):
 
         return True
 
-    def register_database_handler(self, username, password, mobile):
+    def register_database_handler(self, uid, username, password_hash, mobile):
         """
         注册时的数据库处理器
         :return: 成功返回真，失败返回假
         """
 
         # 写入数据库
-        new_user = User(username=username)
-        new_user.password = make_password(password)
+        new_user = User(id=uid, username=username)
+        new_user.password = password_hash
         new_user.mobile = mobile
 
         new_user.last_login_time = datetime.datetime.now
@@ -135,18 +194,24 @@ class RegView(views.View):
         if not re.match(r'^1\d{10}', mobile):
             return HttpResponse(json.dumps(self._error_msg['mobile_error']))
 
-        data = {'mobile': mobile}
-        result = http_fetch(THIRD_PARTY_API['SMS_CODE'], data)
+        # 限制发送频率
+        if not sms_code_store.allow_send(mobile, request.META.get('REMOTE_ADDR', '')):
+            return HttpResponse(json.dumps(self._error_msg['sms_limit_error']))
+
+        # 加入发送队列，短时等待发送结果，验证码由任务存入验证码存储
+        status, result = task_queue.wait(tasks.send_sms_code.delay(mobile))
 
-        if not result:
+        if status not in (DONE, PENDING, RUNNING):
             # 发送失败
             return HttpResponse(json.dumps(self._error_msg['sms_send_error']))
 
         # 存入session，用于验证
-        request.session['sms_code'] = result.data
+        request.session['sms_mobile'] = mobile
 
-        # 返回正确响应
-        return HttpResponse(json.dumps(self._success_msg))
+        # 返回正确响应，等待超时时任务仍在队列中，告知客户端验证码正在发送
+        result = copy.copy(self._success_msg)
+        result['data'] = {'status': 'sent' if status == DONE else 'queued'}
+        return HttpResponse(json.dumps(result))
 
     def verify_sms_code(self, request):
 
@@ -158,9 +223,9 @@ class RegView(views.View):
 
         # 获取参数
         sms_code = request.POST.get('code', '')
-        cached_sms_code = request.session.get('sms_code', '')
+        mobile = request.session.get('sms_mobile', '')
 
-        if sms_code == '' or sms_code != cached_sms_code:
+        if sms_code == '' or mobile == '' or not sms_code_store.verify(mobile, sms_code):
             return HttpResponse(json.dumps(self._error_msg['sms_verify_error']))
 
         # 返回正确响应
@@ -185,6 +250,12 @@ class LoginView(views.View):
     # 第三方列表定义
     _source = ['qq', 'wechat']
 
+    # 第三方token到用户ID的缓存
+    _token_user_cache = LRUCache(TOKEN_CACHE['MAX_SIZE'], TOKEN_CACHE['TTL'])
+
+    # 第三方token验证结果缓存，验证失败的结果以False缓存
+    _check_token_cache = LRUCache(TOKEN_CACHE['MAX_SIZE'], TOKEN_CACHE['TTL'])
+
     def login(self, request):
         """
         登录处理，验证用户凭据
@@ -199,13 +270,14 @@ class LoginView(views.View):
         if username == '' or password == '':
             return HttpResponse(json.dumps(self._error_msg['user_error']))
 
-        user = self.login_verify(username, password)
+        try:
+            user = self.login_verify(username, password)
+        except PasswordHashError:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
 
         if user:
-            # 验证成功
-
-            user.last_login_time = datetime.datetime.now
-            user.save()
+            # 验证成功，最后登录时间延后批量写入
+            touch_login_time(user.id)
 
             return HttpResponse(json.dumps(self._success_msg))
 
@@ -232,18 +304,19 @@ class LoginView(views.View):
         """
 
         if source in self._source:
-            if source == 'qq':
-                if not (UserMongo.objects(qq_token=token).update(
-                        set__last_login_time=datetime.datetime.now) and User.objects.filter(qq_token=token).update(
-                    set__last_login_time=datetime.datetime.now)):
-                    return None
+            uid = self._token_user_cache.get((source, token))
 
-            elif source == 'wechat':
-                if not (UserMongo.objects(wechat_token=token).update(
-                        set__last_login_time=datetime.datetime.now) and User.objects.filter(wechat_token=token).update(
-                    set__last_login_time=datetime.datetime.now)):
+            if uid is None:
+                user = UserMongo.objects(**{'%s_token' % source: token}).only('id').first()
+                if not user:
                     return None
 
+                uid = user.id
+                self._token_user_cache.set((source, token), uid)
+
+            # 最后登录时间延后批量写入
+            touch_login_time(uid)
+
             return True
 
         else:
@@ -267,6 +340,10 @@ class LoginView(views.View):
         if not self.login_verify_by_token('qq', token):
             # 数据库不存在则检测token
             result = self.check_token('qq', token)
+            if result is False:
+                # 第三方平台暂不可用
+                return HttpResponse(json.dumps(self._error_msg['general_error']))
+
             if not result:
                 return HttpResponse(json.dumps(self._error_msg['token_error']))
 
@@ -294,6 +371,10 @@ class LoginView(views.View):
         if not self.login_verify_by_token('wechat', token):
             # 数据库不存在则检测token
             result = self.check_token('wechat', token)
+            if result is False:
+                # 第三方平台暂不可用
+                return HttpResponse(json.dumps(self._error_msg['general_error']))
+
             if not result:
                 return HttpResponse(json.dumps(self._error_msg['token_error']))
 
@@ -310,34 +391,30 @@ class LoginView(views.View):
         通过第三方平台检测token
         :param source: 用户来源
         :param token: 第三方token
-        :return: 成功返回相关信息元组，否则None
+        :return: 成功返回相关信息元组，第三方平台拒绝返回None，未能得到验证结果返回False
         """
 
         assert source in self._source and token != ''
 
-        if source == 'qq':
-            data = {'token': token}
-            result = http_fetch(THIRD_PARTY_API['QQ_LOGIN'], data)
+        cached = self._check_token_cache.get((source, token))
+        if cached is not None:
+            return cached or None
 
-            if not result:
-                # 验证失败
-                return None
-            else:
-                # 验证成功，获取昵称
-                username = result.nickname
-                return (username,)
+        # 通过任务队列验证，短时等待结果；第三方平台超时、熔断或出错时任务失败并重试
+        status, username = task_queue.wait(tasks.check_token.delay(source, token))
 
-        elif source == 'wechat':
-            data = {'token': token}
-            result = http_fetch(THIRD_PARTY_API['WECHAT_LOGIN'], data)
+        if status != DONE:
+            # 等待超时或任务失败，不缓存
+            return False
 
-            if not result:
-                # 验证失败
-                return None
-            else:
-                # 验证成功，获取昵称
-                username = result.nickname
-                return (username,)
+        if not username:
+            # 第三方平台明确拒绝
+            self._check_token_cache.set((source, token), False, TOKEN_CACHE['NEGATIVE_TTL'])
+            return None
+
+        # 验证成功，返回昵称
+        self._check_token_cache.set((source, token), (username,))
+        return (username,)
 
     def new_user_handler(self, source, token, username):
         """
@@ -349,9 +426,12 @@ class LoginView(views.View):
         assert source in self._source and token != ''
 
         if source == 'qq':
-            UserMongo(username=username, reg_source=source, qq_token=token).save()
+            UserMongo(id=id_allocator.next_id('user'), username=username, reg_source=source, qq_token=token).save()
         elif source == 'wechat':
-            UserMongo(username=username, reg_source=source, wechat_token=token).save()
+            UserMongo(id=id_allocator.next_id('user'), username=username, reg_source=source,
+                      wechat_token=token).save()
+
+        availability_index.add(username)
 
 
 class UserCenter(views.View):
@@ -365,6 +445,7 @@ class UserCenter(views.View):
                   'pass_error': {'code': 6003, 'msg': '密码格式不正确，请确保长度在8-20个字符之间'},
                   'portrait_empty_error': {'code': 6004, 'msg': '头像不能为空'},
                   'portrait_upload_error': {'code': 6005, 'msg': '头像上传失败'},
+                  'portrait_size_error': {'code': 6006, 'msg': '头像文件过大'},
                   'general_error': {'code': 6000, 'msg': '操作失败'}
                   }
 
@@ -383,23 +464,28 @@ class UserCenter(views.View):
         if not users:
             return HttpResponse(json.dumps(self._error_msg['permission_error']))
 
-        # 获取数据
-        data = {}
+        # 获取当前资料版本号
         user = users[0]
+        version = profile_snapshot.get_version(user.id)
+        if version is None:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
 
-        data['id'] = user.id
-        data['username'] = user.username
-        data['mobile'] = user.mobile
-        data['topic_num'] = user.topic_num
-        data['following_num'] = user.following_num
-        data['follower_num'] = user.follower_num
-        data['collected_market_num'] = user.collected_market_num
+        # 资料未变化时直接返回304
+        etag = profile_snapshot.etag(user.id, version)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
 
-        result = copy.copy(self._success_msg)
-        result['data'] = data
+        # 读取快照期间用户被删除
+        body = profile_snapshot.get(user, version, self._success_msg)
+        if body is None:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
 
         # 返回正确响应
-        return HttpResponse(json.dumps(result))
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
     def change_password(self, request):
         """
@@ -419,9 +505,18 @@ class UserCenter(views.View):
             return HttpResponse(json.dumps(self._error_msg['pass_error']))
 
         # 处理请求
-        if not self._on_change_password(users, make_password(new_password)):
+        try:
+            password_hash = hash_password(new_password)
+        except PasswordHashError:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
+
+        if not self._on_change_password(users, password_hash):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        # 使已验证用户缓存失效
+        Auth.invalidate(request)
+        Auth.invalidate_user(users[0].id)
+
         # 返回正确响应
         return HttpResponse(json.dumps(self._success_msg))
 
@@ -436,14 +531,22 @@ class UserCenter(views.View):
         result = False
 
         for u in users:
-            if u.update(set__password=new_password):
+            if isinstance(u, UserPrincipal):
+                # 凭据版本号加一，使其他进程缓存的已验证用户失效
+                updated = u.update(set__password=new_password, inc__auth_version=1)
+            else:
+                updated = u.update(set__password=new_password)
+
+            if updated:
                 result = True
 
         return result
 
+    @method_decorator(csrf_exempt)
     def upload_portrait(self, request):
         """
-        上传头像
+        上传头像。上传处理器需在读取请求体之前设置，
+        因此免除CsrfViewMiddleware的预读取，设置后再由_upload_portrait校验csrf
         :param request: 请求
         :return:
         """
@@ -453,26 +556,47 @@ class UserCenter(views.View):
         if not users:
             return HttpResponse(json.dumps(self._error_msg['permission_error']))
 
+        # 请求体超出大小限制时不读取
+        if int(request.META.get('CONTENT_LENGTH') or 0) > PORTRAIT_UPLOAD['MAX_REQUEST_SIZE']:
+            return HttpResponse(json.dumps(self._error_msg['portrait_size_error']))
+
+        # 上传内容分块写入临时文件
+        handler = PortraitUploadHandler(request)
+        request.upload_handlers = [handler]
+
+        return self._upload_portrait(request, users, handler)
+
+    @method_decorator(csrf_protect)
+    def _upload_portrait(self, request, users, handler):
+        """
+        校验csrf后处理上传的头像
+        :param request: 请求
+        :param users: 已验证的用户列表
+        :param handler: 上传处理器
+        :return:
+        """
+
         # 获取参数
-        portrait_image = request.POST.get('portrait', b'')
-        if not portrait_image:
-            return HttpResponse(json.dumps(self._error_msg['portrait_error']))
+        portrait_image = request.FILES.get('portrait')
+        if handler.too_large:
+            return HttpResponse(json.dumps(self._error_msg['portrait_size_error']))
 
-        # 上传到七牛云
-        data = {'file': portrait_image}
-        upload_result = http_fetch(THIRD_PARTY_API['QINIU'], data)
+        if not portrait_image:
+            return HttpResponse(json.dumps(self._error_msg['portrait_empty_error']))
 
-        if not upload_result:
-            # 上传失败
-            return HttpResponse(json.dumps(self._error_msg['portrait_upload_error']))
-        else:
-            # 上传成功，获取url
-            portrait_url = upload_result.url
+        # 相同内容不重复上传，缩略图生成与七牛云推送在任务队列中执行；上次推送未完成时重新加入队列
+        portrait_url, needs_upload = store_portrait(portrait_image)
+        if needs_upload:
+            tasks.process_portrait.delay(portrait_image.sha256)
 
         # 更新用户数据
         if not self._on_upload(users, portrait_url):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        # 使已验证用户缓存失效
+        Auth.invalidate(request)
+        Auth.invalidate_user(users[0].id)
+
         # 返回正确响应
         result = copy.copy(self._success_msg)
         result['data'] = portrait_url
@@ -489,7 +613,14 @@ class UserCenter(views.View):
         result = False
 
         for u in users:
-            if u.update(set__portrait=portrait_url):
+            if isinstance(u, UserPrincipal):
+                updated = u.update(set__portrait=portrait_url, inc__profile_version=1)
+            else:
+                updated = u.update(set__portrait=portrait_url)
+
+            if updated:
                 result = True
 
+        profile_snapshot.touch(users[0].id)
+
         return result
@@ -0,0 +1,9 @@
+"""
+用户行为视图使用的查询形状
+"""
+
+from account.models import FollowMongo
+from LH.indexaudit import register
+
+register(FollowMongo, {'uid': 1, 'follow_id': 2})
+register(FollowMongo, {'follow_id': 2})
@@ -0,0 +1,17 @@
+"""
+用户行为变更在sql后端的重放处理程序
+"""
+
+from account.models import User
+from action.views import ActionView
+from LH.outbox import replicated
+
+
+@replicated('action.follow')
+def follow(record_id, uid, follow_id):
+    return ActionView()._on_follow_sql(record_id, User.objects.get(id=uid), follow_id)
+
+
+@replicated('action.unfollow')
+def unfollow(uid, follow_id):
+    return ActionView()._on_unfollow_sql(User.objects.get(id=uid), follow_id)
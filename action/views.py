@@ -1,8 +1,13 @@
 from account.models import User, Follow, UserMongo, FollowMongo
+from account.principal import UserPrincipal
 from coin.models import Market, MarketMongo
 from django.http import HttpResponse
 from django import views
 from account.auth import Auth
+from account.profile import profile_snapshot
+from LH.dualwrite import dual_write
+from LH import outbox
+from LH.idalloc import id_allocator
 import json
 
 
@@ -57,8 +62,19 @@ class ActionView(views.View):
         """
         assert len(users) >= 2 and follow_id > 0
 
-        result_mongo = self._on_follow_mongo(users[0], follow_id)
-        result_sql = self._on_follow_sql(users[1], follow_id)
+        self._follow_error_code_mongo = self._follow_error_code_sql = None
+
+        # 两个后端使用同一ID
+        record_id = id_allocator.next_id('follow')
+
+        result_mongo, result_sql = dual_write.run(lambda: self._on_follow_mongo(record_id, users[0], follow_id),
+                                                  lambda: self._on_follow_sql(record_id, users[1], follow_id),
+                                                  failure=False,
+                                                  replay=lambda: ('action.follow', [record_id, users[1].id, follow_id]))
+
+        # 发件箱模式下sql后端未同步执行，其结果视为与mongo后端相同
+        if outbox.is_enabled():
+            self._follow_error_code_sql = self._follow_error_code_mongo
 
         if not result_mongo and not result_sql:
             if self._follow_error_code_mongo == self._follow_error_code_sql == self._error_msg['follow_done_error']['code']:
@@ -70,15 +86,16 @@ class ActionView(views.View):
 
         return True
 
-    def _on_follow_mongo(self, user, follow_id):
+    def _on_follow_mongo(self, record_id, user, follow_id):
         """
         关注时的数据库处理程序，mongo后端
+        :param record_id: 关注记录ID
         :param user: 已验证的用户对象
         :param follow_id: 目标用户ID:
         :return: 成功返回真，失败返回假
         """
 
-        assert isinstance(user, UserMongo) and follow_id > 0
+        assert isinstance(user, UserPrincipal) and follow_id > 0
 
         # 重置错误对象
         self._follow_error_code_mongo = None
@@ -90,20 +107,25 @@ class ActionView(views.View):
             return False
 
         # 处理请求
-        following = FollowMongo(uid=user.id, follow_uid=follow_id)
+        following = FollowMongo(id=record_id, uid=user.id, follow_uid=follow_id)
         following.save()
 
-        if [user.update(push__followings=follow_id, inc__following_num=1), UserMongo.objects(id=follow_id).update(
-                push__followers=user.id, inc__follower_num=1)] == [None, None]:
+        result = [user.update(push__followings=follow_id, inc__follow_num=1, inc__profile_version=1),
+                  UserMongo.objects(id=follow_id).update(push__followers=user.id, inc__follower_num=1,
+                                                         inc__profile_version=1)]
+        profile_snapshot.touch(user.id, follow_id)
+
+        if result == [None, None]:
              # 处理失败
              self._follow_error_code_mongo = self._error_msg['follow_general_error']['code']
              return False
 
         return True
 
-    def _on_follow_sql(self, user, follow_id):
+    def _on_follow_sql(self, record_id, user, follow_id):
         """
         关注时的数据库处理程序，sql后端
+        :param record_id: 关注记录ID
         :param user: 已验证的用户对象
         :param follow_id: 目标用户ID
         :return: 成功返回真，失败返回假
@@ -121,7 +143,7 @@ class ActionView(views.View):
             return False
 
         # 处理请求
-        following = Follow(uid=user.id, follow_uid=follow_id)
+        following = Follow(id=record_id, uid=user.id, follow_uid=follow_id)
         following.save()
 
         if [user.update(inc__following_num=1),User.objects.filter(id=follow_id).update(inc__follower_num=1)]==[None,None]:
@@ -155,10 +177,12 @@ class ActionView(views.View):
             return HttpResponse(json.dumps(self._error_msg['follow_none_error']))
 
         # 处理请求
-        if not user.update(pull__followings=follow_id, dec__following_num=1) or not UserMongo.objects(
-                id=follow_id).update(pull__followers=user.id, dec__follower_num=1):
+        if not user.update(pull__followings=follow_id, dec__follow_num=1, inc__profile_version=1) or not UserMongo.objects(
+                id=follow_id).update(pull__followers=user.id, dec__follower_num=1, inc__profile_version=1):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        profile_snapshot.touch(user.id, follow_id)
+
         follow.delete()
 
         # 返回正确响应
@@ -173,8 +197,16 @@ class ActionView(views.View):
         """
         assert len(users) >= 2 and follow_id > 0
 
-        result_mongo = self._on_unfollow_mongo(users[0], follow_id)
-        result_sql = self._on_unfollow_sql(users[1], follow_id)
+        self._follow_error_code_mongo = self._follow_error_code_sql = None
+
+        result_mongo, result_sql = dual_write.run(lambda: self._on_unfollow_mongo(users[0], follow_id),
+                                                  lambda: self._on_unfollow_sql(users[1], follow_id),
+                                                  failure=False,
+                                                  replay=lambda: ('action.unfollow', [users[1].id, follow_id]))
+
+        # 发件箱模式下sql后端未同步执行，其结果视为与mongo后端相同
+        if outbox.is_enabled():
+            self._follow_error_code_sql = self._follow_error_code_mongo
 
         if not result_mongo and not result_sql:
             if self._follow_error_code_mongo == self._follow_error_code_sql == self._error_msg['follow_none_error']['code']:
@@ -194,7 +226,7 @@ class ActionView(views.View):
         :return: 成功返回真，失败返回假
         """
 
-        assert isinstance(user, UserMongo) and follow_id > 0
+        assert isinstance(user, UserPrincipal) and follow_id > 0
 
         # 重置错误对象
         self._follow_error_code_mongo = None
@@ -206,8 +238,12 @@ class ActionView(views.View):
             return False
 
         # 处理请求
-        if [user.update(pull__followings=follow_id, dec__following_num=1), UserMongo.objects(id=follow_id).update(
-                pull__followers=user.id, dec__follower_num=1)] == [None, None]:
+        result = [user.update(pull__followings=follow_id, dec__follow_num=1, inc__profile_version=1),
+                  UserMongo.objects(id=follow_id).update(pull__followers=user.id, dec__follower_num=1,
+                                                         inc__profile_version=1)]
+        profile_snapshot.touch(user.id, follow_id)
+
+        if result == [None, None]:
             # 处理失败
             self._follow_error_code_mongo = self._error_msg['follow_general_error']['code']
             return False
@@ -263,9 +299,11 @@ class ActionView(views.View):
             return HttpResponse(json.dumps(self._error_msg['market_done_error']))
 
         # 处理请求
-        if not user.update(push__collected_markets=market_id, inc__collected_market_num=1):
+        if not user.update(push__collected_markets=market_id, inc__collected_market_num=1, inc__profile_version=1):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        profile_snapshot.touch(user.id)
+
         # 返回正确响应
         return HttpResponse(json.dumps(self._success_msg))
 
@@ -300,7 +338,7 @@ class ActionView(views.View):
         :return: 成功返回真，失败返回假
         """
 
-        assert isinstance(user, UserMongo) and market_id > 0
+        assert isinstance(user, UserPrincipal) and market_id > 0
 
         # 重置错误对象
         self._follow_error_code_mongo = None
@@ -370,8 +408,10 @@ class ActionView(views.View):
             return HttpResponse(json.dumps(self._error_msg['market_none_error']))
 
         # 处理请求
-        if not user.update(pull__collected_markets=market_id, dec__collected_market_num=1):
+        if not user.update(pull__collected_markets=market_id, dec__collected_market_num=1, inc__profile_version=1):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        profile_snapshot.touch(user.id)
+
         # 返回正确响应
         return HttpResponse(json.dumps(self._success_msg))
@@ -0,0 +1,10 @@
+"""
+币种视图使用的查询形状
+"""
+
+from coin.models import CoinMongo, MarketMongo, ExchangeMongo
+from LH.indexaudit import register
+
+register(CoinMongo, {'name': 'name'})
+register(ExchangeMongo, {'name': 'name'})
+register(MarketMongo, {'id': {'$in': [1, 2]}})
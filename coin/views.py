@@ -1,6 +1,7 @@
 from django.http import HttpResponse
 from django.views import View
 from coin.models import Coin, Market, Exchange, CoinMongo, MarketMongo, ExchangeMongo
+from LH.readrouter import read_router
 import json
 import copy
 
@@ -140,8 +141,7 @@ class CoinView(View):
         :param num: 数目
         :return: 列表 或 None
         """
-        coins = self._on_coin_mongo(num)
-        return coins if coins else self._on_coin_sql(num)
+        return read_router.run(('coins', num), lambda: self._on_coin_mongo(num), lambda: self._on_coin_sql(num))
 
     def _on_coin_mongo(self, num):
         """
@@ -169,7 +169,7 @@ class CoinView(View):
         """
         assert num > 0
 
-        coins = Coin.objects.only('name').limit(num)
+        coins = Coin.objects.only('name')[:num]
         if not coins:
             return None
 
@@ -185,8 +185,9 @@ class CoinView(View):
         :param name: 名字
         :return: json数据 或 None
         """
-        coin = self._on_coin_by_name_mongo(name)
-        return coin if coin else self._on_coin_by_name_sql(name)
+        return read_router.run(('coin', name),
+                               lambda: self._on_coin_by_name_mongo(name),
+                               lambda: self._on_coin_by_name_sql(name))
 
     def _on_coin_by_name_mongo(self, name):
 
@@ -223,8 +224,9 @@ class CoinView(View):
         :param num: 数目
         :return: 列表 或 None
         """
-        exchanges = self._on_exchange_mongo(num)
-        return exchanges if exchanges else self._on_exchange_sql(num)
+        return read_router.run(('exchanges', num),
+                               lambda: self._on_exchange_mongo(num),
+                               lambda: self._on_exchange_sql(num))
 
     def _on_exchange_mongo(self, num):
         """
@@ -252,7 +254,7 @@ class CoinView(View):
         """
         assert num > 0
 
-        exchanges = Exchange.objects.only('name').limit(num)
+        exchanges = Exchange.objects.only('name')[:num]
         if not exchanges:
             return None
 
@@ -268,8 +270,9 @@ class CoinView(View):
         :param name: 名字
         :return: json数据 或 None
         """
-        exchange = self._on_exchange_by_name_mongo(name)
-        return exchange if exchange else self._on_exchange_by_name_sql(name)
+        return read_router.run(('exchange', name),
+                               lambda: self._on_exchange_by_name_mongo(name),
+                               lambda: self._on_exchange_by_name_sql(name))
 
     def _on_exchange_by_name_mongo(self, name):
 
@@ -307,8 +310,9 @@ class CoinView(View):
         :param num: 数目
         :return: 市场列表 或 None
         """
-        markets = self._on_market_mongo(exchange, num)
-        return markets if markets else self._on_market_sql(exchange, num)
+        return read_router.run(('markets', exchange, num),
+                               lambda: self._on_market_mongo(exchange, num),
+                               lambda: self._on_market_sql(exchange, num))
 
     def _on_market_mongo(self, exchange, num):
         """
@@ -346,7 +350,7 @@ class CoinView(View):
         if not exchange:
             return None
 
-        markets = exchange.market_set.all().limit(num)
+        markets = exchange.market_set.all()[:num]
         if not markets:
             return None
 
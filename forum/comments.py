@@ -0,0 +1,208 @@
+"""
+评论树，由评论上的祖先路径一次查询取出整个主题或某条评论下的多层回复，在内存中组装
+"""
+
+from pymongo import UpdateOne
+from account.models import UserMongo
+from forum.models import TopicMongo, CommentMongo
+from forum.feed import InvalidCursor, render_author
+from LH.deref import select_related
+from LH.settings import COMMENT_TREE
+import base64
+import json
+
+# 推导评论树位置时读取的字段
+_POSITION_FIELDS = {'_id': 1, 'id': 1, 'topic': 1, 'comment': 1, 'root': 1, 'path': 1, 'depth': 1, 'thread': 1}
+
+
+def encode_cursor(topic_id, parent_id, level, after):
+    """
+    生成不透明游标
+    :param topic_id: 主题ID
+    :param parent_id: 父评论ID，0为主题本身
+    :param level: 直接回复的层级
+    :param after: 已返回的最后一条直接回复的ID
+    :return: 游标字符串
+    """
+    return base64.urlsafe_b64encode(json.dumps([topic_id, parent_id, level, after]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析游标
+    :param cursor: 游标字符串
+    :return: (主题ID, 父评论ID, 直接回复的层级, 已返回的最后一条直接回复的ID)
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        topic_id, parent_id, level, after = (int(v) for v in values)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+    if topic_id <= 0 or parent_id < 0 or level < 0 or after < 0 or (parent_id == 0) != (level == 0):
+        raise InvalidCursor(cursor)
+
+    return topic_id, parent_id, level, after
+
+
+def locate(comment):
+    """
+    获取评论在评论树中的位置；早于路径回填写入的评论沿父评论引用向上找到已有位置的祖先或顶层评论，
+    推导途经各评论的位置并补写
+    :param comment: 评论
+    :return: (所属主题ID, 祖先路径, 层级, 顶层评论ID)，引用链断开无法推导时返回None
+    """
+
+    if comment.root is not None:
+        return comment.root, comment.path, comment.depth, comment.thread
+
+    collection = CommentMongo._get_collection()
+
+    # 由评论自身向上，直到已有位置的祖先或不再引用父评论的顶层评论
+    chain = []
+    son = collection.find_one({'_id': comment.pk}, _POSITION_FIELDS)
+    while son is not None and son.get('root') is None:
+        chain.append(son)
+        if son.get('comment') is None:
+            break
+        son = collection.find_one({'_id': son['comment']}, _POSITION_FIELDS)
+
+    if son is None:
+        return None
+
+    # 位置为(所属主题ID, 祖先路径, 层级, 顶层评论ID, 评论ID)
+    positions = []
+    if son.get('root') is not None:
+        position = (son['root'], son['path'], son['depth'], son['thread'], son['id'])
+    else:
+        topic = son.get('topic') and TopicMongo._get_collection().find_one({'_id': son['topic']}, {'id': 1})
+        if not topic:
+            return None
+
+        chain.pop()
+        position = (topic['id'], [], 0, son['id'], son['id'])
+        positions.append((son['_id'], position))
+
+    for c in reversed(chain):
+        root, path, depth, thread, parent_id = position
+        position = (root, path + [parent_id], depth + 1, thread, c['id'])
+        positions.append((c['_id'], position))
+
+    if positions:
+        collection.bulk_write([UpdateOne({'_id': _id}, {'$set': {'root': p[0], 'path': p[1], 'depth': p[2],
+                                                                'thread': p[3]}})
+                               for _id, p in positions], ordered=False)
+
+    return position[:4]
+
+
+class CommentTree(object):
+    """
+    评论树。每条评论保存所属主题ID、祖先路径和层级，
+    取主题下的评论按(root, thread, depth, id)索引，取某条评论下的回复按(root, path, depth, id)索引，各一次查询；
+    顶层评论按ID分页，超过MAX_DEPTH层或每层超过REPLY_PAGE_SIZE条的回复截断，返回加载更多的游标
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.COMMENT_TREE
+        """
+        self._config = config
+
+    def _query(self, topic_id, parent_id, level, after):
+        """
+        查询一个父节点下的多层回复，同一分支内按(层级, ID)排序，父评论总在回复之前；
+        结果截断于ROW_LIMIT条时截断点之前的评论全部取出，因此每个节点已取出的回复总是按ID排在最前的若干条
+        :param topic_id: 主题ID
+        :param parent_id: 父评论ID，0为主题本身
+        :param level: 直接回复的层级
+        :param after: 只取ID大于此值的直接回复及其下的回复
+        :return: (评论列表, 是否被ROW_LIMIT截断)
+        """
+
+        query = {'root': topic_id, 'depth': {'$lt': level + self._config['MAX_DEPTH']}}
+
+        if parent_id == 0:
+            if after:
+                query['thread'] = {'$gt': after}
+            order = ('thread', 'depth', 'id')
+        else:
+            query['path'] = parent_id
+            if after:
+                # 直接回复比较自身ID，更深的回复比较路径上对应层级的祖先ID
+                query['$or'] = [{'depth': level, 'id': {'$gt': after}},
+                                {'path.%d' % level: {'$gt': after}}]
+            order = ('depth', 'id')
+
+        limit = self._config['ROW_LIMIT']
+        comments = list(CommentMongo.objects(__raw__=query)
+                        .only('id', 'user', 'content', 'time', 'digg_num', 'diss_num', 'comment_num', 'path', 'depth')
+                        .order_by(*order).limit(limit + 1))
+        truncated = len(comments) > limit
+
+        return comments[:limit], truncated
+
+    def _render(self, topic_id, comment, children):
+        """
+        生成一条评论及其回复的响应数据
+        :param topic_id: 主题ID
+        :param comment: 评论
+        :param children: {评论ID: 按ID排序的直接回复列表}
+        :return: 字典
+        """
+
+        replies = children[comment.id]
+        shown = replies[:self._config['REPLY_PAGE_SIZE']]
+
+        # 回复超过每层数目上限、超过层数上限或未在本次查询中取全时，返回加载剩余回复的游标
+        more = None
+        if len(replies) > len(shown) or comment.comment_num > len(replies):
+            more = encode_cursor(topic_id, comment.id, comment.depth + 1, shown[-1].id if shown else 0)
+
+        return {'id': comment.id,
+                'content': comment.content,
+                'time': comment.time.strftime('%Y-%m-%d %H:%M:%S'),
+                'user': render_author(comment._data.get('user')),
+                'digg_num': comment.digg_num,
+                'diss_num': comment.diss_num,
+                'comment_num': comment.comment_num,
+                'replies': [self._render(topic_id, c, children) for c in shown],
+                'more': more}
+
+    def get_page(self, topic_id, num, cursor=None):
+        """
+        获取一页评论树
+        :param topic_id: 主题ID，指定游标时忽略
+        :param num: 直接回复数目
+        :param cursor: 上一页或某条评论的加载更多游标，None为主题的首页
+        :return: (评论树列表, 下一页游标 或 None)
+        """
+
+        if cursor is None:
+            parent_id, level, after = 0, 0, 0
+        else:
+            topic_id, parent_id, level, after = decode_cursor(cursor)
+
+        comments, truncated = self._query(topic_id, parent_id, level, after)
+        select_related(comments, 'user', only={UserMongo: ['id', 'username', 'portrait']})
+
+        # 按父评论分组
+        children = dict((c.id, []) for c in comments)
+        branches = []
+        for comment in sorted(comments, key=lambda c: c.id):
+            if comment.depth == level:
+                branches.append(comment)
+            elif comment.path and comment.path[-1] in children:
+                children[comment.path[-1]].append(comment)
+
+        shown = branches[:num]
+        items = [self._render(topic_id, c, children) for c in shown]
+
+        has_more = len(branches) > num or truncated
+        return items, encode_cursor(topic_id, parent_id, level, shown[-1].id) if has_more and shown else None
+
+
+# 进程内共享的评论树
+comment_tree = CommentTree(COMMENT_TREE)
@@ -0,0 +1,227 @@
+"""
+贴子计数聚合，点赞、踩贴的增量在进程内按贴子合并，定时批量写入两个后端
+"""
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from forum.models import Topic, Comment, TopicMongo, CommentMongo
+from LH.buffer import WriteBehindBuffer, PartialFlushError
+from LH.cache import LRUCache
+from LH.settings import POST_COUNTER
+from LH import outbox
+from collections import defaultdict
+import operator
+import threading
+
+# 贴子类型 -> (mongo数据模型, sql数据模型)，0为主题，1为评论
+_models = {0: (TopicMongo, Topic), 1: (CommentMongo, Comment)}
+
+# 可聚合的计数字段
+FIELDS = ('digg_num', 'diss_num')
+
+
+def _group(items):
+    """
+    按贴子类型和字段分组
+    :param items: {(贴子类型, 贴子ID, 字段): 增量}
+    :return: {贴子类型: {字段: {贴子ID: 增量}}}
+    """
+
+    groups = defaultdict(lambda: defaultdict(dict))
+    for (post_type, post_id, field), delta in items.items():
+        if delta:
+            groups[post_type][field][post_id] = delta
+    return groups
+
+
+def get_post_document(post_type, post_id, fields):
+    """
+    投影查询贴子的mongo文档
+    :param post_type: 贴子类型，0为主题，1为评论
+    :param post_id: 贴子ID
+    :param fields: 字段列表
+    :return: 字典，贴子不存在返回None
+    """
+    return _models[post_type][0].objects(id=post_id).only(*fields).as_pymongo().first()
+
+
+def _flush_mongo(items):
+    """
+    批量写入mongo后端，每类贴子一次bulk_write，同一贴子的多个字段合并为一个$inc；
+    部分写入失败时抛出PartialFlushError，只重试失败的贴子，已写入的增量不会重复累加
+    :param items: {(贴子类型, 贴子ID, 字段): 增量}
+    :return:
+    """
+
+    failed_posts = set()
+    groups = list(_group(items).items())
+    for n, (post_type, fields) in enumerate(groups):
+        incs = defaultdict(dict)
+        for field, deltas in fields.items():
+            for post_id, delta in deltas.items():
+                incs[post_id][field] = delta
+
+        post_ids = list(incs)
+        try:
+            _models[post_type][0]._get_collection().bulk_write(
+                [UpdateOne({'id': post_id}, {'$inc': incs[post_id]}) for post_id in post_ids], ordered=False)
+        except BulkWriteError as e:
+            failed_posts.update((post_type, post_ids[error['index']]) for error in e.details['writeErrors'])
+        except Exception:
+            if n == 0:
+                raise
+
+            # 之前的贴子类型已写入，本类型及之后的全部重试
+            failed_posts.update((t, post_id) for t, f in groups[n:] for deltas in f.values() for post_id in deltas)
+            break
+
+    if failed_posts:
+        raise PartialFlushError(dict((k, v) for k, v in items.items() if (k[0], k[1]) in failed_posts))
+
+
+def _flush_sql(items):
+    """
+    批量写入sql后端，每类贴子的每个字段一条UPDATE；启用发件箱复制时记录为一次变更
+    :param items: {(贴子类型, 贴子ID, 字段): 增量}
+    :return:
+    """
+
+    if outbox.is_enabled():
+        outbox.append('forum.counters', [list(k) + [v] for k, v in items.items() if v])
+        return
+
+    apply_sql(items)
+
+
+def apply_sql(items):
+    """
+    将增量写入sql后端，同一批增量在一个事务中提交
+    :param items: {(贴子类型, 贴子ID, 字段): 增量}
+    :return:
+    """
+
+    with transaction.atomic():
+        for post_type, fields in _group(items).items():
+            for field, deltas in fields.items():
+                _models[post_type][1].objects.filter(id__in=list(deltas)).update(
+                    **{field: F(field) + Case(*[When(id=i, then=Value(d)) for i, d in deltas.items()],
+                                              default=Value(0), output_field=IntegerField())})
+
+
+class PostCounter(object):
+    """
+    贴子计数器，两个后端各用一个缓冲区，刷新失败时各自重试互不影响；
+    同一次调用的多个字段的增量在同一次刷新中写入，mongo后端合并为一个$inc；
+    读取时合并尚未写入的增量，并保证同一进程内读到的计数除本进程的减量外不减小；
+    已返回的计数随本进程的增量更新，可不读数据库直接返回
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.POST_COUNTER
+        """
+
+        self._buffers = {'mongo': WriteBehindBuffer(_flush_mongo, config['FLUSH_INTERVAL'], merge=operator.add),
+                         'sql': WriteBehindBuffer(_flush_sql, config['FLUSH_INTERVAL'], merge=operator.add)}
+        self._served = LRUCache(config['CACHE_SIZE'], config['CACHE_TTL'])
+        self._lock = threading.Lock()
+
+    def incr(self, post_type, post_id, field, delta=1):
+        """
+        增加计数
+        :param post_type: 贴子类型，0为主题，1为评论
+        :param post_id: 贴子ID
+        :param field: 计数字段
+        :param delta: 增量
+        :return: 增加后的计数，贴子不存在返回None
+        """
+
+        # 先确认贴子存在，再记录增量
+        if self.get(post_type, post_id, field) is None:
+            return None
+
+        self.apply(post_type, post_id, {field: delta})
+        return self.get(post_type, post_id, field)
+
+    def apply(self, post_type, post_id, deltas):
+        """
+        记录一个贴子多个字段的增量
+        :param post_type: 贴子类型，0为主题，1为评论
+        :param post_id: 贴子ID
+        :param deltas: {字段: 增量}
+        :return:
+        """
+
+        assert post_type in _models and all(f in FIELDS for f in deltas)
+
+        items = dict(((post_type, post_id, f), d) for f, d in deltas.items())
+        for buffer in self._buffers.values():
+            buffer.put_many(items)
+
+        # 已返回的计数累加本进程的增量，其中减量使计数合法地减小
+        with self._lock:
+            for key, delta in items.items():
+                served = self._served.get(key)
+                if served is not None:
+                    self._served.set(key, served + delta)
+
+    def get(self, post_type, post_id, field):
+        """
+        读取计数
+        :param post_type: 贴子类型
+        :param post_id: 贴子ID
+        :param field: 计数字段
+        :return: 计数，贴子不存在返回None
+        """
+
+        counts = self.get_many(post_type, post_id, [field])
+        return counts[field] if counts is not None else None
+
+    def get_many(self, post_type, post_id, fields=FIELDS, cached=False):
+        """
+        读取多个计数，先读数据库再读缓冲区，刷新恰好在两次读取之间完成时由已返回的最大值兜底
+        :param post_type: 贴子类型
+        :param post_id: 贴子ID
+        :param fields: 计数字段列表
+        :param cached: 是否优先返回本进程已返回并累加了增量的计数，全部字段都有时不读数据库
+        :return: {字段: 计数}，贴子不存在返回None
+        """
+
+        if cached:
+            with self._lock:
+                counts = dict((f, self._served.get((post_type, post_id, f))) for f in fields)
+            if None not in counts.values():
+                return counts
+
+        son = get_post_document(post_type, post_id, fields)
+        if son is None:
+            return None
+
+        counts = {}
+        for field in fields:
+            key = (post_type, post_id, field)
+            count = son.get(field, 0) + self._buffers['mongo'].get(key, 0)
+
+            with self._lock:
+                count = max(count, self._served.get(key, count))
+                self._served.set(key, count)
+
+            counts[field] = count
+
+        return counts
+
+    def flush(self):
+        """
+        立即刷新两个后端的缓冲区
+        :return:
+        """
+
+        for buffer in self._buffers.values():
+            buffer.flush()
+
+
+# 进程内共享的贴子计数器
+post_counter = PostCounter(POST_COUNTER)
@@ -0,0 +1,160 @@
+"""
+主题列表，按(发布时间, ID)倒序的游标分页，首页缓存预先序列化的响应内容
+"""
+
+from account.models import UserMongo
+from forum.models import TopicMongo
+from LH.cache import LRUCache
+from LH.deref import select_related
+from LH.settings import TOPIC_FEED, DEFAULT_PORTRAIT_URL
+import base64
+import datetime
+import json
+
+
+class InvalidCursor(ValueError):
+    """
+    游标格式不正确
+    """
+
+
+def encode_cursor(publish_time, topic_id):
+    """
+    生成不透明游标
+    :param publish_time: 发布时间
+    :param topic_id: 主题ID
+    :return: 游标字符串
+    """
+
+    epoch_ms = int((publish_time - datetime.datetime(1970, 1, 1)).total_seconds() * 1000)
+    return base64.urlsafe_b64encode(json.dumps([epoch_ms, topic_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析游标
+    :param cursor: 游标字符串
+    :return: (发布时间, 主题ID)
+    """
+
+    try:
+        epoch_ms, topic_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(epoch_ms)), int(topic_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def render_author(user):
+    """
+    生成作者的响应数据，作者已被删除时引用未能解引用，返回占位作者
+    :param user: select_related后的作者引用
+    :return: 字典
+    """
+
+    if not isinstance(user, UserMongo):
+        return {'id': 0, 'username': '', 'portrait': DEFAULT_PORTRAIT_URL}
+
+    return {'id': user.id, 'username': user.username, 'portrait': user.portrait}
+
+
+class TopicFeed(object):
+    """
+    主题列表。首页按(论坛ID, 数目)缓存序列化后的响应内容，
+    发表主题时对计数器集合中的列表版本号加一，各进程读取首页时发现版本变化即重新生成
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.TOPIC_FEED
+        """
+
+        self._config = config
+        self._first_pages = LRUCache(config['CACHE_SIZE'], config['CACHE_TTL'])
+
+    def _counters(self):
+        return TopicMongo._get_db()['counters']
+
+    def get_version(self):
+        """
+        读取列表版本号
+        :return: 版本号
+        """
+
+        counter = self._counters().find_one({'_id': 'topic_feed'})
+        return counter['seq'] if counter else 0
+
+    def touch(self):
+        """
+        发表主题后调用，使所有进程的首页缓存过期
+        :return:
+        """
+        self._counters().update_one({'_id': 'topic_feed'}, {'$inc': {'seq': 1}}, upsert=True)
+
+    def _query(self, forum_id, cursor, num):
+        """
+        查询一页主题，由(forum_id, -publish_time, -id)或(-publish_time, -id)索引支持
+        :param forum_id: 论坛ID，None为全部
+        :param cursor: 上一页的游标，None为首页
+        :param num: 数目
+        :return: (主题列表, 下一页游标 或 None)
+        """
+
+        query = {}
+        if forum_id is not None:
+            query['forum_id'] = forum_id
+
+        if cursor is not None:
+            publish_time, topic_id = decode_cursor(cursor)
+            query['$or'] = [{'publish_time': {'$lt': publish_time}},
+                            {'publish_time': publish_time, 'id': {'$lt': topic_id}}]
+
+        # 多取一条判断是否有下一页
+        topics = list(TopicMongo.objects(__raw__=query)
+                      .only('id', 'title', 'publish_time', 'user', 'forum_id', 'comment_num', 'digg_num', 'diss_num')
+                      .order_by('-publish_time', '-id').limit(num + 1))
+        has_more = len(topics) > num
+        topics = select_related(topics[:num], 'user', only={UserMongo: ['id', 'username', 'portrait']})
+
+        items = [{'id': t.id,
+                  'title': t.title,
+                  'publish_time': t.publish_time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'forum_id': t.forum_id,
+                  'user': render_author(t._data.get('user')),
+                  'comment_num': t.comment_num,
+                  'digg_num': t.digg_num,
+                  'diss_num': t.diss_num} for t in topics]
+
+        last = topics[-1] if topics else None
+        return items, encode_cursor(last.publish_time, last.id) if has_more else None
+
+    def get_page(self, forum_id, cursor, num, success_msg):
+        """
+        获取一页主题
+        :param forum_id: 论坛ID，None为全部
+        :param cursor: 上一页的游标，None为首页
+        :param num: 数目
+        :param success_msg: 成功消息
+        :return: 序列化的响应内容
+        """
+
+        if cursor is None:
+            version = self.get_version()
+            entry = self._first_pages.get((forum_id, num))
+            if entry is not None and entry[0] == version:
+                return entry[1]
+
+        items, next_cursor = self._query(forum_id, cursor, num)
+
+        result = dict(success_msg)
+        result['data'] = {'topics': items, 'next': next_cursor}
+        body = json.dumps(result).encode()
+
+        if cursor is None:
+            self._first_pages.set((forum_id, num), (version, body))
+
+        return body
+
+
+# 进程内共享的主题列表
+topic_feed = TopicFeed(TOPIC_FEED)
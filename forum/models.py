@@ -18,6 +18,10 @@ class CommentMongo(Document):
       diss_num: 踩数，整型
       comment_num: 评论数，整型
       time: 评论时间，日期型
+      root: 所属主题ID，整型
+      path: 祖先评论ID，由顶层评论到直接父评论，整型列表
+      depth: 层级，顶层评论为0，整型
+      thread: 所属顶层评论ID，顶层评论为自身ID，整型
     """
 
     # 字段声明
@@ -26,6 +30,10 @@ class CommentMongo(Document):
     type = IntField(default=0)
     topic = ReferenceField('TopicMongo')
     comment = ReferenceField('CommentMongo')
+    root = IntField()
+    path = ListField(IntField())
+    depth = IntField(default=0)
+    thread = IntField()
     content = StringField(min_length=10, max_length=10000, required=True)
     digg_num = IntField(default=0)
     diss_num = IntField(default=0)
@@ -33,7 +41,9 @@ class CommentMongo(Document):
     time = DateTimeField(required=True)
 
     # 元数据：指定集合和索引
-    meta = {'collection': 'comment', 'indexes': ['+id']}
+    meta = {'collection': 'comment',
+            'indexes': ['+id', '+topic', '+comment', ('root', 'thread', 'depth', 'id'),
+                        ('root', 'path', 'depth', 'id')]}
 
     def __str__(self):
         """
@@ -52,6 +62,7 @@ class TopicMongo(Document):
       content: 内容，字符串
       publish_time: 发布时间，日期型
       user: 作者，引用字段
+      forum_id: 所属论坛ID，0为不属于任何论坛，整型
       comments: 评论，引用列表
       comment_num: 评论数，整型
       digg_num: 点赞数，整型
@@ -66,13 +77,15 @@ class TopicMongo(Document):
     content = StringField(max_length=10000, required=True)
     publish_time = DateTimeField(required=True)
     user = ReferenceField('UserMongo', required=True)
+    forum_id = IntField(default=0)
     oomments = ListField(ReferenceField('CommentMongo'), default=[])
     comment_num = IntField(default=0)
     digg_num = IntField(default=0)
     diss_num = IntField(default=0)
 
     # 元数据：指定集合和索引
-    meta = {'collection': 'topic', 'indexes': ['+id']}
+    meta = {'collection': 'topic',
+            'indexes': ['+id', '+user', ('-publish_time', '-id'), ('forum_id', '-publish_time', '-id')]}
 
     def __str__(self):
         """
@@ -131,6 +144,7 @@ class Topic(models.Model):
       title: 标题，字符串
       content: 内容，字符串
       publish_time: 发布时间，日期型
+      forum: 所属论坛，外键，可为空
       comment_num: 评论数，整型
       digg_num: 点赞数，整型
       diss_num: 踩数，整型
@@ -140,6 +154,7 @@ class Topic(models.Model):
 
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey('User')
+    forum = models.ForeignKey('Forum', null=True, on_delete=models.SET_NULL)
     title = models.CharField(max_length=50)
     content = models.TextField(max_length=10000)
     publish_time = models.DateTimeField(default=datetime.datetime.now)
@@ -150,6 +165,8 @@ class Topic(models.Model):
     class Meta:
         verbose_name = 'Topic'
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['-publish_time', '-id']),
+                   models.Index(fields=['forum', '-publish_time', '-id'])]
 
     def __str__(self):
         """
@@ -0,0 +1,22 @@
+"""
+论坛视图使用的查询形状
+"""
+
+from bson import ObjectId
+from forum.models import TopicMongo, CommentMongo
+from forum.votes import VoteMongo
+from LH.indexaudit import register
+
+register(TopicMongo, {'id': 1})
+register(TopicMongo, {'user': ObjectId()})
+register(TopicMongo, {}, sort=[('publish_time', -1), ('id', -1)], name='topic feed')
+register(TopicMongo, {'forum_id': 1}, sort=[('publish_time', -1), ('id', -1)], name='topic feed by forum')
+register(CommentMongo, {'id': 1})
+register(CommentMongo, {'topic': ObjectId()})
+register(CommentMongo, {'comment': ObjectId()})
+register(VoteMongo, {'post_type': 0, 'post_id': 1})
+register(VoteMongo, {'post_type': 0, 'post_id': 1, 'uid': 1})
+register(CommentMongo, {'root': 1, 'depth': {'$lt': 4}, 'thread': {'$gt': 1}},
+         sort=[('thread', 1), ('depth', 1), ('id', 1)], name='comment tree')
+register(CommentMongo, {'root': 1, 'path': 1, 'depth': {'$lt': 5}}, sort=[('depth', 1), ('id', 1)],
+         name='comment replies')
@@ -0,0 +1,24 @@
+"""
+论坛变更在sql后端的重放处理程序
+"""
+
+from account.models import User
+from forum.counters import apply_sql
+from forum.views import ForumView
+from LH.outbox import replicated
+
+
+@replicated('forum.counters')
+def counters(items):
+    return apply_sql(dict(((post_type, post_id, field), delta) for post_type, post_id, field, delta in items))
+
+
+@replicated('forum.publish_topic')
+def publish_topic(topic_id, title, content, forum_id, publish_time, uid):
+    return ForumView()._on_publish_topic_sql(topic_id, title, content, forum_id, publish_time,
+                                             [None, User.objects.get(id=uid)])
+
+
+@replicated('forum.publish_comment')
+def publish_comment(comment_id, post_id, post_type, content, uid):
+    return ForumView()._on_publish_comment_sql(comment_id, post_id, post_type, content, User.objects.get(id=uid))
@@ -0,0 +1,169 @@
+"""
+敏感词过滤，词表来自文件或集合，变化后自动重新构建自动机
+"""
+
+from mongoengine import *
+from LH.ahocorasick import AhoCorasick
+from LH.settings import SENSITIVE_WORDS
+import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SensitiveWordMongo(Document):
+    """
+    敏感词MongoDB数据模型，各字段说明如下：
+
+      word: 敏感词，字符串
+      time: 添加时间，日期型
+    """
+
+    # 字段声明
+
+    word = StringField(primary_key=True, max_length=50)
+    time = DateTimeField(default=datetime.datetime.now)
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'sensitive_word', 'indexes': ['-time']}
+
+
+class SensitiveWordFilter(object):
+    """
+    敏感词过滤器，进程内构建一次自动机供所有视图共享；
+    每隔RELOAD_INTERVAL秒检查词表是否变化，变化时构建新自动机后整体替换，匹配中的请求不受影响；
+    读取失败或读到的词数明显少于预期时保留原自动机，下次检查时重试；尚未成功读取过时每隔RETRY_INTERVAL秒重试
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.SENSITIVE_WORDS
+        """
+
+        self._config = config
+        self._matcher = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _get_version(self):
+        """
+        获取词表版本，文件为修改时间和大小，集合为词数和最近添加时间
+        :return: 版本
+        """
+
+        if self._config['SOURCE'] == 'file':
+            try:
+                stat = os.stat(self._config['PATH'])
+            except OSError:
+                return None
+            return stat.st_mtime, stat.st_size
+
+        latest = SensitiveWordMongo.objects.only('time').order_by('-time').first()
+        return SensitiveWordMongo.objects.count(), latest.time if latest else None
+
+    def _load_words(self):
+        """
+        读取词表，每行一个词，读取失败时抛出异常
+        :return: 词列表
+        """
+
+        if self._config['SOURCE'] == 'file':
+            with open(self._config['PATH'], encoding='utf-8') as f:
+                return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+        return [w['_id'] for w in SensitiveWordMongo.objects.only('word').as_pymongo()]
+
+    def _is_complete(self, words, version, force):
+        """
+        检查读到的词表是否完整：集合的词数不少于版本中的词数，且相比原词表的减少不超过MAX_SHRINK
+        :param words: 词列表
+        :param version: 读取前获取的版本
+        :param force: 是否强制重新构建，强制时不检查减少比例
+        :return: 完整返回真，否则假
+        """
+
+        if self._config['SOURCE'] == 'mongo' and len(words) < version[0]:
+            return False
+
+        if force or self._matcher is None:
+            return True
+
+        return len(words) >= len(self._matcher) * (1 - self._config['MAX_SHRINK'])
+
+    def _check_interval(self):
+        """
+        检查词表的间隔，尚未成功读取过时使用较短的重试间隔
+        :return: 间隔，单位为秒
+        """
+        return self._config['RETRY_INTERVAL'] if self._version is None else self._config['RELOAD_INTERVAL']
+
+    def reload(self, force=False):
+        """
+        词表变化时重新构建自动机，读取成功后才替换
+        :param force: 是否忽略版本强制重新构建
+        :return: 当前自动机
+        """
+
+        with self._lock:
+            # 等待锁期间其他线程已完成检查
+            fresh = time.monotonic() - self._checked_at < self._check_interval()
+            if not force and self._matcher is not None and fresh:
+                return self._matcher
+
+            self._checked_at = time.monotonic()
+
+            try:
+                version = self._get_version()
+                if force or self._matcher is None or version != self._version:
+                    words = self._load_words()
+                    if not self._is_complete(words, version, force):
+                        logger.error('sensitive word list incomplete, %d words read, matcher kept', len(words))
+                    else:
+                        self._matcher = AhoCorasick(words)
+                        self._version = version
+                        logger.info('sensitive word matcher built with %d words', len(self._matcher))
+            except Exception:
+                logger.exception('sensitive word list load failed, matcher kept')
+
+            # 首次读取失败时使用空自动机，版本仍为空，按重试间隔重新读取
+            if self._matcher is None:
+                self._matcher = AhoCorasick([])
+
+            return self._matcher
+
+    def get_matcher(self):
+        """
+        获取当前自动机，超过检查间隔时检查词表是否变化
+        :return: AhoCorasick
+        """
+
+        matcher = self._matcher
+        if matcher is None or time.monotonic() - self._checked_at >= self._check_interval():
+            matcher = self.reload()
+
+        return matcher
+
+    def find_all(self, text):
+        """
+        查找文本中的全部敏感词
+        :param text: 文本
+        :return: [(起始位置, 结束位置（不含）, 词)]
+        """
+        return self.get_matcher().find_all(text)
+
+    def search(self, text):
+        """
+        查找文本中的第一个敏感词
+        :param text: 文本
+        :return: (起始位置, 结束位置（不含）, 词) 或 None
+        """
+        return self.get_matcher().search(text)
+
+
+# 进程内共享的敏感词过滤器
+sensitive_filter = SensitiveWordFilter(SENSITIVE_WORDS)
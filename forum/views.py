@@ -2,9 +2,20 @@ from django.http.response import HttpResponse
 from django import views
 from forum.models import Topic, Comment, TopicMongo, CommentMongo
 from account.models import User, UserMongo
+from account.principal import UserPrincipal
 from account.auth import Auth
+from account.profile import profile_snapshot
+from forum.counters import post_counter
+from forum.votes import vote_ledger, DIGG, DISS
+from forum.sensitive import sensitive_filter
+from forum.feed import topic_feed, InvalidCursor
+from forum.comments import comment_tree, locate
+from LH.dualwrite import dual_write
+from LH.idalloc import id_allocator
+from LH.settings import TOPIC_FEED, COMMENT_TREE
 import json
 import datetime
+import copy
 
 
 class ForumView(views.View):
@@ -19,14 +30,26 @@ class ForumView(views.View):
                   'content_words_error': {'code': 3004, 'msg': '内容含有敏感词'},
                   'post_type_error': {'code': 3005, 'msg': '贴子类型不正确'},
                   'post_id_error': {'code': 3005, 'msg': '贴子ID不正确'},
+                  'vote_done_error': {'code': 3006, 'msg': '不能重复投票'},
+                  'forum_id_error': {'code': 3007, 'msg': '论坛ID不正确'},
+                  'cursor_error': {'code': 3008, 'msg': '分页游标不正确'},
                   'general_error': {'code': 3000, 'msg': '操作失败'}
                   }
 
     # 成功消息定义
     _success_msg = {'code': 0, 'msg': '操作成功'}
 
-    # 敏感词列表
-    _forbidden_words = ['共产党']
+    def _words_error(self, name, matches):
+        """
+        生成含敏感词的错误响应，附带敏感词位置
+        :param name: 错误消息名
+        :param matches: 匹配列表
+        :return: 错误消息
+        """
+
+        result = copy.copy(self._error_msg[name])
+        result['data'] = [{'start': start, 'end': end, 'word': word} for start, end, word in matches]
+        return result
 
     def digg_post(self, request):
         """
@@ -51,55 +74,37 @@ class ForumView(views.View):
             return HttpResponse(json.dumps(self._error_msg['post_id_error']))
 
         # 处理请求
-        if not self._on_digg(post_type, post_id):
-            return HttpResponse(json.dumps(self._error_msg['post_id_error']))
+        error, counts = self._on_vote(post_type, post_id, users[0].id, DIGG)
+        if error:
+            return HttpResponse(json.dumps(self._error_msg[error]))
 
-        # 返回正确响应
-        return HttpResponse(json.dumps(self._success_msg))
-
-    def _on_digg(self, post_type, post_id):
-        """
-        点赞时的数据库处理程序
-        :param post_type: 贴子类型 0为主题，1为评论
-        :param post_id: 贴子ID
-        :return: 失败返回假
-        """
+        # 将数据加入响应结果
+        result = copy.copy(self._success_msg)
+        result['data'] = counts
 
-        return [self._on_digg_mongo(post_type, post_id), self._on_digg_sql(post_type, post_id)] != [None, None]
+        # 返回正确响应
+        return HttpResponse(json.dumps(result))
 
-    def _on_digg_mongo(self, post_type, post_id):
+    def _on_vote(self, post_type, post_id, uid, direction):
         """
-        点赞时的数据库处理程序,mongo后端
+        投票时的数据库处理程序，由投票账本确认贴子存在并拒绝重复投票，计数增量由计数器合并后批量写入两个后端
         :param post_type: 贴子类型 0为主题，1为评论
         :param post_id: 贴子ID
-        :return: 失败返回None
+        :param uid: 用户ID
+        :param direction: 投票方向，DIGG或DISS
+        :return: (错误消息名, 投票后的计数字典)，成功时错误消息名为None
         """
 
         assert post_type in [0, 1] and post_id > 0
 
-        if post_type == 0:
-            result = TopicMongo.objects(id=post_id).update(inc__digg_num=1)
-        else:
-            result = CommentMongo.objects(id=post_id).update(inc__digg_num=1)
+        voted = vote_ledger.vote(post_type, post_id, uid, direction)
+        if voted is None:
+            return 'post_id_error', None
 
-        return result
+        if not voted:
+            return 'vote_done_error', None
 
-    def _on_digg_sql(self, post_type, post_id):
-        """
-        点赞时的数据库处理程序,sql后端
-        :param post_type: 贴子类型 0为主题，1为评论
-        :param post_id: 贴子ID
-        :return: 失败返回None
-        """
-
-        assert post_type in [0, 1] and post_id > 0
-
-        if post_type == 0:
-            result = Topic.objects.filter(id=post_id).update(inc__digg_num=1)
-        else:
-            result = Comment.objects.filter(id=post_id).update(inc__digg_num=1)
-
-        return result
+        return None, post_counter.get_many(post_type, post_id, cached=True)
 
     def diss_post(self, request):
         """
@@ -124,55 +129,75 @@ class ForumView(views.View):
             return HttpResponse(json.dumps(self._error_msg['post_id_error']))
 
         # 处理请求
-        if not self._on_diss(post_type, post_id):
-            return HttpResponse(json.dumps(self._error_msg['post_id_error']))
+        error, counts = self._on_vote(post_type, post_id, users[0].id, DISS)
+        if error:
+            return HttpResponse(json.dumps(self._error_msg[error]))
+
+        # 将数据加入响应结果
+        result = copy.copy(self._success_msg)
+        result['data'] = counts
 
         # 返回正确响应
-        return HttpResponse(json.dumps(self._success_msg))
+        return HttpResponse(json.dumps(result))
 
-    def _on_diss(self, post_type, post_id):
+    def get_topics(self, request):
         """
-        踩贴时的数据库处理程序
-        :param post_type: 贴子类型 0为主题，1为评论
-        :param post_id: 贴子ID
-        :return: 失败返回假
+        获取主题列表，按发布时间倒序，使用上一页返回的游标翻页
+        :param request: 请求
+        :return: json格式数据
         """
 
-        return [self._on_diss_mongo(post_type, post_id), self._on_diss_sql(post_type, post_id)] != [None, None]
+        # 获取参数
+        forum_id = request.GET.get('forum', '')
+        cursor = request.GET.get('cursor', '') or None
+        num = request.GET.get('num', str(TOPIC_FEED['PAGE_SIZE']))
 
-    def _on_diss_mongo(self, post_type, post_id):
-        """
-        踩贴时的数据库处理程序,mongo后端
-        :param post_type: 贴子类型 0为主题，1为评论
-        :param post_id: 贴子ID
-        :return: 失败返回None
-        """
+        if forum_id != '' and not forum_id.isdigit():
+            return HttpResponse(json.dumps(self._error_msg['forum_id_error']))
 
-        assert post_type in [0, 1] and post_id > 0
+        if not num.isdigit() or not 0 < int(num) <= TOPIC_FEED['MAX_PAGE_SIZE']:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
 
-        if post_type == 0:
-            result = TopicMongo.objects(id=post_id).update(dec__digg_num=1)
-        else:
-            result = CommentMongo.objects(id=post_id).update(dec__digg_num=1)
+        # 处理请求
+        try:
+            body = topic_feed.get_page(int(forum_id) if forum_id else None, cursor, int(num), self._success_msg)
+        except InvalidCursor:
+            return HttpResponse(json.dumps(self._error_msg['cursor_error']))
 
-        return result
+        # 返回正确响应
+        return HttpResponse(body, content_type='application/json')
 
-    def _on_diss_sql(self, post_type, post_id):
+    def get_comments(self, request):
         """
-        踩贴时的数据库处理程序,sql后端
-        :param post_type: 贴子类型 0为主题，1为评论
-        :param post_id: 贴子ID
-        :return: 失败返回None
+        获取主题的评论树，顶层评论按ID分页；使用上一页返回的游标翻页，或使用评论返回的游标加载其余回复
+        :param request: 请求
+        :return: json格式数据
         """
 
-        assert post_type in [0, 1] and post_id > 0
+        # 获取参数
+        topic_id = request.GET.get('topic', '')
+        cursor = request.GET.get('cursor', '') or None
+        num = request.GET.get('num', str(COMMENT_TREE['PAGE_SIZE']))
 
-        if post_type == 0:
-            result = Topic.objects.filter(id=post_id).update(dec__digg_num=1)
-        else:
-            result = Comment.objects.filter(id=post_id).update(dec__digg_num=1)
+        if cursor is None and (not topic_id.isdigit() or int(topic_id) <= 0):
+            return HttpResponse(json.dumps(self._error_msg['post_id_error']))
 
-        return result
+        if not num.isdigit() or not 0 < int(num) <= COMMENT_TREE['MAX_PAGE_SIZE']:
+            return HttpResponse(json.dumps(self._error_msg['general_error']))
+
+        # 处理请求
+        try:
+            comments, next_cursor = comment_tree.get_page(int(topic_id) if topic_id.isdigit() else 0, int(num),
+                                                          cursor)
+        except InvalidCursor:
+            return HttpResponse(json.dumps(self._error_msg['cursor_error']))
+
+        # 将数据加入响应结果
+        result = copy.copy(self._success_msg)
+        result['data'] = {'comments': comments, 'next': next_cursor}
+
+        # 返回正确响应
+        return HttpResponse(json.dumps(result))
 
     def publish_topic(self, request):
         """
@@ -189,72 +214,100 @@ class ForumView(views.View):
         # 获取参数
         title = request.POST.get('title', '')
         content = request.POST.get('content', '')
+        forum_id = request.POST.get('forum', '0')
+
+        if not forum_id.isdigit():
+            return HttpResponse(json.dumps(self._error_msg['forum_id_error']))
+
+        forum_id = int(forum_id)
 
         # 验证标题
         if len(title) > 50:
             return HttpResponse(json.dumps(self._error_msg['title_len_error']))
 
-        for w in self._forbidden_words:
-            if title.find(w) >= 0:
-                return HttpResponse(json.dumps(self._error_msg['title_words_error']))
+        matches = sensitive_filter.find_all(title)
+        if matches:
+            return HttpResponse(json.dumps(self._words_error('title_words_error', matches)))
 
         # 验证内容
         if len(content) > 10000:
             return HttpResponse(json.dumps(self._error_msg['content_len_error']))
 
-        for w in self._forbidden_words:
-            if content.find(w) >= 0:
-                return HttpResponse(json.dumps(self._error_msg['content_words_error']))
+        matches = sensitive_filter.find_all(content)
+        if matches:
+            return HttpResponse(json.dumps(self._words_error('content_words_error', matches)))
 
         # 处理请求
-        if not self._on_publish_topic(title, content, users):
+        if not self._on_publish_topic(title, content, forum_id, users):
             return HttpResponse(json.dumps(self._error_msg['general_error']))
 
+        topic_feed.touch()
+
         # 返回正确响应
         return HttpResponse(json.dumps(self._success_msg))
 
-    def _on_publish_topic(self, title, content, users):
+    def _on_publish_topic(self, title, content, forum_id, users):
         """
         发表主题时的数据库处理程序
         :param title: 标题
         :param content: 内容
+        :param forum_id: 论坛ID，0为不属于任何论坛
         :param users: 已验证的用户对象
         :return: 成功返回真，失败返回假
         """
 
-        return [self._on_publish_topic_mongo(title, content, users),
-                self._on_publish_topic_sql(title, content, users)] != [False, False]
+        # 两个后端使用同一ID和发布时间，发布时间截断到mongo支持的毫秒精度，保证分页游标在两个后端一致
+        topic_id = id_allocator.next_id('topic')
+        now = datetime.datetime.now()
+        publish_time = now.replace(microsecond=now.microsecond // 1000 * 1000)
 
-    def _on_publish_topic_mongo(self, title, content, users):
+        return dual_write.run(
+            lambda: self._on_publish_topic_mongo(topic_id, title, content, forum_id, publish_time, users),
+            lambda: self._on_publish_topic_sql(topic_id, title, content, forum_id, publish_time, users),
+            failure=False,
+            replay=lambda: ('forum.publish_topic',
+                            [topic_id, title, content, forum_id, publish_time, users[1].id])) != [False, False]
+
+    def _on_publish_topic_mongo(self, topic_id, title, content, forum_id, publish_time, users):
         """
         发表主题时的数据库处理程序，mongo后端
+        :param topic_id: 主题ID
         :param title: 标题
         :param content: 内容
+        :param forum_id: 论坛ID，0为不属于任何论坛
+        :param publish_time: 发布时间
         :param users: 已验证的用户对象
         :return: 成功返回真，失败返回假
         """
 
-        assert title != '' and content != '' and len(users) >= 1 and isinstance(users[0], UserMongo)
+        assert title != '' and content != '' and len(users) >= 1 and isinstance(users[0], UserPrincipal)
 
-        new_topic = TopicMongo(title=title, content=content, author=users[0])
+        new_topic = TopicMongo(id=topic_id, title=title, content=content, user=users[0].to_dbref(),
+                               forum_id=forum_id, publish_time=publish_time)
         new_topic.save()
 
         result = UserMongo.objects(id=users[0].id).update(push__topics=new_topic,
-                                                          inc__topic_num=1)
+                                                          inc__topic_num=1, inc__profile_version=1)
+        profile_snapshot.touch(users[0].id)
+
         return result is not None
 
-    def _on_publish_topic_sql(self, title, content, users):
+    def _on_publish_topic_sql(self, topic_id, title, content, forum_id, publish_time, users):
         """
         发表主题时的数据库处理程序，sql后端
+        :param topic_id: 主题ID
         :param title: 标题
         :param content: 内容
+        :param forum_id: 论坛ID，0为不属于任何论坛
+        :param publish_time: 发布时间
         :param users: 已验证的用户对象
         :return: 成功返回真，失败返回假
         """
 
         assert title != '' and content != '' and len(users) > 1 and isinstance(users[1], User)
 
-        new_topic = Topic(title=title, content=content, author=users[1])
+        new_topic = Topic(id=topic_id, title=title, content=content, author=users[1],
+                          forum_id=forum_id or None, publish_time=publish_time)
         new_topic.save()
 
         result = User.objects.filter(id=users[1].id).update(inc__topic_num=1)
@@ -285,9 +338,9 @@ class ForumView(views.View):
         if len(content) > 10000:
             return HttpResponse(json.dumps(self._error_msg['content_len_error']))
 
-        for w in self._forbidden_words:
-            if content.find(w) >= 0:
-                return HttpResponse(json.dumps(self._error_msg['content_words_error']))
+        matches = sensitive_filter.find_all(content)
+        if matches:
+            return HttpResponse(json.dumps(self._words_error('content_words_error', matches)))
 
         # 处理请求
         if not self._on_publish_comment(post_id, post_type, content, users):
@@ -308,12 +361,19 @@ class ForumView(views.View):
 
         assert len(users) >= 2
 
-        return [self._on_publish_comment_mongo(post_id, post_type, content, users[0]),
-                self._on_publish_comment_sql(post_id, post_type, content, users[1])] != [False, False]
+        # 两个后端使用同一ID
+        comment_id = id_allocator.next_id('comment')
 
-    def _on_publish_comment_mongo(self, post_id, post_type, content, user):
+        return dual_write.run(lambda: self._on_publish_comment_mongo(comment_id, post_id, post_type, content, users[0]),
+                              lambda: self._on_publish_comment_sql(comment_id, post_id, post_type, content, users[1]),
+                              failure=False,
+                              replay=lambda: ('forum.publish_comment',
+                                              [comment_id, post_id, post_type, content, users[1].id])) != [False, False]
+
+    def _on_publish_comment_mongo(self, comment_id, post_id, post_type, content, user):
         """
         发表评论时的数据库处理程序，mongo后端
+        :param comment_id: 评论ID
          :param post_id: 被评论的贴子ID
         :param post_type: 被评论的评论类型，0为主题，1为评论
         :param content: 内容
@@ -321,7 +381,7 @@ class ForumView(views.View):
         :return: 成功返回真，失败返回假
         """
 
-        assert post_id > 0 and post_type in [0, 1] and content != '' and isinstance(user, UserMongo)
+        assert post_id > 0 and post_type in [0, 1] and content != '' and isinstance(user, UserPrincipal)
 
         if post_type == 0:
             # 评论对象为主题的情形
@@ -330,7 +390,9 @@ class ForumView(views.View):
             if not topic:
                 return False
 
-            new_comment = CommentMongo(content=content, user=user, topic=topic, time=datetime.datetime.now)
+            new_comment = CommentMongo(id=comment_id, content=content, user=user.to_dbref(), topic=topic,
+                                       root=topic.id, path=[], depth=0, thread=comment_id,
+                                       time=datetime.datetime.now)
             new_comment.save()
 
             result = topic.update(push__comments=new_comment, inc__comment_num=1)
@@ -341,17 +403,26 @@ class ForumView(views.View):
             if not comment:
                 return False
 
-            new_comment = CommentMongo(content=content, user=user, type=1, comment=comment,
-                                       time=datetime.datetime.now)
+            # 继承父评论的祖先路径，整个主题的评论树可由一次查询取出；
+            # 父评论的位置无法推导时留空，由backfill_comment_paths命令补写
+            position = locate(comment)
+            if position:
+                root, path, depth, thread = position[0], position[1] + [comment.id], position[2] + 1, position[3]
+            else:
+                root, path, depth, thread = None, [], 0, None
+
+            new_comment = CommentMongo(id=comment_id, content=content, user=user.to_dbref(), type=1, comment=comment,
+                                       root=root, path=path, depth=depth, thread=thread, time=datetime.datetime.now)
             new_comment.save()
 
             result = comment.update(inc__comment_num=1)
 
         return result is not None
 
-    def _on_publish_comment_sql(self, post_id, post_type, content, user):
+    def _on_publish_comment_sql(self, comment_id, post_id, post_type, content, user):
         """
         发表评论时的数据库处理程序，sql后端
+        :param comment_id: 评论ID
          :param post_id: 被评论的贴子ID
         :param post_type: 评论类型，0为主题，1为评论
         :param content: 内容
@@ -368,7 +439,7 @@ class ForumView(views.View):
             if not topic:
                 return False
 
-            new_comment = Comment(content=content, user=user, tid=topic.id, time=datetime.datetime.now)
+            new_comment = Comment(id=comment_id, content=content, user=user, tid=topic.id, time=datetime.datetime.now)
             new_comment.save()
 
             result = topic.update(inc__comment_num=1)
@@ -379,7 +450,7 @@ class ForumView(views.View):
             if not comment:
                 return False
 
-            new_comment = Comment(content=content, user=user, type=1, cid=comment.id,
+            new_comment = Comment(id=comment_id, content=content, user=user, type=1, cid=comment.id,
                                   time=datetime.datetime.now)
             new_comment.save()
 
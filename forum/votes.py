@@ -0,0 +1,208 @@
+"""
+投票账本，记录每个用户对每个贴子的投票方向，防止重复投票
+"""
+
+from array import array
+from bisect import bisect_left
+from concurrent.futures import Future
+from mongoengine import *
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from forum.counters import post_counter, FIELDS as COUNTER_FIELDS, get_post_document
+from LH.cache import LRUCache
+from LH.settings import VOTE_LEDGER
+import datetime
+import threading
+
+# 投票方向 -> 计数字段
+DIGG = 1
+DISS = -1
+FIELDS = {DIGG: 'digg_num', DISS: 'diss_num'}
+
+
+class VoteMongo(Document):
+    """
+    投票MongoDB数据模型，每个用户对每个贴子只有一条记录，各字段说明如下：
+
+      post_type: 贴子类型，0为主题，1为评论，整型
+      post_id: 贴子ID，整型
+      uid: 用户ID，整型
+      direction: 投票方向，1为赞，-1为踩，整型
+      time: 投票时间，日期型
+    """
+
+    # 字段声明
+
+    post_type = IntField(required=True)
+    post_id = IntField(required=True)
+    uid = IntField(required=True)
+    direction = IntField(required=True, choices=(DIGG, DISS))
+    time = DateTimeField(default=datetime.datetime.now)
+
+    # 元数据：指定集合和索引
+    meta = {'collection': 'vote',
+            'indexes': [{'fields': ['post_type', 'post_id', 'uid'], 'unique': True}]}
+
+
+class PostVotes(object):
+    """
+    单个贴子的投票集合，赞和踩各用一个有序整型数组保存用户ID
+    """
+
+    __slots__ = ('_uids',)
+
+    def __init__(self, votes=()):
+        """
+        初始化
+        :param votes: (用户ID, 投票方向)序列
+        """
+
+        self._uids = {DIGG: array('q'), DISS: array('q')}
+        for uid, direction in sorted(votes):
+            self._uids[direction].append(uid)
+
+    def _contains(self, uids, uid):
+        i = bisect_left(uids, uid)
+        return i < len(uids) and uids[i] == uid
+
+    def direction_of(self, uid):
+        """
+        查询用户的投票方向
+        :param uid: 用户ID
+        :return: 投票方向，未投票返回None
+        """
+
+        for direction, uids in self._uids.items():
+            if self._contains(uids, uid):
+                return direction
+        return None
+
+    def set(self, uid, direction):
+        """
+        记录用户的投票方向，已有的其他方向的投票被移除
+        :param uid: 用户ID
+        :param direction: 投票方向
+        :return:
+        """
+
+        for d, uids in self._uids.items():
+            i = bisect_left(uids, uid)
+            present = i < len(uids) and uids[i] == uid
+            if d == direction and not present:
+                uids.insert(i, uid)
+            elif d != direction and present:
+                del uids[i]
+
+
+class VoteLedger(object):
+    """
+    投票账本，热点贴子的投票集合缓存在内存中，加载时确认贴子存在；
+    已加载的贴子以内存中的投票集合为准，重复投票无需访问数据库即可拒绝，
+    其他进程的并发投票由唯一索引兜底，同一用户对同一贴子只有一条记录
+    """
+
+    def __init__(self, config):
+        """
+        初始化
+        :param config: 配置，格式同settings.VOTE_LEDGER
+        """
+
+        self._posts = LRUCache(config['CACHE_SIZE'], config['CACHE_TTL'])
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _load_post(self, post_type, post_id):
+        """
+        从数据库加载贴子的投票集合
+        :param post_type: 贴子类型
+        :param post_id: 贴子ID
+        :return: PostVotes，贴子不存在返回None
+        """
+
+        if get_post_document(post_type, post_id, COUNTER_FIELDS) is None:
+            return None
+
+        cursor = VoteMongo.objects(post_type=post_type, post_id=post_id).only('uid', 'direction').as_pymongo()
+        votes = PostVotes((v['uid'], v['direction']) for v in cursor)
+        self._posts.set((post_type, post_id), votes)
+
+        return votes
+
+    def _get_post(self, post_type, post_id):
+        """
+        获取贴子的投票集合，未缓存时从数据库加载，同一贴子的并发加载只执行一次
+        :param post_type: 贴子类型
+        :param post_id: 贴子ID
+        :return: PostVotes，贴子不存在返回None
+        """
+
+        key = (post_type, post_id)
+        votes = self._posts.get(key)
+        if votes is not None:
+            return votes
+
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._load_post(post_type, post_id))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+        return future.result()
+
+    def vote(self, post_type, post_id, uid, direction):
+        """
+        投票，改变投票方向时同时调整赞数和踩数
+        :param post_type: 贴子类型
+        :param post_id: 贴子ID
+        :param uid: 用户ID
+        :param direction: 投票方向
+        :return: 成功返回真，重复投票返回假，贴子不存在返回None
+        """
+
+        assert direction in FIELDS
+
+        votes = self._get_post(post_type, post_id)
+        if votes is None:
+            return None
+
+        with self._lock:
+            if votes.direction_of(uid) == direction:
+                return False
+
+        # 唯一索引兜底其他进程的并发投票：已有相同方向的记录时upsert因键冲突失败
+        try:
+            previous = VoteMongo._get_collection().find_one_and_update(
+                {'post_type': post_type, 'post_id': post_id, 'uid': uid, 'direction': {'$ne': direction}},
+                {'$set': {'direction': direction, 'time': datetime.datetime.now()}},
+                upsert=True, projection={'direction': 1}, return_document=ReturnDocument.BEFORE)
+        except DuplicateKeyError:
+            with self._lock:
+                votes.set(uid, direction)
+            return False
+
+        deltas = {FIELDS[direction]: 1}
+        if previous is not None:
+            deltas[FIELDS[previous['direction']]] = -1
+
+        # 两个计数的增量在同一次刷新中写入
+        post_counter.apply(post_type, post_id, deltas)
+
+        with self._lock:
+            votes.set(uid, direction)
+
+        return True
+
+
+# 进程内共享的投票账本
+vote_ledger = VoteLedger(VOTE_LEDGER)
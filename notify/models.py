@@ -4,7 +4,7 @@ from django.db import models
 import datetime
 
 
-class NotifyMongo(EmbeddedDocument):
+class NotifyMongo(Document):
     """
     通知MongoDB数据模型，各字段说明如下：
 
@@ -20,7 +20,7 @@ class NotifyMongo(EmbeddedDocument):
 
     # 字段声明
 
-    id = IntField(required=True)
+    id = IntField(unique=True, required=True)
     event = StringField(max_length=20, required=True)
     to = IntField(required=True)
     title = StringField(max_length=50, required=True)
@@ -30,7 +30,7 @@ class NotifyMongo(EmbeddedDocument):
     time = DateTimeField(required=True)
 
     # 元数据：指定集合和索引
-    meta = {'collection': 'notify', 'indexes': ['-time']}
+    meta = {'collection': 'notify', 'indexes': [('to', 'status', '-time')]}
 
     def __str__(self):
         """
@@ -0,0 +1,9 @@
+"""
+通知视图使用的查询形状
+"""
+
+from notify.models import NotifyMongo
+from LH.indexaudit import register
+
+register(NotifyMongo, {'id': 1, 'to': 1})
+register(NotifyMongo, {'to': 1, 'status': 0}, sort=[('time', -1)])
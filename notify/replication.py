@@ -0,0 +1,11 @@
+"""
+通知变更在sql后端的重放处理程序
+"""
+
+from notify.views import NotifyView
+from LH.outbox import replicated
+
+
+@replicated('notify.read')
+def read(uid, nid):
+    return NotifyView()._on_read_notify_sql(uid, nid)
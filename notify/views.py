@@ -3,6 +3,7 @@ from django import views
 from account.auth import Auth
 from account.models import User, UserMongo
 from notify.models import Notify,NotifyMongo
+from LH.dualwrite import dual_write
 import json
 import datetime
 
@@ -92,8 +93,10 @@ class NotifyView(views.View):
         :return: 成功返回真，失败返回假
         """
 
-        return [self._on_read_notify_mongo(uid,nid),
-                self._on_read_notify_sql(uid,nid)] != [False, False]
+        return dual_write.run(lambda: self._on_read_notify_mongo(uid, nid),
+                              lambda: self._on_read_notify_sql(uid, nid),
+                              failure=False,
+                              replay=('notify.read', [uid, nid])) != [False, False]
 
     def _on_read_notify_mongo(self, uid, nid):
         """